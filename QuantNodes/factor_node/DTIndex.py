@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""时点标尺的位置索引"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+_CACHE_SIZE = 8  # 缓存的时点标尺个数
+
+_Cache = OrderedDict()  # {id(时点标尺): DTIndex}
+_CacheLock = threading.Lock()  # 计算进程内的多个线程同时准备因子时保护 _Cache
+
+
+# 时点标尺的位置索引, 以字典查找代替 list.index 的线性查找
+# dt_ruler: [时点], 升序排列, 索引持有时点标尺的引用, 标尺对象被重新赋值或者长度改变后索引失效
+class DTIndex(object):
+    def __init__(self, dt_ruler):
+        self.DTRuler = dt_ruler
+        self._Len = len(dt_ruler)
+        self._Pos = {iDT: i for i, iDT in enumerate(dt_ruler)}
+        self._Values = None  # array(dtype=datetime64[us]), 在需要时生成
+
+    def isValid(self, dt_ruler):
+        return (self.DTRuler is dt_ruler) and (self._Len == len(dt_ruler))
+
+    def __len__(self):
+        return self._Len
+
+    def __contains__(self, dt):
+        return dt in self._Pos
+
+    # 时点的位置, 与 list.index 一致, 不存在时触发 ValueError
+    def index(self, dt):
+        try:
+            return self._Pos[dt]
+        except KeyError:
+            raise ValueError("%s is not in list" % (dt,))
+
+    # 时点序列的位置, 返回: array(dtype=int), 不存在的时点为 -1
+    def getIndexer(self, dts):
+        Pos = self._Pos
+        return np.fromiter((Pos.get(iDT, -1) for iDT in dts), dtype=np.int64, count=len(dts))
+
+    # 时点序列在标尺中的插入位置, 时点可以不在标尺中
+    def searchsorted(self, dts, side="left"):
+        if self._Values is None: self._Values = np.array(self.DTRuler, dtype="datetime64[us]")
+        return self._Values.searchsorted(np.array(dts, dtype="datetime64[us]"), side=side)
+
+
+# 获取时点标尺的位置索引, 同一个标尺对象共享同一个索引, 线程安全
+def getDTIndex(dt_ruler):
+    Key = id(dt_ruler)
+    with _CacheLock:
+        Index = _Cache.get(Key, None)
+        if (Index is not None) and Index.isValid(dt_ruler):
+            _Cache.move_to_end(Key)
+            return Index
+        Index = _Cache[Key] = DTIndex(dt_ruler)
+        _Cache.move_to_end(Key)
+        while len(_Cache) > _CACHE_SIZE: _Cache.popitem(last=False)
+        return Index
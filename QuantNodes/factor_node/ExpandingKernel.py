@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""扩张窗口和指数加权运算的递推计算"""
+import numpy as np
+
+# 以下函数的 data 为 array(shape=(nDT, ...)), 沿第 0 维递推, 返回: (结果, 状态), 结果与 data 的形状相同
+# 状态为 {名称: array(shape=data.shape[1:])}, 记录了已处理的所有时点的信息, 将状态传入下一段数据的计算即可接续, 结果与一次计算全部数据相同
+# state 为 None 表示从头开始计算
+EXPANDING_STATS = ("count", "sum", "mean", "var", "std", "skew", "kurt", "max", "min")
+EWM_STATS = ("mean", "var", "std", "cov", "corr")
+
+
+def _as2D(data):
+    Data = np.asarray(data, dtype=np.float64)
+    return Data.reshape((Data.shape[0], -1)), Data.shape
+
+
+def _restore(rslt, shape):
+    return rslt.reshape((rslt.shape[0],) + shape[1:])
+
+
+def _initState(names, n):
+    return {iName: np.zeros(n) for iName in names}
+
+
+# 展开状态为二维数组的形式, 以便与数据的列对应
+def _flattenState(state, names, n):
+    if state is None: return _initState(names, n)
+    return {iName: np.array(state[iName], dtype=np.float64).reshape(-1) for iName in names}
+
+
+def _reshapeState(state, shape):
+    return {iName: iVal.reshape(shape[1:]) for iName, iVal in state.items()}
+
+
+# 逐时点更新计数, 均值以及 2 至 4 阶中心矩之和, 同时计算结果, order: 需要的最高阶矩
+def _updateMoments(data, state, order, fun):
+    Rslt = np.full(data.shape, np.nan)
+    Count, Mean = state["Count"], state["Mean"]
+    M2, M3, M4 = state.get("M2"), state.get("M3"), state.get("M4")
+    for t in range(data.shape[0]):
+        x = data[t]
+        Mask = ~np.isnan(x)
+        n1 = Count.copy()
+        Count += Mask
+        n = np.maximum(Count, 1)
+        Delta = np.where(Mask, x - Mean, 0)
+        DeltaN = Delta / n
+        Term1 = Delta * DeltaN * n1
+        if order >= 4:
+            M4 += Term1 * DeltaN ** 2 * (n * n - 3 * n + 3) + 6 * DeltaN ** 2 * M2 - 4 * DeltaN * M3
+        if order >= 3:
+            M3 += Term1 * DeltaN * (n - 2) - 3 * DeltaN * M2
+        if order >= 2:
+            M2 += Term1
+        Mean += DeltaN
+        Rslt[t] = fun(Count, Mean, M2, M3, M4)
+    return Rslt
+
+
+def _skew(n, m2, m3):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt = np.sqrt(n * (n - 1)) / (n - 2) * (m3 / n) / (m2 / n) ** 1.5
+    Rslt[(n < 3) | (m2 / np.maximum(n, 1) <= 1e-14)] = np.nan
+    return Rslt
+
+
+def _kurt(n, m2, m4):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt = (n + 1) * n * (n - 1) / ((n - 2) * (n - 3)) * m4 / m2 ** 2 - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+    Rslt[(n < 4) | (m2 / np.maximum(n, 1) <= 1e-14)] = np.nan
+    return Rslt
+
+
+# 扩张窗口统计量, how: count, sum, mean, var, std, skew, kurt, max, min, 有效数据个数少于 min_periods 的结果为 nan
+def expanding(data, how="mean", state=None, min_periods=1, ddof=1):
+    Data, Shape = _as2D(data)
+    nCol = Data.shape[1]
+    Mask = ~np.isnan(Data)
+    if how in ("count", "sum", "max", "min"):
+        State = _flattenState(state, ("nRow", "Count", "Sum", "Max", "Min"), nCol)
+        if state is None: State["Max"][:], State["Min"][:] = np.nan, np.nan
+        Count = State["Count"] + np.cumsum(Mask, axis=0)
+        if how == "count":  # 与 pandas 一致, count 的 min_periods 针对时点数而非有效数据个数
+            Rslt = Count.copy()
+            Rslt[State["nRow"] + np.arange(1, Data.shape[0] + 1).reshape((-1, 1)) < min_periods] = np.nan
+            Count = np.full(Count.shape, np.inf)
+        elif how == "sum":
+            Rslt = State["Sum"] + np.cumsum(np.where(Mask, Data, 0), axis=0)
+        elif how == "max":
+            Rslt = np.fmax(State["Max"], np.fmax.accumulate(Data, axis=0))
+        else:
+            Rslt = np.fmin(State["Min"], np.fmin.accumulate(Data, axis=0))
+        if Data.shape[0] > 0:
+            State["nRow"] = State["nRow"] + Data.shape[0]
+            State["Count"] = State["Count"] + np.sum(Mask, axis=0)
+            State["Sum"] = State["Sum"] + np.sum(np.where(Mask, Data, 0), axis=0)
+            State["Max"] = np.fmax(State["Max"], np.nanmax(np.where(Mask, Data, -np.inf), axis=0))
+            State["Max"][np.isinf(State["Max"]) & (State["Count"] == 0)] = np.nan
+            State["Min"] = np.fmin(State["Min"], np.nanmin(np.where(Mask, Data, np.inf), axis=0))
+            State["Min"][np.isinf(State["Min"]) & (State["Count"] == 0)] = np.nan
+    else:
+        Order = {"mean": 1, "var": 2, "std": 2, "skew": 3, "kurt": 4}.get(how)
+        if Order is None:
+            from QuantStudio import __QS_Error__
+            raise __QS_Error__("尚不支持的扩张窗口统计量: %s" % how)
+        State = _flattenState(state, ("Count", "Mean", "M2", "M3", "M4")[:Order + 1], nCol)
+        if how == "mean":
+            Fun = (lambda n, mean, m2, m3, m4: np.where(n > 0, mean, np.nan))
+        elif how in ("var", "std"):
+            def Fun(n, mean, m2, m3, m4):
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    Var = np.maximum(m2, 0) / (n - ddof)
+                Var[n <= ddof] = np.nan
+                return (Var if how == "var" else np.sqrt(Var))
+        elif how == "skew":
+            Fun = (lambda n, mean, m2, m3, m4: _skew(n, m2, m3))
+        else:
+            Fun = (lambda n, mean, m2, m3, m4: _kurt(n, m2, m4))
+        Rslt = _updateMoments(Data, State, Order, Fun)
+        Count = State["Count"] - np.cumsum(Mask[::-1], axis=0)[::-1] + Mask  # 各时点的有效数据个数
+    Rslt = np.asarray(Rslt, dtype=np.float64)
+    Rslt[Count < max(min_periods, 1)] = np.nan
+    return _restore(Rslt, Shape), _reshapeState(State, Shape)
+
+
+# 扩张窗口协方差和相关系数, how: cov, corr, 只使用两者均有效的数据, 状态为计数, 均值以及离差交叉乘积之和
+def expandingCov(data1, data2, how="cov", state=None, min_periods=1, ddof=1):
+    Data1, Shape = _as2D(data1)
+    Data2 = _as2D(data2)[0]
+    State = _flattenState(state, ("Count", "MeanX", "MeanY", "Cxy", "Cxx", "Cyy"), Data1.shape[1])
+    Count, MeanX, MeanY, Cxy, Cxx, Cyy = (State[iName] for iName in ("Count", "MeanX", "MeanY", "Cxy", "Cxx", "Cyy"))
+    Rslt = np.full(Data1.shape, np.nan)
+    for t in range(Data1.shape[0]):
+        Mask = ~(np.isnan(Data1[t]) | np.isnan(Data2[t]))
+        Count += Mask
+        n = np.maximum(Count, 1)
+        DeltaX, DeltaY = np.where(Mask, Data1[t] - MeanX, 0), np.where(Mask, Data2[t] - MeanY, 0)
+        MeanX += DeltaX / n
+        MeanY += DeltaY / n
+        Cxy += DeltaX * np.where(Mask, Data2[t] - MeanY, 0)
+        Cxx += DeltaX * np.where(Mask, Data1[t] - MeanX, 0)
+        Cyy += DeltaY * np.where(Mask, Data2[t] - MeanY, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if how == "cov":
+                iRslt = np.where(Count > ddof, Cxy / (Count - ddof), np.nan)
+            else:
+                iRslt = np.where((Cxx / n > 1e-14) & (Cyy / n > 1e-14), Cxy / np.sqrt(Cxx * Cyy), np.nan)
+        iRslt[Count < max(min_periods, 1)] = np.nan
+        Rslt[t] = iRslt
+    return _restore(Rslt, Shape), _reshapeState(State, Shape)
+
+
+# 由 com, span, halflife, alpha 之一计算指数加权的 alpha, 与 pandas.DataFrame.ewm 一致
+def genEWMAlpha(com=None, span=None, halflife=None, alpha=None):
+    if com is not None: return 1 / (1 + com)
+    elif span is not None: return 2 / (span + 1)
+    elif halflife is not None: return 1 - np.exp(np.log(0.5) / halflife)
+    elif alpha is not None: return alpha
+    from QuantStudio import __QS_Error__
+    raise __QS_Error__("com, span, halflife, alpha 必须指定其中之一!")
+
+
+# 指数加权均值, 与 pandas 的递推一致: 状态为当前的加权均值, 历史权重和以及有效数据个数
+def _ewmMean(data, alpha, state, adjust, ignore_na):
+    OldWtFactor, NewWt = 1 - alpha, (1.0 if adjust else alpha)
+    Weighted, OldWt, nObs = state["Weighted"], state["OldWt"], state["nObs"]
+    Rslt, Count = np.full(data.shape, np.nan), np.zeros(data.shape)
+    for t in range(data.shape[0]):
+        x = data[t]
+        IsObs = ~np.isnan(x)
+        nObs += IsObs
+        Started = ~np.isnan(Weighted)
+        Decay = Started & (IsObs | (not ignore_na))
+        OldWt[Decay] *= OldWtFactor
+        Update = Started & IsObs
+        with np.errstate(invalid="ignore"):
+            Weighted[Update] = np.where(Weighted[Update] != x[Update],
+                                        (OldWt[Update] * Weighted[Update] + NewWt * x[Update]) / (OldWt[Update] + NewWt), Weighted[Update])
+        OldWt[Update] = (OldWt[Update] + NewWt if adjust else 1.0)
+        Start = (~Started) & IsObs
+        Weighted[Start] = x[Start]
+        Rslt[t], Count[t] = Weighted, nObs
+    return Rslt, Count
+
+
+# 指数加权协方差, 与 pandas 的 ewmcov 一致
+def _ewmCov(x_data, y_data, alpha, state, adjust, ignore_na, bias):
+    OldWtFactor, NewWt = 1 - alpha, (1.0 if adjust else alpha)
+    MeanX, MeanY, Cov = state["MeanX"], state["MeanY"], state["Cov"]
+    SumWt, SumWt2, OldWt, nObs = state["SumWt"], state["SumWt2"], state["OldWt"], state["nObs"]
+    Rslt, Count = np.full(x_data.shape, np.nan), np.zeros(x_data.shape)
+    for t in range(x_data.shape[0]):
+        x, y = x_data[t], y_data[t]
+        IsObs = ~(np.isnan(x) | np.isnan(y))
+        nObs += IsObs
+        Started = ~np.isnan(MeanX)
+        Decay = Started & (IsObs | (not ignore_na))
+        SumWt[Decay] *= OldWtFactor
+        SumWt2[Decay] *= OldWtFactor ** 2
+        OldWt[Decay] *= OldWtFactor
+        Update = Started & IsObs
+        if Update.any():
+            ix, iy, iOldWt = x[Update], y[Update], OldWt[Update]
+            OldMeanX, OldMeanY = MeanX[Update], MeanY[Update]
+            NewMeanX = np.where(OldMeanX != ix, (iOldWt * OldMeanX + NewWt * ix) / (iOldWt + NewWt), OldMeanX)
+            NewMeanY = np.where(OldMeanY != iy, (iOldWt * OldMeanY + NewWt * iy) / (iOldWt + NewWt), OldMeanY)
+            Cov[Update] = (iOldWt * (Cov[Update] + (OldMeanX - NewMeanX) * (OldMeanY - NewMeanY)) +
+                           NewWt * (ix - NewMeanX) * (iy - NewMeanY)) / (iOldWt + NewWt)
+            MeanX[Update], MeanY[Update] = NewMeanX, NewMeanY
+            SumWt[Update] += NewWt
+            SumWt2[Update] += NewWt ** 2
+            OldWt[Update] += NewWt
+            if not adjust:
+                SumWt[Update] /= OldWt[Update]
+                SumWt2[Update] /= OldWt[Update] ** 2
+                OldWt[Update] = 1.0
+        Start = (~Started) & IsObs
+        MeanX[Start], MeanY[Start] = x[Start], y[Start]
+        if bias:
+            iRslt = Cov.copy()
+        else:
+            Numerator = SumWt * SumWt
+            Denominator = Numerator - SumWt2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                iRslt = np.where(Denominator > 0, Numerator / Denominator * Cov, np.nan)
+        iRslt[np.isnan(MeanX)] = np.nan
+        Rslt[t], Count[t] = iRslt, nObs
+    return Rslt, Count
+
+
+def _initEWMCovState(n):
+    State = {"MeanX": np.full(n, np.nan), "MeanY": np.full(n, np.nan), "Cov": np.zeros(n)}
+    State.update({"SumWt": np.ones(n), "SumWt2": np.ones(n), "OldWt": np.ones(n), "nObs": np.zeros(n)})
+    return State
+
+
+# 指数加权统计量, how: mean, var, std, cov, corr, cov 和 corr 需要 data2, 有效数据个数少于 min_periods 的结果为 nan
+# 状态: mean 为 {"Weighted", "OldWt", "nObs"}; var, std, cov 为协方差递推的状态; corr 为 {"XY_*", "XX_*", "YY_*"} 三组协方差递推的状态
+def ewm(data, alpha, how="mean", state=None, data2=None, min_periods=0, adjust=True, ignore_na=False, bias=False):
+    Data, Shape = _as2D(data)
+    nCol = Data.shape[1]
+    if how == "mean":
+        if state is None:
+            State = {"Weighted": np.full(nCol, np.nan), "OldWt": np.ones(nCol), "nObs": np.zeros(nCol)}
+        else:
+            State = _flattenState(state, ("Weighted", "OldWt", "nObs"), nCol)
+        Rslt, Count = _ewmMean(Data, alpha, State, adjust, ignore_na)
+    elif how in ("var", "std", "cov"):
+        Data2 = (Data if how != "cov" else _as2D(data2)[0])
+        State = (_initEWMCovState(nCol) if state is None else
+                 _flattenState(state, ("MeanX", "MeanY", "Cov", "SumWt", "SumWt2", "OldWt", "nObs"), nCol))
+        Rslt, Count = _ewmCov(Data, Data2, alpha, State, adjust, ignore_na, bias)
+        if how == "std": Rslt = np.sqrt(Rslt)
+    elif how == "corr":
+        Data2 = _as2D(data2)[0]
+        Mask = (np.isnan(Data) | np.isnan(Data2))
+        Data, Data2 = np.where(Mask, np.nan, Data), np.where(Mask, np.nan, Data2)  # 方差只使用两者均有效的数据
+        State = {}
+        Names = ("MeanX", "MeanY", "Cov", "SumWt", "SumWt2", "OldWt", "nObs")
+        Rslts = []
+        for iPrefix, iX, iY in (("XY_", Data, Data2), ("XX_", Data, Data), ("YY_", Data2, Data2)):
+            iState = (_initEWMCovState(nCol) if state is None else
+                      _flattenState({iName: state[iPrefix + iName] for iName in Names}, Names, nCol))
+            Rslts.append(_ewmCov(iX, iY, alpha, iState, adjust, ignore_na, True))
+            State.update({iPrefix + iName: iVal for iName, iVal in iState.items()})
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Rslt = Rslts[0][0] / np.sqrt(Rslts[1][0] * Rslts[2][0])
+        Count = Rslts[0][1]
+    else:
+        from QuantStudio import __QS_Error__
+        raise __QS_Error__("尚不支持的指数加权统计量: %s" % how)
+    Rslt[Count < max(min_periods, 1)] = np.nan
+    return _restore(Rslt, Shape), _reshapeState(State, Shape)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""运算模式下的缓存文件"""
+import os
+import pickle
+import shelve
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node.FactorDType import encodeCategory, isCategoryFrame, fromCodes, toRecordArray, genStdFrame
+
+# 缓存格式
+# shelve: 整体 pickle 存储, 读取时整体反序列化
+# mmap: 列式存储, 数值数据为 float64 等定长类型, 对象数据和 category 类型的数据字典编码为 int32, record 类型的数据为结构化数组,
+#       读取时通过 np.memmap 零拷贝切片
+CACHE_FORMATS = ("mmap", "shelve")
+
+_MMAP_SUFFIX = ".qsc"  # mmap 缓存文件夹的后缀
+_INDEX_FILE = "_QS_Index.pkl"  # mmap 缓存文件夹的索引文件
+
+
+_SHELVE_SUFFIXES = ("", ".db", ".dat")  # 不同 dbm 后端生成的 shelve 文件后缀
+
+
+# 字典编码, 返回: (array(int32), array(object)), 缺失值编码为 -1
+def encodeObjectArray(data):
+    Codes, Categories = pd.factorize(data.ravel())
+    return Codes.astype(np.int32).reshape(data.shape), np.asarray(Categories, dtype="O")
+
+
+# 字典解码, -1 解码为 None
+def decodeObjectArray(codes, categories):
+    Data = np.empty(codes.shape, dtype="O")
+    Mask = (codes >= 0)
+    Data[Mask] = categories[codes[Mask]]
+    return Data
+
+
+def _isUniformFrame(data):
+    if data.shape[1] == 0: return True
+    DTypes = set(data.dtypes)
+    if len(DTypes) != 1: return False
+    DType = DTypes.pop()
+    return isinstance(DType, np.dtype) and (DType.kind in "biufcO")
+
+
+# 将数组写入 .npy 文件, 返回文件名
+def _saveArray(dir_path, slot, data):
+    FileName = slot + ".npy"
+    TmpPath = os.path.join(dir_path, FileName + ".tmp")
+    with open(TmpPath, "wb") as File:
+        np.lib.format.write_array(File, np.ascontiguousarray(data), allow_pickle=False)
+    os.replace(TmpPath, os.path.join(dir_path, FileName))
+    return FileName
+
+
+def _loadArray(dir_path, file_name):
+    FilePath = os.path.join(dir_path, file_name)
+    try:  # copy-on-write 模式, 算子原地修改数据时不会写回文件
+        return np.load(FilePath, mmap_mode="c")
+    except ValueError:  # 空数组不能 mmap
+        return np.load(FilePath)
+
+
+# 基于 np.memmap 的列式缓存文件, 接口与 shelve 保持一致: {键: 值}
+# DataFrame 如果各列类型相同(比如因子数据: index=[时点], columns=[ID]), 按二维数据块存储, 否则按列存储
+# 非 DataFrame 的值按 pickle 存储
+class MMAPCacheFile(object):
+    def __init__(self, file_path, flag="c"):
+        self._DirPath = file_path + _MMAP_SUFFIX
+        self._Flag = flag
+        if flag == "r":
+            if not os.path.isdir(self._DirPath): raise FileNotFoundError(self._DirPath)
+        elif (flag == "n") and os.path.isdir(self._DirPath):
+            for iFile in os.listdir(self._DirPath): os.remove(os.path.join(self._DirPath, iFile))
+        else:
+            os.makedirs(self._DirPath, exist_ok=True)
+        IndexPath = os.path.join(self._DirPath, _INDEX_FILE)
+        if os.path.isfile(IndexPath):
+            with open(IndexPath, "rb") as File:
+                self._Index = pickle.load(File)  # {键: (存储类型, 槽位, 元数据)}
+        else:
+            self._Index = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        self._Index = None
+
+    def keys(self):
+        return self._Index.keys()
+
+    def __contains__(self, key):
+        return key in self._Index
+
+    def __iter__(self):
+        return iter(self._Index)
+
+    def __len__(self):
+        return len(self._Index)
+
+    def get(self, key, default=None):
+        if key not in self._Index: return default
+        return self[key]
+
+    def _saveIndex(self):
+        IndexPath = os.path.join(self._DirPath, _INDEX_FILE)
+        with open(IndexPath + ".tmp", "wb") as File:
+            pickle.dump(self._Index, File)
+        os.replace(IndexPath + ".tmp", IndexPath)
+
+    def _genSlot(self, key):
+        OldInfo = self._Index.get(key)
+        if OldInfo is not None: return OldInfo[1]
+        Slots = {iInfo[1] for iInfo in self._Index.values()}
+        i = len(self._Index)
+        while "s" + str(i) in Slots: i += 1
+        return "s" + str(i)
+
+    def __setitem__(self, key, value):
+        if self._Flag == "r": raise PermissionError("缓存文件 '%s' 为只读!" % self._DirPath)
+        Slot = self._genSlot(key)
+        if isinstance(value, pd.DataFrame) and isCategoryFrame(value):
+            Data, Categories = encodeCategory(value)
+            Meta = {"index": value.index, "columns": value.columns, "categories": np.asarray(Categories, dtype="O"), "category": True}
+            Meta["file"] = _saveArray(self._DirPath, Slot, Data)
+            self._Index[key] = ("block", Slot, Meta)
+        elif isinstance(value, pd.DataFrame) and _isUniformFrame(value):
+            Data = value.values
+            Meta = {"index": value.index, "columns": value.columns}
+            if (Data.dtype == np.dtype("O")) and ("dtype" in value.attrs):
+                Data = toRecordArray(Data, value.attrs["dtype"])
+                Meta["dtype"] = value.attrs["dtype"]
+            elif Data.dtype == np.dtype("O"):
+                Data, Meta["categories"] = encodeObjectArray(Data)
+            Meta["file"] = _saveArray(self._DirPath, Slot, Data)
+            self._Index[key] = ("block", Slot, Meta)
+        elif isinstance(value, pd.DataFrame):
+            Meta = {"index": value.index, "columns": value.columns, "files": [], "categories": {}, "dtypes": {}}
+            for i, iCol in enumerate(value.columns):
+                iData = value.iloc[:, i]
+                iDType = iData.dtype
+                if isinstance(iDType, np.dtype) and (iDType.kind in "biufcmM"):
+                    iData = iData.values
+                else:
+                    iData, Meta["categories"][i] = encodeObjectArray(iData.values.astype("O"))
+                    Meta["dtypes"][i] = iDType
+                Meta["files"].append(_saveArray(self._DirPath, Slot + "_" + str(i), iData))
+            self._Index[key] = ("columns", Slot, Meta)
+        else:
+            FileName = Slot + ".pkl"
+            with open(os.path.join(self._DirPath, FileName), "wb") as File:
+                pickle.dump(value, File)
+            self._Index[key] = ("pickle", Slot, {"file": FileName})
+        self._saveIndex()
+
+    def __getitem__(self, key):
+        Kind, Slot, Meta = self._Index[key]
+        if Kind == "block": return self.readBlock(key)
+        elif Kind == "columns":
+            Data = {}
+            for i, iFileName in enumerate(Meta["files"]):
+                iData = _loadArray(self._DirPath, iFileName)
+                if i in Meta["categories"]:
+                    iData = pd.Series(decodeObjectArray(iData, Meta["categories"][i]))
+                    try:
+                        iData = iData.astype(Meta["dtypes"][i])
+                    except (TypeError, ValueError):
+                        pass
+                Data[i] = iData
+            Data = pd.DataFrame(Data, index=range(len(Meta["index"])))
+            Data.index, Data.columns = Meta["index"], Meta["columns"]
+            return Data
+        with open(os.path.join(self._DirPath, Meta["file"]), "rb") as File:
+            return pickle.load(File)
+
+    # 读取二维数据块, 返回: array, 连续的时点和 ID 切片为 memmap 的视图, 不发生拷贝
+    # record 类型的数据返回结构化数组, decode 为 False 时字典编码的数据返回 int32 编码
+    def readArray(self, key, dts=None, ids=None, decode=True):
+        Kind, Slot, Meta = self._Index[key]
+        if Kind != "block": raise TypeError("缓存数据 '%s' 不是二维数据块!" % key)
+        Data = _loadArray(self._DirPath, Meta["file"])
+        if dts is not None: Data = Data[_genPosition(Meta["index"], dts)]
+        if ids is not None: Data = Data[:, _genPosition(Meta["columns"], ids)]
+        if decode and ("categories" in Meta): Data = decodeObjectArray(Data, Meta["categories"])
+        return Data
+
+    # 读取二维数据块, 返回: DataFrame(index=[时点], columns=[ID])
+    def readBlock(self, key, dts=None, ids=None):
+        Kind, Slot, Meta = self._Index[key]
+        try:
+            Data = self.readArray(key, dts=dts, ids=ids, decode=(not Meta.get("category", False)))
+        except KeyError:  # 存在缓存中没有的时点或 ID, 缺失的部分填充 nan
+            Data = self.readBlock(key)
+            if dts is not None: Data = Data.reindex(index=dts)
+            if ids is not None: Data = Data.reindex(columns=ids)
+            return Data
+        Index, Columns = (Meta["index"] if dts is None else dts), (Meta["columns"] if ids is None else ids)
+        if Meta.get("category", False): return fromCodes(Data, Meta["categories"], Index, Columns)
+        if "dtype" in Meta: return genStdFrame(Data, Index, Columns, "record", dtype=Meta["dtype"])
+        return pd.DataFrame(Data, index=Index, columns=Columns, copy=False)
+
+
+# 标签转换成位置, 如果位置连续则返回 slice 以保证切片是视图
+def _genPosition(index, labels):
+    Pos = index.get_indexer(labels)
+    if (Pos < 0).any(): raise KeyError("缓存数据中不存在标签: %s" % (np.asarray(labels, dtype="O")[Pos < 0][:5].tolist(),))
+    if Pos.shape[0] == 0: return Pos
+    if (Pos.shape[0] == 1) or (np.diff(Pos) == 1).all(): return slice(Pos[0], Pos[-1] + 1)
+    return Pos
+
+
+# 打开缓存文件
+def openCacheFile(file_path, flag="c", cache_format="mmap"):
+    if cache_format == "mmap": return MMAPCacheFile(file_path, flag)
+    return shelve.open(file_path, flag)
+
+
+# 缓存文件是否存在
+def isCacheFile(file_path, cache_format="mmap"):
+    if cache_format == "mmap": return os.path.isfile(os.path.join(file_path + _MMAP_SUFFIX, _INDEX_FILE))
+    return any(os.path.isfile(file_path + iSuffix) for iSuffix in _SHELVE_SUFFIXES)
+
+
+# 检测缓存文件的格式, 优先检测 cache_format, 不存在返回 None
+def detectCacheFormat(file_path, cache_format="mmap"):
+    for iFormat in (cache_format,) + tuple(iFormat for iFormat in CACHE_FORMATS if iFormat != cache_format):
+        if isCacheFile(file_path, iFormat): return iFormat
+    return None
+
+
+# 读取缓存文件中的因子数据, 返回: DataFrame(index=[时点], columns=[ID])
+def readCacheData(cache_file, key, dts=None, ids=None):
+    if isinstance(cache_file, MMAPCacheFile): return cache_file.readBlock(key, dts=dts, ids=ids)
+    Data = cache_file[key]
+    if dts is not None: Data = Data.loc[dts]
+    if ids is not None: Data = Data.loc[:, ids]
+    return Data
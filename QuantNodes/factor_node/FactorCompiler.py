@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""因子运算符的表达式编译"""
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# 运算符重载生成的参数结构与 FactorDB._UnitaryOperator, FactorDB._BinaryOperator 相同:
+# {"OperatorType": 运算符, "Fun1": 算子, "Arg1": 参数, "Data1": 标量, "SepInd": 分隔位置, ...}
+# 编译时将嵌套的运算符参数展开成一棵表达式树, 再生成一个 Python 函数, 描述子数据的位置和常量在编译时确定
+# 表达式树的节点:
+# ("slot", i): 描述子数据 x[i]
+# ("const", i): 常量
+# ("call", i, start, end): 无法编译的算子, 以 x[start:end] 调用
+# ("op", 运算符, 子节点, ...): 运算
+
+_UNITARY_OPS = ("neg", "abs", "not")
+_BINARY_UFUNCS = {"add": "np.add", "sub": "np.subtract", "mul": "np.multiply", "floordiv": "np.floor_divide",
+                  "mod": "np.remainder", "and": "np.bitwise_and", "or": "np.bitwise_or", "xor": "np.bitwise_xor",
+                  "<": "np.less", "<=": "np.less_equal", ">": "np.greater", ">=": "np.greater_equal", "==": "np.equal",
+                  "!=": "np.not_equal"}
+_UNITARY_UFUNCS = {"neg": "np.negative", "abs": "np.absolute", "not": "np.invert"}
+# 结果可以写入临时数组的运算
+_INPLACE_OPS = {"add", "sub", "mul", "div", "floordiv", "mod", "pow", "neg", "abs"}
+# numexpr 支持且语义与 numpy 一致的运算, {运算符: 表达式模板}
+_NUMEXPR_TEMPLATES = {"add": "({0} + {1})", "sub": "({0} - {1})", "mul": "({0} * {1})",
+                      "div": "where({1} == 0, nan, {0} / {1})", "pow": "where(({0} == 0) & ({1} < 0), nan, {0} ** {1})",
+                      "<": "({0} < {1})", "<=": "({0} <= {1})", ">": "({0} > {1})", ">=": "({0} >= {1})",
+                      "==": "({0} == {1})", "!=": "({0} != {1})", "neg": "(-{0})", "abs": "abs({0})"}
+
+_KERNELS = {}  # 已编译的函数, {源代码: 函数}
+
+
+# 计算表达式, 作为 PointOperation 的算子
+def evalExpr(f, idt, iid, x, args):
+    Source, Consts, Calls = args["Kernel"]
+    Kernel = _KERNELS.get(Source)
+    if Kernel is None: Kernel = _KERNELS[Source] = _compileSource(Source)
+    return Kernel(f, idt, iid, x, Consts, Calls)
+
+
+# 编译运算符参数, 返回附带编译结果的参数
+def compileExpr(args):
+    Consts, Calls = [], []
+    Tree = _genTree(args, 0, None, Consts, Calls)
+    args = dict(args)
+    args["Kernel"] = (_genSource(Tree), tuple(Consts), tuple(Calls))
+    return args
+
+
+def _genOperandTree(fun, arg, start, end, consts, calls):
+    if fun is evalExpr: return _genTree(arg, start, end, consts, calls)
+    calls.append((fun, arg))
+    return ("call", len(calls) - 1, start, end)
+
+
+def _genDataTree(args, key, default_slot, consts):
+    Data = args.get(key, None)
+    if Data is None: return ("slot", default_slot)
+    consts.append(Data)
+    return ("const", len(consts) - 1)
+
+
+# 由运算符参数生成表达式树, start, end: 该运算符可见的描述子数据在 x 中的范围
+def _genTree(args, start, end, consts, calls):
+    OperatorType = args.get("OperatorType", "add")
+    if OperatorType in _UNITARY_OPS:
+        Fun = args.get("Fun", None)
+        if Fun is not None: return ("op", OperatorType, _genOperandTree(Fun, args["Arg"], start, end, consts, calls))
+        return ("op", OperatorType, ("slot", start))
+    SepInd = start + args["SepInd"]
+    Fun1 = args.get("Fun1", None)
+    if Fun1 is not None:
+        Operand1 = _genOperandTree(Fun1, args["Arg1"], start, SepInd, consts, calls)
+    else:
+        Operand1 = _genDataTree(args, "Data1", start, consts)
+    Fun2 = args.get("Fun2", None)
+    if Fun2 is not None:
+        Operand2 = _genOperandTree(Fun2, args["Arg2"], SepInd, end, consts, calls)
+    else:
+        Operand2 = _genDataTree(args, "Data2", SepInd, consts)
+    return ("op", OperatorType, Operand1, Operand2)
+
+
+def _countOps(node):
+    if node[0] != "op": return 0
+    return 1 + sum(_countOps(iNode) for iNode in node[2:])
+
+
+def _isNumExprTree(node):
+    if node[0] != "op": return True
+    return (node[1] in _NUMEXPR_TEMPLATES) and all(_isNumExprTree(iNode) for iNode in node[2:])
+
+
+class _CodeGenerator(object):
+    def __init__(self):
+        self.Lines = []
+        self._nVar = 0
+        self._Leaves = {}  # 已经生成的叶子节点, {节点: 变量名}
+
+    def _newVar(self):
+        self._nVar += 1
+        return "v" + str(self._nVar)
+
+    def _emit(self, line, indent):
+        self.Lines.append("    " * indent + line)
+
+    # 叶子节点, 返回变量名, ("var", 变量名) 表示已经生成的子树结果
+    def genLeaf(self, node, indent):
+        if node[0] == "var": return node[1]
+        if node in self._Leaves: return self._Leaves[node]
+        if node[0] == "slot":
+            Var = "x[%d]" % node[1]
+        elif node[0] == "const":
+            Var = "_C[%d]" % node[1]
+        else:
+            Var = self._newVar()
+            End = ("" if node[3] is None else str(node[3]))
+            self._emit("%s = _F[%d][0](f, idt, iid, x[%d:%s], _F[%d][1])" % (Var, node[1], node[2], End, node[1]), indent)
+        self._Leaves[node] = Var
+        return Var
+
+    # 生成 numpy 代码, 返回: (变量名, 是否为临时数组)
+    def genNumPy(self, node, indent):
+        if node[0] == "var": return node[1], True
+        if node[0] != "op": return self.genLeaf(node, indent), False
+        Operands = [self.genNumPy(iNode, indent) for iNode in node[2:]]
+        Var, OperatorType = self._newVar(), node[1]
+        Reuse = tuple((iTemp and (OperatorType in _INPLACE_OPS)) for _, iTemp in Operands)
+        Names = [iVar for iVar, _ in Operands]
+        if OperatorType == "div":
+            self._emit("%s = _div(%s, %s, %s)" % (Var, Names[0], Names[1], Reuse), indent)
+        elif OperatorType == "pow":
+            self._emit("%s = _pow(%s, %s, %s)" % (Var, Names[0], Names[1], Reuse), indent)
+        elif OperatorType in _UNITARY_UFUNCS:
+            self._emit("%s = _ufunc(%s, (%s,), %s)" % (Var, _UNITARY_UFUNCS[OperatorType], Names[0], Reuse), indent)
+        elif OperatorType in _BINARY_UFUNCS:
+            self._emit("%s = _ufunc(%s, (%s, %s), %s)" % (Var, _BINARY_UFUNCS[OperatorType], Names[0], Names[1], Reuse), indent)
+        else:
+            from QuantStudio import __QS_Error__
+            raise __QS_Error__("尚不支持的因子运算符: %s" % OperatorType)
+        return Var, True
+
+    # 生成 numexpr 表达式字符串, names: {变量名: numexpr 中的名称}
+    def genNumExpr(self, node, names, indent):
+        if node[0] != "op":
+            Var = self.genLeaf(node, indent)
+            if Var not in names: names[Var] = "a" + str(len(names))
+            return names[Var]
+        return _NUMEXPR_TEMPLATES[node[1]].format(*[self.genNumExpr(iNode, names, indent) for iNode in node[2:]])
+
+    # 生成节点的代码, 返回变量名, 可以融合的子树优先使用 numexpr 计算, 数据类型不支持时退回 numpy 代码
+    def genNode(self, node, indent=1):
+        if node[0] != "op": return self.genLeaf(node, indent)
+        if (numexpr is not None) and (_countOps(node) > 1) and _isNumExprTree(node):
+            Names = {}
+            Expr = self.genNumExpr(node, Names, indent)
+            Var = self._newVar()
+            self._emit("%s = _numexpr(%r, {%s})" % (Var, Expr, ", ".join("%r: %s" % (iName, iVar) for iVar, iName in Names.items())), indent)
+            self._emit("if %s is None:" % Var, indent)
+            iVar, _ = self.genNumPy(node, indent + 1)
+            self._emit("%s = %s" % (Var, iVar), indent + 1)
+            return Var
+        Children = [(("var", self.genNode(iNode, indent)) if iNode[0] == "op" else iNode) for iNode in node[2:]]
+        return self.genNumPy(("op", node[1]) + tuple(Children), indent)[0]
+
+
+def _genSource(tree):
+    Generator = _CodeGenerator()
+    Var = Generator.genNode(tree)
+    return "\n".join(["def _QS_Kernel(f, idt, iid, x, _C, _F):"] + Generator.Lines + ["    return " + Var])
+
+
+def _compileSource(source):
+    Namespace = {"np": np, "_ufunc": _ufunc, "_div": _div, "_pow": _pow, "_numexpr": _evaluateNumExpr}
+    exec(compile(source, "<FactorCompiler>", "exec"), Namespace)
+    return Namespace["_QS_Kernel"]
+
+
+# 选择可以写入结果的临时数组, 避免分配新的数组
+def _genOut(operands, reuse):
+    for iData, iReuse in zip(operands, reuse):
+        if iReuse and isinstance(iData, np.ndarray) and (iData.dtype == np.float64):
+            try:
+                if (np.result_type(*operands) == np.float64) and (
+                        np.broadcast_shapes(*(np.shape(jData) for jData in operands)) == iData.shape):
+                    return iData
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def _ufunc(ufunc, operands, reuse):
+    Out = _genOut(operands, reuse)
+    if Out is None: return ufunc(*operands)
+    return ufunc(*operands, out=Out)
+
+
+def _div(data1, data2, reuse):
+    if np.isscalar(data2): return (_ufunc(np.true_divide, (data1, data2), reuse) if data2 != 0 else np.empty(np.shape(data1)) + np.nan)
+    if reuse[1] and isinstance(data2, np.ndarray) and (data2.dtype.kind == "f"):
+        data2[data2 == 0] = np.nan
+    else:
+        data2 = np.where(data2 == 0, np.nan, data2)
+    return _ufunc(np.true_divide, (data1, data2), (reuse[0], True))
+
+
+def _pow(data1, data2, reuse):
+    if np.isscalar(data2):
+        if data2 < 0: data1 = np.where(data1 == 0, np.nan, data1)
+        return _ufunc(np.power, (data1, data2), reuse)
+    if np.isscalar(data1):
+        if data1 == 0: data2 = np.where(data2 < 0, np.nan, data2)
+        return _ufunc(np.power, (data1, data2), reuse)
+    data1 = np.where((data1 == 0) & (data2 < 0), np.nan, data1)
+    return _ufunc(np.power, (data1, data2), (True, reuse[1]))
+
+
+# 使用 numexpr 计算融合后的表达式, 数据不是数值类型时返回 None, 由 numpy 代码计算
+def _evaluateNumExpr(expr, local_dict):
+    for iData in local_dict.values():
+        if isinstance(iData, np.ndarray):
+            if iData.dtype.kind not in "if": return None
+        elif isinstance(iData, (bool, np.bool_)) or (not isinstance(iData, (int, float, np.integer, np.floating))):
+            return None
+    local_dict["nan"] = np.nan
+    try:
+        return numexpr.evaluate(expr, local_dict=local_dict)
+    except (ValueError, TypeError, KeyError, NotImplementedError):
+        return None
@@ -7,7 +7,7 @@ import os
 import pandas as pd
 import pickle
 import platform
-import shelve
+import queue
 import shutil
 import tempfile
 import time
@@ -20,9 +20,20 @@ from traits.api import Instance, Str, File, List, Int, Bool, Directory, Enum, Li
 from QuantStudio import __QS_Object__, __QS_Error__
 from QuantStudio.Tools.AuxiliaryFun import genAvailableName, startMultiProcess, partitionListMovingSampling
 from QuantStudio.Tools.DataPreprocessingFun import fillNaByLookback
-from QuantStudio.Tools.FileFun import listDirDir, getShelveFileSuffix
+from QuantStudio.Tools.FileFun import listDirDir
 from QuantStudio.Tools.IDFun import testIDFilterStr
 
+from QuantNodes.factor_node.DTIndex import getDTIndex
+from QuantNodes.factor_node.FactorCache import CACHE_FORMATS, openCacheFile, isCacheFile, detectCacheFormat, \
+    readCacheData
+from QuantNodes.factor_node.FactorCompiler import compileExpr, evalExpr
+from QuantNodes.factor_node.FactorDType import DATA_TYPES, isCategoryFrame, genEmptyFrame, toStorage
+from QuantNodes.factor_node.FactorGraph import FactorHasher, FactorFingerprint, genFactorDeps, sortFactorDAG, pruneFactorDAG, \
+    runFactorDAG
+from QuantNodes.factor_node.FactorPanel import FactorPanel
+from QuantNodes.factor_node.ResultCache import ResultCache, genResultKey
+from QuantNodes.factor_node.SharedCache import SharedCacheWriter, SharedCacheReader
+
 
 # 因子库, 只读, 接口类
 # 数据库由若干张因子表组成
@@ -150,6 +161,7 @@ class _ErgodicMode(__QS_Object__):
     CacheSize = Int(300, arg_type="Integer", label="缓冲区大小", order=5)  # 以 MB 为单位
     ErgodicDTs = List(arg_type="DateTimeList", label="遍历时点", order=6)
     ErgodicIDs = List(arg_type="IDList", label="遍历ID", order=7)
+    ShareMode = Enum("共享内存", "mmap", arg_type="SingleOption", label="共享方式", order=8)
 
     def __init__(self, sys_args={}, **kwargs):
         super().__init__(sys_args=sys_args, **kwargs)
@@ -215,8 +227,8 @@ def _prepareMMAPFactorCacheData(ft, mmap_cache):
                                                               dts=NewCacheDTs), factor_names=CacheFactorNames,
                             ids=ft.ErgodicMode._IDs, dts=NewCacheDTs)
                     else:
-                        NewCacheData = pd.Panel(items=CacheFactorNames, major_axis=NewCacheDTs,
-                                                minor_axis=ft.ErgodicMode._IDs)
+                        NewCacheData = FactorPanel(items=CacheFactorNames, major_axis=NewCacheDTs,
+                                                   minor_axis=ft.ErgodicMode._IDs)
                     for iFactorName in CacheData:
                         if isDisjoint:
                             CacheData[iFactorName] = NewCacheData[iFactorName]
@@ -275,7 +287,7 @@ def _prepareMMAPIDCacheData(ft, mmap_cache):
                                                               dts=NewCacheDTs), factor_names=ft.FactorNames,
                             ids=CacheIDs, dts=NewCacheDTs)
                     else:
-                        NewCacheData = pd.Panel(items=ft.FactorNames, major_axis=NewCacheDTs, minor_axis=CacheIDs)
+                        NewCacheData = FactorPanel(items=ft.FactorNames, major_axis=NewCacheDTs, minor_axis=CacheIDs)
                     for iID in CacheData:
                         if isDisjoint:
                             CacheData[iID] = NewCacheData.loc[:, :, iID]
@@ -286,6 +298,97 @@ def _prepareMMAPIDCacheData(ft, mmap_cache):
     return 0
 
 
+# 基于共享内存的缓冲数据, 数值型的缓冲数据由子进程直接写入共享内存, 主进程只需要包装成 DataFrame, 无需序列化
+# 缓冲区前移时只拷贝保留的时点和新增的时点
+def _prepareSHMFactorCacheData(ft):
+    DTNum = len(ft.ErgodicMode._DateTimes)
+    CacheData = SharedCacheWriter(min(DTNum, ft.ErgodicMode.BackwardPeriod + ft.ErgodicMode.ForwardPeriod + 1))
+    CacheDTs = []
+    while True:
+        Task = ft.ErgodicMode._Queue2SubProcess.get()  # 获取任务
+        if Task is None: break  # 结束进程
+        if (Task[0] is None) and (Task[1] is None):  # 发布缓存区
+            ft.ErgodicMode._Queue2MainProcess.put(CacheData.publish())
+        elif Task[0] is None:  # 调整缓存区
+            NewFactors, PopFactors = Task[1]
+            for iFactorName in PopFactors: CacheData.pop(iFactorName)
+            if NewFactors:
+                if CacheDTs:
+                    NewCacheData = ft.__QS_calcData__(
+                        raw_data=ft.__QS_prepareRawData__(factor_names=NewFactors, ids=ft.ErgodicMode._IDs,
+                                                          dts=CacheDTs), factor_names=NewFactors,
+                        ids=ft.ErgodicMode._IDs, dts=CacheDTs)
+                    for iFactorName in NewFactors: CacheData.write(iFactorName, NewCacheData[iFactorName], dts=CacheDTs)
+                    NewCacheData = None
+                else:
+                    for iFactorName in NewFactors:
+                        CacheData.write(iFactorName, pd.DataFrame(index=CacheDTs, columns=ft.ErgodicMode._IDs), dts=CacheDTs)
+        else:  # 准备缓存区
+            CurInd = Task[0] + ft.ErgodicMode.ForwardPeriod + 1
+            if CurInd < DTNum:  # 未到结尾处, 需要再准备缓存数据
+                OldCacheDTs = set(CacheDTs)
+                CacheDTs = ft.ErgodicMode._DateTimes[max((0, CurInd - ft.ErgodicMode.BackwardPeriod)):min(
+                    (DTNum, CurInd + ft.ErgodicMode.ForwardPeriod + 1))].tolist()
+                NewCacheDTs = sorted(set(CacheDTs).difference(OldCacheDTs))
+                if len(CacheData) > 0:
+                    CacheFactorNames = CacheData.keys()
+                    if NewCacheDTs:
+                        NewCacheData = ft.__QS_calcData__(
+                            raw_data=ft.__QS_prepareRawData__(factor_names=CacheFactorNames, ids=ft.ErgodicMode._IDs,
+                                                              dts=NewCacheDTs), factor_names=CacheFactorNames,
+                            ids=ft.ErgodicMode._IDs, dts=NewCacheDTs)
+                        CacheData.shift(CacheDTs, {iFactorName: NewCacheData[iFactorName] for iFactorName in CacheFactorNames})
+                    else:
+                        CacheData.shift(CacheDTs, {iFactorName: pd.DataFrame(index=NewCacheDTs, columns=ft.ErgodicMode._IDs)
+                                                   for iFactorName in CacheFactorNames})
+                    NewCacheData = None
+    CacheData.close()
+    return 0
+
+
+# 基于共享内存的 ID 缓冲的因子表, 缓冲区里是 ID 的部分数据
+def _prepareSHMIDCacheData(ft):
+    DTNum = len(ft.ErgodicMode._DateTimes)
+    CacheData = SharedCacheWriter(min(DTNum, ft.ErgodicMode.BackwardPeriod + ft.ErgodicMode.ForwardPeriod + 1))
+    CacheDTs = []
+    while True:
+        Task = ft.ErgodicMode._Queue2SubProcess.get()  # 获取任务
+        if Task is None: break  # 结束进程
+        if (Task[0] is None) and (Task[1] is None):  # 发布缓冲区
+            ft.ErgodicMode._Queue2MainProcess.put(CacheData.publish())
+        elif Task[0] is None:  # 调整缓存区数据
+            NewID, PopID = Task[1]
+            if PopID: CacheData.pop(PopID)  # 用新 ID 数据替换旧 ID
+            if NewID:
+                if CacheDTs:
+                    CacheData.write(NewID, ft.__QS_calcData__(
+                        raw_data=ft.__QS_prepareRawData__(factor_names=ft.FactorNames, ids=[NewID], dts=CacheDTs),
+                        factor_names=ft.FactorNames, ids=[NewID], dts=CacheDTs).iloc[:, :, 0], dts=CacheDTs)
+                else:
+                    CacheData.write(NewID, pd.DataFrame(index=CacheDTs, columns=ft.FactorNames), dts=CacheDTs)
+        else:  # 准备缓冲区
+            CurInd = Task[0] + ft.ErgodicMode.ForwardPeriod + 1
+            if CurInd < DTNum:  # 未到结尾处, 需要再准备缓存数据
+                OldCacheDTs = set(CacheDTs)
+                CacheDTs = ft.ErgodicMode._DateTimes[max((0, CurInd - ft.ErgodicMode.BackwardPeriod)):min(
+                    (DTNum, CurInd + ft.ErgodicMode.ForwardPeriod + 1))].tolist()
+                NewCacheDTs = sorted(set(CacheDTs).difference(OldCacheDTs))
+                if len(CacheData) > 0:
+                    CacheIDs = CacheData.keys()
+                    if NewCacheDTs:
+                        NewCacheData = ft.__QS_calcData__(
+                            raw_data=ft.__QS_prepareRawData__(factor_names=ft.FactorNames, ids=CacheIDs,
+                                                              dts=NewCacheDTs), factor_names=ft.FactorNames,
+                            ids=CacheIDs, dts=NewCacheDTs)
+                        CacheData.shift(CacheDTs, {iID: NewCacheData.loc[:, :, iID] for iID in CacheIDs})
+                    else:
+                        CacheData.shift(CacheDTs, {iID: pd.DataFrame(index=NewCacheDTs, columns=ft.FactorNames)
+                                                   for iID in CacheIDs})
+                    NewCacheData = None
+    CacheData.close()
+    return 0
+
+
 # 因子表的运算模式参数对象
 class _OperationMode(__QS_Object__):
     """运算模式"""
@@ -293,13 +396,19 @@ class _OperationMode(__QS_Object__):
     IDs = ListStr()
     FactorNames = ListStr()
     SubProcessNum = Int(0)
+    ThreadNum = Int(1)  # 每个计算进程内并行计算相互独立的因子的线程数, 不大于 1 表示在计算进程的主线程内按照拓扑序依次计算; 大于 1 时算子需要是线程安全的
     DTRuler = List(dt.datetime)
+    CacheFormat = Enum(*CACHE_FORMATS)  # 缓存文件格式, mmap: 列式内存映射文件, shelve: pickle 文件
+    ResultCacheDir = Str("")  # 跨运行的结果缓存目录, 为空表示不使用
+    ResultCacheSize = Int(0)  # 结果缓存的容量(字节), 超出时淘汰最近最少使用的条目, 0 表示不限制
+    WriteMemoryLimit = Int(0)  # 每个进程每次写入的数据大小上限(字节), 0 表示不限制
 
     def __init__(self, ft, sys_args={}, config_file=None, **kwargs):
         self._FT = ft
         self._isStarted = False
         self._Factors = []  # 因子列表, 只包含当前生成数据的因子
         self._FactorDict = {}  # 因子字典, {因子名:因子}, 包括所有的因子, 即衍生因子所依赖的描述子也在内
+        self._FactorDeps = {}  # 因子依赖图, {因子名: [描述子名]}
         self._FactorID = {}  # {因子名: 因子唯一的 ID 号(int)}, 比如防止操作系统文件大小写不敏感导致缓存文件重名
         self._FactorStartDT = {}  # {因子名: 起始时点}
         self._FactorPrepareIDs = {}  # {因子名: 需要准备原始数据的 ID 序列}
@@ -310,9 +419,11 @@ class _OperationMode(__QS_Object__):
         self._CacheDir = None  # 缓存数据的临时文件夹
         self._RawDataDir = ""  # 原始数据存放根目录
         self._CacheDataDir = ""  # 中间数据存放根目录
-        self._Event = {}  # {因子名: (Sub2MainQueue, Event)}
-        self._FileSuffix = getShelveFileSuffix()
-        if self._FileSuffix: self._FileSuffix = "." + self._FileSuffix
+        self._Event = {}  # {因子名: Event}, 截面同步点, 所有进程到达后由主进程 set
+        self._Sub2MainQueue = None  # 计算进程向主进程发送消息的队列, 消息格式: (PID, 进度增量, None 或 (消息类型, 因子名, ...))
+        self._FactorTime = {}  # {因子名: 计算耗时(秒)}, 多进程下为各进程的耗时之和
+        self._ResultCache = None  # 跨运行的结果缓存
+        self._FactorFingerprint = {}  # {因子名: 因子树的指纹}, None 表示不能跨运行缓存
         super().__init__(sys_args=sys_args, config_file=config_file, **kwargs)
 
     def __QS_initArgs__(self):
@@ -339,7 +450,8 @@ def _prepareRawData(args):
                 if iPID_PrepareIDs is None: iPID_PrepareIDs = args["FT"].OperationMode._PID_IDs
                 iRawData = iFT.__QS_prepareRawData__(iRawFactorNames, iPrepareIDs, iDTs, iArgs)
                 iFT.__QS_saveRawData__(iRawData, iRawFactorNames, args["FT"].OperationMode._RawDataDir, iPID_PrepareIDs,
-                                       args["RawDataFileNames"][i], args["FT"].OperationMode._PID_Lock)
+                                       args["RawDataFileNames"][i], args["FT"].OperationMode._PID_Lock,
+                                       cache_format=args["FT"].OperationMode.CacheFormat)
                 ProgBar.update(i + 1)
     else:  # 运行模式为并行
         for i in range(nGroup):
@@ -350,15 +462,88 @@ def _prepareRawData(args):
             if iPID_PrepareIDs is None: iPID_PrepareIDs = args["FT"].OperationMode._PID_IDs
             iRawData = iFT.__QS_prepareRawData__(iRawFactorNames, iPrepareIDs, iDTs, iArgs)
             iFT.__QS_saveRawData__(iRawData, iRawFactorNames, args["FT"].OperationMode._RawDataDir, iPID_PrepareIDs,
-                                   args["RawDataFileNames"][i], args["FT"].OperationMode._PID_Lock)
+                                   args["RawDataFileNames"][i], args["FT"].OperationMode._PID_Lock,
+                                   cache_format=args["FT"].OperationMode.CacheFormat)
             args['Sub2MainQueue'].put((args["PID"], 1, None))
     return 0
 
 
+# 因子是否依赖截面运算或者面板运算, 这些运算的结果与所有进程的 ID 有关
+def _dependsOnSection(operation_mode, factor_name):
+    Stack, Visited = list(operation_mode._FactorDeps[factor_name]), set()
+    while Stack:
+        iFactorName = Stack.pop()
+        if iFactorName in operation_mode._Event: return True
+        if iFactorName in Visited: continue
+        Visited.add(iFactorName)
+        Stack.extend(operation_mode._FactorDeps[iFactorName])
+    return False
+
+
+# 因子在当前进程的结果缓存键, 由因子树的指纹, 计算的时点和 ID 决定; 不能缓存时返回 None
+# 截面运算和面板运算的缓存数据由所有进程共同写入, 不使用结果缓存; 依赖它们的因子的键包含完整的 ID 序列
+def _genResultKey(operation_mode, factor_name):
+    Fingerprint = operation_mode._FactorFingerprint.get(factor_name, None)
+    if (operation_mode._ResultCache is None) or (Fingerprint is None) or (factor_name in operation_mode._Event): return None
+    PID, DTRuler = operation_mode._iPID, operation_mode.DTRuler
+    StartInd, EndInd = getDTIndex(DTRuler).index(operation_mode._FactorStartDT[factor_name]), getDTIndex(DTRuler).index(operation_mode.DateTimes[-1])
+    IDs = tuple(operation_mode._PID_IDs[PID])
+    if _dependsOnSection(operation_mode, factor_name): IDs = (IDs, tuple(operation_mode.IDs))
+    return genResultKey(Fingerprint, operation_mode.CacheFormat, DTRuler[0], tuple(DTRuler[StartInd:EndInd + 1]),
+                        IDs, operation_mode._FactorPrepareIDs[factor_name],
+                        len(operation_mode._PIDs), operation_mode._PIDs.index(PID))
+
+
+# 当前进程需要执行的依赖图, 开启了结果缓存时命中的因子不需要计算其描述子
+# 截面同步节点需要所有进程一致地到达, 总是保留
+def _genRunDeps(operation_mode):
+    if operation_mode._ResultCache is None: return operation_mode._FactorDeps
+    def _isHit(factor_name):
+        Key = _genResultKey(operation_mode, factor_name)
+        return (Key is not None) and (Key in operation_mode._ResultCache)
+    return pruneFactorDAG(operation_mode._FactorDeps, operation_mode.FactorNames, _isHit, keep=operation_mode._Event)
+
+
+# 准备因子的缓存数据, 开启了结果缓存时命中的因子直接复制缓存数据, 未命中的因子计算后写入结果缓存
+def _prepareCacheData(factor):
+    if factor._isCacheDataOK: return 0
+    OperationMode = factor._OperationMode
+    Key = _genResultKey(OperationMode, factor.Name)
+    if Key is None:
+        factor.__QS_prepareCacheData__()
+        return 0
+    PID = OperationMode._iPID
+    CacheFilePath = OperationMode._CacheDataDir + os.sep + PID + os.sep + factor.Name + str(OperationMode._FactorID[factor.Name])
+    Data = OperationMode._ResultCache.get(Key)
+    if Data is not None:
+        with OperationMode._PID_Lock[PID]:
+            with openCacheFile(CacheFilePath, "c", OperationMode.CacheFormat) as CacheFile:
+                for iKey, iVal in Data.items(): CacheFile[iKey] = iVal
+        factor._isCacheDataOK = True
+        return 0
+    factor.__QS_prepareCacheData__()
+    if not isCacheFile(CacheFilePath, OperationMode.CacheFormat): return 0
+    with OperationMode._PID_Lock[PID]:
+        with openCacheFile(CacheFilePath, "r", OperationMode.CacheFormat) as CacheFile:
+            Data = {iKey: CacheFile[iKey] for iKey in CacheFile.keys()}
+    OperationMode._ResultCache.put(Key, Data)
+    return 0
+
+
+# 汇报计算进度和因子的耗时, 串行模式下直接记录, 多进程模式下发送给主进程
+def _reportProgress(args, inc, factor_name, elapsed):
+    OperationMode = args["FT"].OperationMode
+    if OperationMode._Sub2MainQueue is None:
+        OperationMode._FactorTime[factor_name] = OperationMode._FactorTime.get(factor_name, 0) + elapsed
+    else:
+        OperationMode._Sub2MainQueue.put((args["PID"], inc, ("Timing", factor_name, elapsed)))
+
+
 # 因子表运算子进程
 def _calculate(args):
     FT = args["FT"]
     FT.OperationMode._iPID = args["PID"]
+    FT.OperationMode._Sub2MainQueue = args.get("Sub2MainQueue", None)
     # 分配任务
     TDB, TableName, SpecificTarget = args["FactorDB"], args["TableName"], args["specific_target"]
     if SpecificTarget:
@@ -376,87 +561,101 @@ def _calculate(args):
                 TaskDispatched[iDBTable] = (iDB, [FT.OperationMode._FactorDict[iFactorName]], [iTargetFactorName])
     else:
         TaskDispatched = {(id(TDB), TableName): (TDB, FT.OperationMode._Factors, list(FT.OperationMode.FactorNames))}
-    # 执行任务
+    # 按照因子依赖图准备所有因子的缓存数据, 描述子先于衍生因子计算, 相互独立的因子并行计算
+    # 截面运算和面板运算需要所有进程的数据, 是进程间仅有的同步点
+    def _runNode(factor_name):
+        StartT = time.perf_counter()
+        _prepareCacheData(FT.OperationMode._FactorDict[factor_name])
+        _reportProgress(args, 0, factor_name, time.perf_counter() - StartT)
+
+    runFactorDAG(_genRunDeps(FT.OperationMode), _runNode, barriers=FT.OperationMode._Event,
+                 thread_num=FT.OperationMode.ThreadNum)
+    # 执行任务, 按时点分块读取并写入, 每块数据的大小不超过内存上限
     nTask = len(FT.OperationMode.FactorNames)
-    nDT = len(FT.OperationMode.DateTimes)
-    TaskCount = 0
     if FT.OperationMode.SubProcessNum == 0:  # 运行模式为串行
-
         with ProgressBar(max_value=nTask) as ProgBar:
-            for i, iTask in enumerate(TaskDispatched):
-                iDB, iFactors, iTargetFactorNames = TaskDispatched[iTask]
-                iTableName = iTask[1]
-                if hasattr(iDB, "writeFactorData"):
-                    for j, jFactor in enumerate(iFactors):
-                        jData = jFactor._QS_getData(dts=FT.OperationMode.DateTimes, pids=[args["PID"]])
-                        if FT.OperationMode._FactorPrepareIDs[jFactor.Name] is not None:
-                            jData = jData.loc[:, FT.OperationMode.IDs]
-                        iDB.writeFactorData(jData, iTableName, iTargetFactorNames[j], if_exists=args["if_exists"],
-                                            data_type=jFactor.getMetaData(key="DataType"))
-                        jData = None
-                        TaskCount += 1
-                        ProgBar.update(TaskCount)
-                else:
-                    iFactoNum = len(iFactors)
-                    iDTLen = int(np.ceil(nDT / iFactoNum))
-                    iDataTypes = {iTargetFactorNames[j]: jFactor.getMetaData(key="DataType") for j, jFactor in
-                                  enumerate(iFactors)}
-                    for j in range(iFactoNum):
-                        jDTs = list(FT.OperationMode.DateTimes[j * iDTLen:(j + 1) * iDTLen])
-                        if jDTs:
-                            jData = {}
-                            for k, kFactor in enumerate(iFactors):
-                                ijkData = kFactor._QS_getData(dts=jDTs, pids=[args["PID"]])
-                                if FT.OperationMode._FactorPrepareIDs[kFactor.Name] is not None:
-                                    ijkData = ijkData.loc[:, FT.OperationMode.IDs]
-                                jData[iTargetFactorNames[k]] = ijkData
-                                if j == 0:
-                                    TaskCount += 0.5
-                                    ProgBar.update(TaskCount)
-                            jData = pd.Panel(jData).loc[iTargetFactorNames]
-                            iDB.writeData(jData, iTableName, if_exists=args["if_exists"], data_type=iDataTypes)
-                            jData = None
-                        TaskCount += 0.5
-                        ProgBar.update(TaskCount)
+            _writeTasks(args, TaskDispatched, ProgBar)
     else:
-        for i, iTask in enumerate(TaskDispatched):
-            iDB, iFactors, iTargetFactorNames = TaskDispatched[iTask]
-            iTableName = iTask[1]
-            if hasattr(iDB, "writeFactorData"):
-                for j, jFactor in enumerate(iFactors):
-                    if FT.OperationMode._FactorPrepareIDs[jFactor.Name] is not None:
-                        jData = jFactor._QS_getData(dts=FT.OperationMode.DateTimes, pids=None)
-                        jData = jData.loc[:, FT.OperationMode._PID_IDs[args["PID"]]]
-                    else:
-                        jData = jFactor._QS_getData(dts=FT.OperationMode.DateTimes, pids=[args["PID"]])
-                    iDB.writeFactorData(jData, iTableName, iTargetFactorNames[j], if_exists=args["if_exists"],
-                                        data_type=jFactor.getMetaData(key="DataType"))
-                    jData = None
-                    args["Sub2MainQueue"].put((args["PID"], 1, None))
-            else:
-                iFactoNum = len(iFactors)
-                iDTLen = int(np.ceil(nDT / iFactoNum))
-                iDataTypes = {iTargetFactorNames[j]: jFactor.getMetaData(key="DataType") for j, jFactor in
-                              enumerate(iFactors)}
-                for j in range(iFactoNum):
-                    jDTs = list(FT.OperationMode.DateTimes[j * iDTLen:(j + 1) * iDTLen])
-                    if jDTs:
-                        jData = {}
-                        for k, kFactor in enumerate(iFactors):
-                            ijkData = kFactor._QS_getData(dts=jDTs, pids=[args["PID"]])
-                            if FT.OperationMode._FactorPrepareIDs[kFactor.Name] is not None:
-                                ijkData = ijkData.loc[:, FT.OperationMode.IDs]
-                            jData[iTargetFactorNames[k]] = ijkData
-                            if j == 0: args["Sub2MainQueue"].put((args["PID"], 0.5, None))
-                        jData = pd.Panel(jData).loc[iTargetFactorNames]
-                        iDB.writeData(jData, iTableName, if_exists=args["if_exists"], data_type=iDataTypes)
-                        jData = None
-                    args["Sub2MainQueue"].put((args["PID"], 0.5, None))
+        _writeTasks(args, TaskDispatched, None)
     return 0
 
 
+# 按照内存上限将时点序列分块, n_factor: 每块同时读取的因子数, n_id: ID 数
+# memory_limit 为 0 时每块包含 ceil(nDT / n_factor) 个时点, 即所有因子的数据合计约为一个因子的全部数据
+def _genDTChunks(dts, n_factor, n_id, memory_limit=0):
+    nDT = len(dts)
+    if nDT == 0: return []
+    if memory_limit > 0:
+        ChunkLen = max(1, int(memory_limit // max(1, n_factor * n_id * 8)))  # 按照每个数据 8 字节估计
+    else:
+        ChunkLen = int(np.ceil(nDT / max(1, n_factor)))
+    return [dts[i:i + ChunkLen] for i in range(0, nDT, ChunkLen)]
+
+
+# 读取当前进程需要写入的因子数据, 返回: DataFrame(index=[时点], columns=[ID])
+# 指定了截面的因子在各进程中按照截面 ID 划分计算, 需要从所有进程的缓存中取出当前进程负责的 ID
+def _readOutputData(ft, factor, dts, pid):
+    if ft.OperationMode._FactorPrepareIDs[factor.Name] is None:
+        return factor._QS_getData(dts=dts, pids=[pid])
+    elif ft.OperationMode.SubProcessNum == 0:
+        return factor._QS_getData(dts=dts, pids=[pid]).loc[:, ft.OperationMode.IDs]
+    else:
+        return factor._QS_getData(dts=dts, pids=None).loc[:, ft.OperationMode._PID_IDs[pid]]
+
+
+# _readOutputData 读取的 ID 数, 用于估计分块写入的内存, 指定了截面的因子读取的是整个截面
+def _readIDNum(ft, factor, pid):
+    nID = len(ft.OperationMode._PID_IDs[pid])
+    if ft.OperationMode._FactorPrepareIDs[factor.Name] is None: return nID
+    return max(nID, len(ft.OperationMode._FactorPrepareIDs[factor.Name]))
+
+
+# 将因子数据分块写入目标因子库, 每块写入后即释放, 峰值内存由 OperationMode.WriteMemoryLimit 控制
+# 进度以因子为单位汇报, 串行模式下更新进度条 prog_bar
+def _writeTasks(args, task_dispatched, prog_bar=None):
+    FT, PID = args["FT"], args["PID"]
+    DTs = list(FT.OperationMode.DateTimes)
+    MemoryLimit = FT.OperationMode.WriteMemoryLimit
+    TaskCount = 0
+    for iTask, (iDB, iFactors, iTargetFactorNames) in task_dispatched.items():
+        iTableName = iTask[1]
+        if hasattr(iDB, "writeFactorData"):  # 逐个因子写入
+            for j, jFactor in enumerate(iFactors):
+                jDTChunks = _genDTChunks(DTs, 1, _readIDNum(FT, jFactor, PID), MemoryLimit)
+                jDataType = jFactor.getMetaData(key="DataType")
+                for k, kDTs in enumerate(jDTChunks):
+                    kStartT = time.perf_counter()
+                    kData, kDataType = toStorage(_readOutputData(FT, jFactor, kDTs, PID), jDataType)
+                    iDB.writeFactorData(kData, iTableName, iTargetFactorNames[j], if_exists=args["if_exists"],
+                                        data_type=kDataType)
+                    kData = None
+                    kInc = int(k == len(jDTChunks) - 1)
+                    _reportProgress(args, kInc, jFactor.Name, time.perf_counter() - kStartT)
+                    TaskCount += kInc
+                    if prog_bar is not None: prog_bar.update(TaskCount)
+        else:  # 多个因子按时点分块写入
+            iFactorNum = len(iFactors)
+            iFactorDataTypes = [jFactor.getMetaData(key="DataType") for jFactor in iFactors]
+            iDataTypes = {iTargetFactorNames[j]: toStorage(None, jDataType)[1] for j, jDataType in enumerate(iFactorDataTypes)}
+            iDTChunks = _genDTChunks(DTs, iFactorNum, max(_readIDNum(FT, jFactor, PID) for jFactor in iFactors), MemoryLimit)
+            for j, jDTs in enumerate(iDTChunks):
+                jData = {}
+                for k, kFactor in enumerate(iFactors):
+                    kStartT = time.perf_counter()
+                    jData[iTargetFactorNames[k]] = toStorage(_readOutputData(FT, kFactor, jDTs, PID), iFactorDataTypes[k])[0]
+                    _reportProgress(args, 0, kFactor.Name, time.perf_counter() - kStartT)
+                jData = FactorPanel(jData, items=iTargetFactorNames)
+                iDB.writeData(jData, iTableName, if_exists=args["if_exists"], data_type=iDataTypes)
+                jData = None
+                # 以整数汇报进度, 避免浮点累加误差导致主进程无法判断结束
+                jInc = iFactorNum * (j + 1) // len(iDTChunks) - iFactorNum * j // len(iDTChunks)
+                if FT.OperationMode._Sub2MainQueue is not None: FT.OperationMode._Sub2MainQueue.put((PID, jInc, None))
+                TaskCount += jInc
+                if prog_bar is not None: prog_bar.update(TaskCount)
+    return 0
+
 # 因子表, 接口类
-# 因子表可看做一个独立的数据集或命名空间, 可看做 Panel(items=[因子], major_axis=[时间点], minor_axis=[ID])
+# 因子表可看做一个独立的数据集或命名空间, 可看做 FactorPanel(items=[因子], major_axis=[时间点], minor_axis=[ID])
 # 因子表的数据有三个维度: 时间点, ID, 因子
 # 时间点数据类型是 datetime.datetime, ID 和因子名称的数据类型是 str
 # 不支持某个操作时, 方法产生错误
@@ -543,11 +742,11 @@ class FactorTable(__QS_Object__):
     def __QS_prepareRawData__(self, factor_names, ids, dts, args={}):
         return None
 
-    # 计算数据的接口, 返回: Panel(item=[因子], major_axis=[时间点], minor_axis=[ID])
+    # 计算数据的接口, 返回: FactorPanel(item=[因子], major_axis=[时间点], minor_axis=[ID])
     def __QS_calcData__(self, raw_data, factor_names, ids, dts, args={}):
         return None
 
-    # 读取数据, 返回: Panel(item=[因子], major_axis=[时间点], minor_axis=[ID])
+    # 读取数据, 返回: FactorPanel(item=[因子], major_axis=[时间点], minor_axis=[ID])
     def readData(self, factor_names, ids, dts, args={}):
         if self.ErgodicMode._isStarted: return self._readData_ErgodicMode(factor_names=factor_names, ids=ids, dts=dts,
                                                                           args=args)
@@ -576,7 +775,7 @@ class FactorTable(__QS_Object__):
                     CacheFactorNames.add(iFactorName)
                 else:  # 当前缓存因子数等于最大缓存因子数，那么将检查最小读取次数的因子
                     CacheFactorReadNum = self.ErgodicMode._FactorReadNum[self.ErgodicMode._CacheData.keys()]
-                    MinReadNumInd = CacheFactorReadNum.argmin()
+                    MinReadNumInd = CacheFactorReadNum.idxmin()
                     if CacheFactorReadNum.loc[MinReadNumInd] < self.ErgodicMode._FactorReadNum[
                         iFactorName]:  # 当前读取的因子的读取次数超过了缓存因子读取次数的最小值，缓存该因子数据
                         CacheFactorNames.add(iFactorName)
@@ -597,8 +796,7 @@ class FactorTable(__QS_Object__):
             Data.update(iData)
             self.ErgodicMode._CacheData.update(iData)
         self.ErgodicMode._Queue2SubProcess.put((None, (CacheFactorNames, PopFactorNames)))
-        Data = pd.Panel(Data)
-        if Data.shape[0] > 0: Data = Data.loc[:, dts, ids]
+        Data = FactorPanel(Data, major_axis=dts, minor_axis=ids)
         if not DataFactorNames: return Data.loc[factor_names]
         # print("超出缓存区因子个数读取: "+str(DataFactorNames))# debug
         return self.__QS_calcData__(
@@ -624,7 +822,7 @@ class FactorTable(__QS_Object__):
                 self.ErgodicMode._Queue2SubProcess.put((None, (iid, None)))
             else:  # 当前缓存 ID 数等于最大缓存 ID 数，那么将检查最小读取次数的 ID
                 CacheIDReadNum = self.ErgodicMode._IDReadNum[self.ErgodicMode._CacheData.keys()]
-                MinReadNumInd = CacheIDReadNum.argmin()
+                MinReadNumInd = CacheIDReadNum.idxmin()
                 if CacheIDReadNum.loc[MinReadNumInd] < self.ErgodicMode._IDReadNum[
                     iid]:  # 当前读取的 ID 的读取次数超过了缓存 ID 读取次数的最小值，缓存该 ID 数据
                     IDData = self.__QS_calcData__(
@@ -645,8 +843,8 @@ class FactorTable(__QS_Object__):
     def _readData_ErgodicMode(self, factor_names, ids, dts, args={}):
         if self.ErgodicMode.CacheMode == "因子": return self._readData_FactorCacheMode(factor_names=factor_names, ids=ids,
                                                                                      dts=dts, args=args)
-        return pd.Panel(
-            {iID: self._readIDData(iID, factor_names=factor_names, dts=dts, args=args) for iID in ids}).swapaxes(0, 2)
+        return FactorPanel({iID: self._readIDData(iID, factor_names=factor_names, dts=dts, args=args) for iID in ids},
+                           items=ids, major_axis=dts, minor_axis=factor_names).swapaxes(0, 2)
 
     # 启动遍历模式, dts: 遍历的时间点序列或者迭代器
     def start(self, dts, **kwargs):
@@ -665,10 +863,17 @@ class FactorTable(__QS_Object__):
         self.ErgodicMode._CacheIDNum = 0  # 当前缓存ID个数, 小于等于 self.MaxIDCacheNum
         self.ErgodicMode._FactorReadNum = pd.Series(0,
                                                     index=self.FactorNames)  # 因子读取次数, pd.Series(读取次数, index=self.FactorNames)
-        self.ErgodicMode._IDReadNum = pd.Series()  # ID读取次数, pd.Series(读取次数, index=self.FactorNames)
+        self.ErgodicMode._IDReadNum = pd.Series(dtype=np.int64)  # ID读取次数, pd.Series(读取次数, index=self.FactorNames)
         self.ErgodicMode._Queue2SubProcess = Queue()  # 主进程向数据准备子进程发送消息的管道
         self.ErgodicMode._Queue2MainProcess = Queue()  # 数据准备子进程向主进程发送消息的管道
-        if self.ErgodicMode.CacheSize > 0:
+        if (self.ErgodicMode.CacheSize > 0) and (self.ErgodicMode.ShareMode == "共享内存"):
+            if self.ErgodicMode.CacheMode == "因子":
+                self.ErgodicMode._CacheDataProcess = Process(target=_prepareSHMFactorCacheData, args=(self,), daemon=True)
+            else:
+                self.ErgodicMode._CacheDataProcess = Process(target=_prepareSHMIDCacheData, args=(self,), daemon=True)
+            self.ErgodicMode._CacheDataProcess.start()
+            self._SHMCacheData = SharedCacheReader()  # 共享内存缓冲区的读取端
+        elif self.ErgodicMode.CacheSize > 0:
             if os.name == "nt":
                 self.ErgodicMode._TagName = str(uuid.uuid1())  # 共享内存的 tag
                 self._MMAPCacheData = None
@@ -697,14 +902,17 @@ class FactorTable(__QS_Object__):
                 (not self.ErgodicMode._CacheDTs) or (
                 self.ErgodicMode._DateTimes[self.ErgodicMode._CurInd] > self.ErgodicMode._CacheDTs[-1])):  # 需要读入缓冲区的数据
             self.ErgodicMode._Queue2SubProcess.put((None, None))
-            DataLen = self.ErgodicMode._Queue2MainProcess.get()
-            CacheData = b""
-            while DataLen > 0:
-                self._MMAPCacheData.seek(0)
-                CacheData += self._MMAPCacheData.read(DataLen)
-                self.ErgodicMode._Queue2SubProcess.put(DataLen)
+            if self.ErgodicMode.ShareMode == "共享内存":
+                self.ErgodicMode._CacheData = self._SHMCacheData.load(self.ErgodicMode._Queue2MainProcess.get())
+            else:
                 DataLen = self.ErgodicMode._Queue2MainProcess.get()
-            self.ErgodicMode._CacheData = pickle.loads(CacheData)
+                CacheData = b""
+                while DataLen > 0:
+                    self._MMAPCacheData.seek(0)
+                    CacheData += self._MMAPCacheData.read(DataLen)
+                    self.ErgodicMode._Queue2SubProcess.put(DataLen)
+                    DataLen = self.ErgodicMode._Queue2MainProcess.get()
+                self.ErgodicMode._CacheData = pickle.loads(CacheData)
             if self.ErgodicMode._CurInd == PreInd + 1:  # 没有跳跃, 连续型遍历
                 self.ErgodicMode._Queue2SubProcess.put((self.ErgodicMode._CurInd, None))
                 self.ErgodicMode._CacheDTs = self.ErgodicMode._DateTimes[
@@ -733,6 +941,9 @@ class FactorTable(__QS_Object__):
         self.ErgodicMode._isStarted = False
         self.ErgodicMode._CurDT = None
         self._MMAPCacheData = None
+        if getattr(self, "_SHMCacheData", None) is not None:
+            self._SHMCacheData.close()
+            self._SHMCacheData = None
         return 0
 
     def __QS_onBackTestEndEvent__(self, event):
@@ -748,17 +959,19 @@ class FactorTable(__QS_Object__):
             RawFactorNames.add(iFactor._NameInFT)
             StartDT = min((StartDT, operation_mode._FactorStartDT[iFactor.Name]))
         EndDT = operation_mode.DateTimes[-1]
-        StartInd, EndInd = operation_mode.DTRuler.index(StartDT), operation_mode.DTRuler.index(EndDT)
+        StartInd, EndInd = getDTIndex(operation_mode.DTRuler).index(StartDT), getDTIndex(operation_mode.DTRuler).index(EndDT)
         return [(self, FactorNames, list(RawFactorNames), operation_mode.DTRuler[StartInd:EndInd + 1], {})]
 
     def __QS_saveRawData__(self, raw_data, factor_names, raw_data_dir, pid_ids, file_name, pid_lock, **kwargs):
         if raw_data is None: return 0
+        CacheFormat = kwargs.get("cache_format", "shelve")
         if isinstance(raw_data, pd.DataFrame) and ("ID" in raw_data):  # 如果原始数据有 ID 列，按照 ID 列划分后存入子进程的原始文件中
             raw_data = raw_data.set_index(["ID"])
             CommonCols = raw_data.columns.difference(factor_names).tolist()
             AllIDs = set(raw_data.index)
             for iPID, iIDs in pid_ids.items():
-                with shelve.open(raw_data_dir + os.sep + iPID + os.sep + file_name) as iFile:
+                with openCacheFile(raw_data_dir + os.sep + iPID + os.sep + file_name, "c",
+                                   CacheFormat) as iFile:
                     iInterIDs = sorted(AllIDs.intersection(iIDs))
                     iData = raw_data.loc[iInterIDs]
                     if factor_names:
@@ -769,20 +982,28 @@ class FactorTable(__QS_Object__):
                     iFile["_QS_IDs"] = iIDs
         else:  # 如果原始数据没有 ID 列，则将所有数据分别存入子进程的原始文件中
             for iPID, iIDs in pid_ids.items():
-                with shelve.open(raw_data_dir + os.sep + iPID + os.sep + file_name) as iFile:
+                with openCacheFile(raw_data_dir + os.sep + iPID + os.sep + file_name, "c",
+                                   CacheFormat) as iFile:
                     iFile["RawData"] = raw_data
                     iFile["_QS_IDs"] = iIDs
         return 0
 
-    def _genFactorDict(self, factors, factor_dict={}):
+    def _genFactorDict(self, factors, factor_dict=None):
+        if factor_dict is None: factor_dict = {}
         for iFactor in factors:
+            if (factors is not self.OperationMode._Factors) and (factor_dict.get(iFactor.Name) is iFactor): continue  # 已经解析过的因子
             iFactor._OperationMode = self.OperationMode
             if (not isinstance(iFactor.Name, str)) or (iFactor.Name == "") or (
                     iFactor is not factor_dict.get(iFactor.Name, iFactor)):  # 该因子命名错误或者未命名, 或者有因子重名
                 iFactor.Name = genAvailableName("TempFactor", factor_dict)
             factor_dict[iFactor.Name] = iFactor
             self.OperationMode._FactorID[iFactor.Name] = len(factor_dict)
-            factor_dict.update(self._genFactorDict(iFactor.Descriptors, factor_dict))
+            Descriptors = iFactor.Descriptors
+            if hasattr(iFactor, "_OperationDescriptors"):  # 结构相同的描述子合并成一个因子, 只记录在运算模式的描述子中, 不修改因子的 Descriptors
+                Descriptors = iFactor._OperationDescriptors = [
+                    self.OperationMode._FactorKeys.setdefault(self.OperationMode._FactorHasher.genKey(iDescriptor), iDescriptor)
+                    for iDescriptor in Descriptors]
+            self._genFactorDict(Descriptors, factor_dict)
         return factor_dict
 
     def _initOperation(self):
@@ -790,14 +1011,10 @@ class FactorTable(__QS_Object__):
         if not self.OperationMode.DateTimes: raise __QS_Error__("运算时点序列不能为空!")
         if not self.OperationMode.IDs: raise __QS_Error__("运算 ID 序列不能为空!")
         # 检查时点标尺是否合适
-        try:
-            DTs = pd.Series(np.arange(0, len(self.OperationMode.DTRuler)), index=list(self.OperationMode.DTRuler)).loc[
-                list(self.OperationMode.DateTimes)]
-        except:
-            raise __QS_Error__("运算时点序列超出了时点标尺!")
-        if pd.isnull(DTs).sum() > 0:
+        DTs = getDTIndex(self.OperationMode.DTRuler).getIndexer(self.OperationMode.DateTimes)
+        if (DTs < 0).any():
             raise __QS_Error__("运算时点序列超出了时点标尺!")
-        elif (DTs.diff().iloc[1:] != 1).sum() > 0:
+        elif (np.diff(DTs) != 1).any():
             raise __QS_Error__("运算时点序列的频率与时点标尺不一致!")
         # 检查因子的合法性, 解析出所有的因子(衍生因子所依赖的描述子也在内)
         if not self.OperationMode.FactorNames: self.OperationMode.FactorNames = self.FactorNames
@@ -810,10 +1027,26 @@ class FactorTable(__QS_Object__):
             self.OperationMode._Factors.append(iFactor)
             self.OperationMode._FactorDict[iFactorName] = iFactor
             self.OperationMode._FactorID[iFactorName] = i
+        self.OperationMode._FactorHasher = FactorHasher()  # 因子的结构哈希
+        self.OperationMode._FactorKeys = {}  # {结构哈希键: 因子}
+        for iFactor in self.OperationMode._Factors:
+            self.OperationMode._FactorKeys.setdefault(self.OperationMode._FactorHasher.genKey(iFactor), iFactor)
         self.OperationMode._FactorDict = self._genFactorDict(self.OperationMode._Factors,
                                                              self.OperationMode._FactorDict)
+        self.OperationMode._FactorHasher = self.OperationMode._FactorKeys = None
+        self.OperationMode._FactorDeps = genFactorDeps(self.OperationMode._FactorDict)
+        sortFactorDAG(self.OperationMode._FactorDeps)  # 检查因子之间是否存在循环依赖
+        if self.OperationMode.ResultCacheDir:
+            self.OperationMode._ResultCache = ResultCache(self.OperationMode.ResultCacheDir,
+                                                          self.OperationMode.ResultCacheSize, self.OperationMode.CacheFormat)
+            Fingerprint = FactorFingerprint()
+            self.OperationMode._FactorFingerprint = {iFactorName: Fingerprint.genFingerprint(iFactor) for iFactorName, iFactor
+                                                     in self.OperationMode._FactorDict.items()}
+        else:
+            self.OperationMode._ResultCache, self.OperationMode._FactorFingerprint = None, {}
         # 分配每个子进程的计算 ID 序列, 生成原始数据和缓存数据存储目录
-        self.OperationMode._Event = {}  # {因子名: (Sub2MainQueue, Event)}, 用于多进程同步的 Event 数据
+        self.OperationMode._Event = {}  # {因子名: Event}, 用于多进程同步的 Event 数据
+        self.OperationMode._FactorTime = {}  # {因子名: 计算耗时(秒)}
         self.OperationMode._CacheDir = tempfile.TemporaryDirectory()
         self.OperationMode._RawDataDir = self.OperationMode._CacheDir.name + os.sep + "RawData"  # 原始数据存放根目录
         self.OperationMode._CacheDataDir = self.OperationMode._CacheDir.name + os.sep + "CacheData"  # 中间数据存放根目录
@@ -921,16 +1154,80 @@ class FactorTable(__QS_Object__):
             iFactor._exit()
         return 0
 
-    # 计算因子数据并写入因子库
+    # 增量计算的时点和自身初始值, 返回: ([需要计算的时点], {因子名: 自身初始值})
+    # 所有目标因子都已存储时, 只计算最早的最新存储时点之后的时点, 回溯期由时点标尺提供
+    # 输出因子的自身回溯以已存储的数据作为初始值; 中间因子的自身回溯以及扩张窗口需要完整的历史, 此时退回全量计算
+    def _genIncrementalInfo(self, factor_names, dts, factor_db, table_name, specific_target):
+        Factors = [self.getFactor(iFactorName) for iFactorName in factor_names]
+        Stack, Visited = [iDescriptor for iFactor in Factors for iDescriptor in iFactor.Descriptors], set()
+        while Stack:
+            iFactor = Stack.pop()
+            if id(iFactor) in Visited: continue
+            Visited.add(id(iFactor))
+            if ((getattr(iFactor, "iLookBack", 0) != 0) or (getattr(iFactor, "iLookBackMode", "滚动窗口") == "扩张窗口") or
+                    ("扩张窗口" in getattr(iFactor, "LookBackMode", []))):
+                self._QS_Logger.warning("因子 '%s' 依赖完整的历史数据, 增量计算退回全量计算!" % (iFactor.Name,))
+                return dts, {}
+            Stack.extend(iFactor.Descriptors)
+        LastDT, Targets = None, {}
+        for iFactor in Factors:  # 输出因子的滚动自身回溯由已存储的数据初始化, 扩张窗口需要完整的历史数据
+            if (getattr(iFactor, "iLookBackMode", "滚动窗口") == "扩张窗口") or ("扩张窗口" in getattr(iFactor, "LookBackMode", [])):
+                self._QS_Logger.warning("因子 '%s' 依赖完整的历史数据, 增量计算退回全量计算!" % (iFactor.Name,))
+                return dts, {}
+            iDB, iTableName, iTargetFactorName = specific_target.get(iFactor.Name, (None, None, None))
+            if iDB is None: iDB = factor_db
+            if iTableName is None: iTableName = table_name
+            if iTargetFactorName is None: iTargetFactorName = iFactor.Name
+            if iTableName not in iDB.TableNames: return dts, {}
+            iFT = iDB.getTable(iTableName)
+            if iTargetFactorName not in iFT.FactorNames: return dts, {}
+            iDTs = iFT.getDateTime(ifactor_name=iTargetFactorName, end_dt=dts[-1])
+            if not iDTs: return dts, {}
+            Targets[iFactor.Name] = (iFT, iTargetFactorName, iDTs)
+            LastDT = (iDTs[-1] if LastDT is None else min(LastDT, iDTs[-1]))
+        NewDTs = [iDT for iDT in dts if iDT > LastDT]
+        InitData = {}
+        for iFactor in Factors:
+            iLookBack = getattr(iFactor, "iLookBack", 0)
+            if (iLookBack == 0) or (iFactor.iInitData is not None) or (not NewDTs): continue
+            iFT, iTargetFactorName, iDTs = Targets[iFactor.Name]
+            iDTs = [iDT for iDT in iDTs if iDT < NewDTs[0]][-iLookBack:]
+            if iDTs: InitData[iFactor.Name] = iFT.readData(factor_names=[iTargetFactorName], ids=self.OperationMode.IDs, dts=iDTs).iloc[0]
+        return NewDTs, InitData
+
+    # 计算因子数据并写入因子库, incremental: 是否增量计算, 为 True 时只计算目标表中已存储的最新时点之后的时点
 
     def write2FDB(self, factor_names, ids, dts, factor_db, table_name, if_exists="update",
-                  subprocess_num=cpu_count() - 1, dt_ruler=None, section_ids=None, specific_target={}, **kwargs):
+                  subprocess_num=cpu_count() - 1, dt_ruler=None, section_ids=None, specific_target={}, incremental=False,
+                  **kwargs):
         if not isinstance(factor_db, WritableFactorDB): raise __QS_Error__("因子数据库: %s 不可写入!" % factor_db.Name)
         print("==========因子运算==========", "1. 原始数据准备", sep="\n", end="\n")
         TotalStartT = time.perf_counter()
         self.OperationMode.SubProcessNum = subprocess_num
         self.OperationMode.DTRuler = (dts if dt_ruler is None else dt_ruler)
         self.OperationMode.SectionIDs = section_ids
+        self.OperationMode.CacheFormat = kwargs.get("cache_format", self.OperationMode.CacheFormat)
+        self.OperationMode.ThreadNum = kwargs.get("thread_num", self.OperationMode.ThreadNum)
+        self.OperationMode.ResultCacheDir = kwargs.get("result_cache_dir", self.OperationMode.ResultCacheDir)
+        self.OperationMode.ResultCacheSize = kwargs.get("result_cache_size", self.OperationMode.ResultCacheSize)
+        self.OperationMode.WriteMemoryLimit = kwargs.get("memory_limit", self.OperationMode.WriteMemoryLimit)
+        InitData = {}
+        if incremental:
+            self.OperationMode.IDs = ids
+            dts, InitData = self._genIncrementalInfo((factor_names if factor_names else self.FactorNames), list(dts),
+                                                     factor_db, table_name, specific_target)
+            if not dts:
+                print("没有需要增量计算的时点", "=" * 28, sep="\n", end="\n")
+                return 0
+            for iFactorName, iInitData in InitData.items(): self.getFactor(iFactorName).iInitData = iInitData
+        try:
+            return self._write2FDB(factor_names, ids, dts, factor_db, table_name, if_exists, specific_target,
+                                   start_t=TotalStartT)
+        finally:
+            for iFactorName in InitData: self.getFactor(iFactorName).iInitData = None
+
+    def _write2FDB(self, factor_names, ids, dts, factor_db, table_name, if_exists, specific_target, start_t):
+        TotalStartT = start_t
         self._prepare(factor_names, ids, dts)
         print(("耗时 : %.2f" % (time.perf_counter() - TotalStartT,)), "2. 因子数据计算", end="\n", sep="\n")
         StartT = time.perf_counter()
@@ -941,31 +1238,37 @@ class FactorTable(__QS_Object__):
         else:
             nPrcs = len(self.OperationMode._PIDs)
             nTask = len(self.OperationMode._Factors) * nPrcs
-            EventState = {iFactorName: 0 for iFactorName in self.OperationMode._Event}
+            EventState = {iFactorName: 0 for iFactorName in self.OperationMode._Event}  # {因子名: 已到达同步点的进程数}
+            FactorTime = self.OperationMode._FactorTime
             Procs, Main2SubQueue, Sub2MainQueue = startMultiProcess(pid="0", n_prc=nPrcs, target_fun=_calculate,
                                                                     arg=Args,
                                                                     main2sub_queue="None", sub2main_queue="Single")
             iProg = 0
             with ProgressBar(max_value=nTask) as ProgBar:
-                while True:
-                    nEvent = len(EventState)
-                    if nEvent > 0:
-                        FactorNames = tuple(EventState.keys())
-                        for iFactorName in FactorNames:
-                            iQueue = self.OperationMode._Event[iFactorName][0]
-                            while not iQueue.empty():
-                                jInc = iQueue.get()
-                                EventState[iFactorName] += jInc
-                            if EventState[iFactorName] >= nPrcs:
-                                self.OperationMode._Event[iFactorName][1].set()
-                                EventState.pop(iFactorName)
-                    while ((not Sub2MainQueue.empty()) or (nEvent == 0)) and (iProg < nTask):
-                        iPID, iSubProg, iMsg = Sub2MainQueue.get()
+                while iProg < nTask:
+                    # 阻塞等待子进程的消息, 超时仅用于检查子进程是否异常退出
+                    try:
+                        iPID, iSubProg, iMsg = Sub2MainQueue.get(timeout=1)
+                    except queue.Empty:
+                        Failed = [iPID for iPID, iPrcs in Procs.items() if iPrcs.exitcode not in (None, 0)]
+                        if Failed:
+                            for iPrcs in Procs.values(): iPrcs.terminate()
+                            raise __QS_Error__("因子运算子进程 %s 异常退出!" % (", ".join(Failed),))
+                        continue
+                    if iMsg is not None:
+                        if iMsg[0] == "Barrier":
+                            EventState[iMsg[1]] += 1
+                            if EventState[iMsg[1]] >= nPrcs: self.OperationMode._Event[iMsg[1]].set()
+                        elif iMsg[0] == "Timing":
+                            FactorTime[iMsg[1]] = FactorTime.get(iMsg[1], 0) + iMsg[2]
+                    if iSubProg:
                         iProg += iSubProg
                         ProgBar.update(iProg)
-                    if iProg >= nTask: break
             for iPID, iPrcs in Procs.items(): iPrcs.join()
-        print(("耗时 : %.2f" % (time.perf_counter() - StartT,)), "3. 清理缓存", end="\n", sep="\n")
+        print(("耗时 : %.2f" % (time.perf_counter() - StartT,)), end="\n")
+        SlowFactors = sorted(self.OperationMode._FactorTime.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        if SlowFactors: print("耗时最长的因子 : " + ", ".join("%s(%.2f)" % iFactorTime for iFactorTime in SlowFactors))
+        print("3. 清理缓存", end="\n")
         StartT = time.perf_counter()
         factor_db.connect()
         self._exit()
@@ -1045,19 +1348,21 @@ class CustomFT(FactorTable):
         return eval("temp[" + CompiledFilterStr + "].index.tolist()")
 
     def __QS_calcData__(self, raw_data, factor_names, ids, dts, args={}):
-        return pd.Panel({iFactorName: self._Factors[iFactorName].readData(ids=ids, dts=dts, dt_ruler=self._DateTimes,
-                                                                          section_ids=self._IDs) for iFactorName in
-                         factor_names}).loc[factor_names]
+        return FactorPanel({iFactorName: self._Factors[iFactorName].readData(ids=ids, dts=dts, dt_ruler=self._DateTimes,
+                                                                             section_ids=self._IDs) for iFactorName in
+                            factor_names}, items=factor_names)
 
     def write2FDB(self, factor_names, ids, dts, factor_db, table_name, if_exists="update",
-                  subprocess_num=cpu_count() - 1, dt_ruler=None, section_ids=None, specific_target={}, **kwargs):
+                  subprocess_num=cpu_count() - 1, dt_ruler=None, section_ids=None, specific_target={}, incremental=False,
+                  **kwargs):
         if dt_ruler is None: dt_ruler = self._DateTimes
         if not dt_ruler: dt_ruler = None
         if section_ids is None: section_ids = self._IDs
         if (not section_ids) or (section_ids == ids): section_ids = None
 
         return super().write2FDB(factor_names, ids, dts, factor_db, table_name, if_exists, subprocess_num,
-                                 dt_ruler=dt_ruler, section_ids=section_ids, specific_target=specific_target, **kwargs)
+                                 dt_ruler=dt_ruler, section_ids=section_ids, specific_target=specific_target,
+                                 incremental=incremental, **kwargs)
 
     # ---------------新的接口------------------
     # 添加因子, factor_list: 因子对象列表
@@ -1140,6 +1445,7 @@ def Factorize(factor_object, factor_name, args={}, **kwargs):
     return factor_object
 
 
+# 未编译的运算符, 运算符重载已经改用 FactorCompiler.evalExpr, 保留以兼容已有的因子对象
 def _UnitaryOperator(f, idt, iid, x, args):
     Fun = args.get("Fun", None)
     if Fun is not None:
@@ -1268,7 +1574,7 @@ class Factor(__QS_Object__):
         return []
 
     # --------------------------------数据读取---------------------------------
-    # 读取数据, 返回: Panel(item=[因子], major_axis=[时间点], minor_axis=[ID])
+    # 读取数据, 返回: FactorPanel(item=[因子], major_axis=[时间点], minor_axis=[ID])
     def readData(self, ids, dts, **kwargs):
         if not self._isStarted: return \
             self._FactorTable.readData(factor_names=[self._NameInFT], ids=ids, dts=dts, args=self.Args).loc[
@@ -1285,7 +1591,7 @@ class Factor(__QS_Object__):
                 self._FactorTable.readData(factor_names=[self._NameInFT], ids=self._CacheData.columns.tolist(),
                                            dts=NewDTs,
                                            args=self.Args).loc[self._NameInFT]
-            self._CacheData = self._CacheData.append(NewCacheData).loc[dts]
+            self._CacheData = pd.concat([self._CacheData, NewCacheData]).loc[dts]
         NewIDs = sorted(set(ids).difference(self._CacheData.columns))
         if NewIDs:
             NewCacheData = \
@@ -1308,11 +1614,12 @@ class Factor(__QS_Object__):
     def __QS_prepareCacheData__(self, ids=None):
         StartDT = self._OperationMode._FactorStartDT[self.Name]
         EndDT = self._OperationMode.DateTimes[-1]
-        StartInd, EndInd = self._OperationMode.DTRuler.index(StartDT), self._OperationMode.DTRuler.index(EndDT)
+        StartInd, EndInd = getDTIndex(self._OperationMode.DTRuler).index(StartDT), getDTIndex(self._OperationMode.DTRuler).index(EndDT)
         DTs = self._OperationMode.DTRuler[StartInd:EndInd + 1]
         RawDataFilePath = self._OperationMode._RawDataDir + os.sep + self._OperationMode._iPID + os.sep + self._RawDataFile
-        if os.path.isfile(RawDataFilePath + self._OperationMode._FileSuffix):
-            with shelve.open(RawDataFilePath, "r") as File:
+        RawDataFormat = detectCacheFormat(RawDataFilePath, self._OperationMode.CacheFormat)
+        if RawDataFormat is not None:
+            with openCacheFile(RawDataFilePath, "r", RawDataFormat) as File:
                 PrepareIDs = File["_QS_IDs"]
                 if self._NameInFT in File:
                     RawData = File[self._NameInFT]
@@ -1342,9 +1649,9 @@ class Factor(__QS_Object__):
                 self._FactorTable.readData(factor_names=[self._NameInFT], ids=PrepareIDs, dts=DTs, args=self.Args).iloc[
                     0]
         with self._OperationMode._PID_Lock[self._OperationMode._iPID]:
-            with shelve.open(
+            with openCacheFile(
                     self._OperationMode._CacheDataDir + os.sep + self._OperationMode._iPID + os.sep + self.Name + str(
-                        self._OperationMode._FactorID[self.Name])) as CacheFile:
+                        self._OperationMode._FactorID[self.Name]), "c", self._OperationMode.CacheFormat) as CacheFile:
                 CacheFile["StdData"] = StdData
                 CacheFile["_QS_IDs"] = PrepareIDs
         self._isCacheDataOK = True
@@ -1369,27 +1676,23 @@ class Factor(__QS_Object__):
         else:
             StdData = None
             # IDs = []
+        dts = list(dts)
+        StdData = ([] if StdData is None else [StdData.loc[dts]])
         while len(pids) > 0:
             iPID = pids.pop()
             iFilePath = self._OperationMode._CacheDataDir + os.sep + iPID + os.sep + self.Name + str(
                 self._OperationMode._FactorID[self.Name])
-            if not os.path.isfile(iFilePath + self._OperationMode._FileSuffix):  # 该进程的数据没有准备好
+            if not isCacheFile(iFilePath, self._OperationMode.CacheFormat):  # 该进程的数据没有准备好
                 pids.add(iPID)
                 continue
             with self._OperationMode._PID_Lock[iPID]:
-                with shelve.open(iFilePath, 'r') as CacheFile:
-                    iStdData = CacheFile["StdData"]
-                    # IDs.extend(CacheFile.get("_QS_IDs", self._OperationMode._PID_IDs[iPID]))
-            if StdData is None:
-                StdData = iStdData
-            else:
-                StdData = pd.merge(StdData, iStdData, how='inner', left_index=True, right_index=True)
-        if not AllPID:
-            StdData = StdData.loc[list(dts), :]
-        elif self._OperationMode._FactorPrepareIDs[self.Name] is None:
-            StdData = StdData.loc[list(dts), self._OperationMode.IDs]
-        else:
-            StdData = StdData.loc[list(dts), self._OperationMode._FactorPrepareIDs[self.Name]]
+                with openCacheFile(iFilePath, "r", self._OperationMode.CacheFormat) as CacheFile:
+                    StdData.append(readCacheData(CacheFile, "StdData", dts=dts))
+        # 各进程的数据只在最后拼接一次, 避免逐个 merge 产生的多次拷贝
+        StdData = (StdData[0] if len(StdData) == 1 else pd.concat(StdData, axis=1, join="inner"))
+        if AllPID:
+            PrepareIDs = self._OperationMode._FactorPrepareIDs[self.Name]
+            StdData = StdData.loc[:, (self._OperationMode.IDs if PrepareIDs is None else PrepareIDs)]
         gc.collect()
         return StdData
 
@@ -1452,189 +1755,189 @@ class Factor(__QS_Object__):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "add"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __radd__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "add"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __sub__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "sub"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rsub__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "sub"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __mul__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "mul"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rmul__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "mul"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __pow__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "pow"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rpow__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "pow"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __truediv__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "div"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rtruediv__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "div"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __floordiv__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "floordiv"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rfloordiv__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "floordiv"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __mod__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "mod"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rmod__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "mod"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __and__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "and"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rand__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "and"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __or__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "or"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __ror__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "or"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __xor__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "xor"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __rxor__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genRBinaryOperatorInfo(other)
         Args["OperatorType"] = "xor"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __lt__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "<"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __le__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "<="
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __eq__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "=="
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __ne__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = "!="
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __gt__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = ">"
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __ge__(self, other):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genBinaryOperatorInfo(other)
         Args["OperatorType"] = ">="
-        return PointOperation("", Descriptors, {"算子": _BinaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __neg__(self):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genUnitaryOperatorInfo()
         Args["OperatorType"] = "neg"
-        return PointOperation("", Descriptors, {"算子": _UnitaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __pos__(self):
@@ -1644,21 +1947,21 @@ class Factor(__QS_Object__):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genUnitaryOperatorInfo()
         Args["OperatorType"] = "abs"
-        return PointOperation("", Descriptors, {"算子": _UnitaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
     def __invert__(self):
         from QuantStudio.FactorDataBase.FactorOperation import PointOperation
         Descriptors, Args = self._genUnitaryOperatorInfo()
         Args["OperatorType"] = "not"
-        return PointOperation("", Descriptors, {"算子": _UnitaryOperator, "参数": Args, "运算时点": "多时点", "运算ID": "多ID"},
+        return PointOperation("", Descriptors, {"算子": evalExpr, "参数": compileExpr(Args), "运算时点": "多时点", "运算ID": "多ID"},
                               logger=self._QS_Logger)
 
 
 # 直接赋予数据产生的因子
 # data: DataFrame(index=[时点], columns=[ID])
 class DataFactor(Factor):
-    DataType = Enum("double", "string", "object", arg_type="SingleOption", label="数据类型", order=0)
+    DataType = Enum(*DATA_TYPES, arg_type="SingleOption", label="数据类型", order=0)
     LookBack = Int(0, arg_type="Integer", label="回溯天数", order=1)
 
     def __init__(self, name, data, sys_args={}, config_file=None, **kwargs):
@@ -1677,7 +1980,9 @@ class DataFactor(Factor):
                     sys_args["数据类型"] = "double"
         elif isinstance(data, pd.DataFrame):
             self._DataContent = "Factor"
-            if "数据类型" not in sys_args:
+            if ("数据类型" not in sys_args) and isCategoryFrame(data):
+                sys_args["数据类型"] = "category"
+            elif "数据类型" not in sys_args:
                 try:
                     data = data.astype(np.float)
                 except:
@@ -1736,7 +2041,7 @@ class DataFactor(Factor):
         else:
             Data = self._Data
         if (Data.columns.intersection(ids).shape[0] == 0) or (Data.index.intersection(dts).shape[0] == 0):
-            return pd.DataFrame(index=dts, columns=ids, dtype=("O" if self.DataType != "double" else np.float))
+            return genEmptyFrame(dts, ids, self.DataType)
         if self.LookBack == 0:
             return Data.loc[dts, ids]
         else:
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""因子数据类型"""
+import numpy as np
+import pandas as pd
+
+# 因子的数据类型
+# double: float64
+# string, object: Python 对象
+# category: 字典编码的对象数据, DataFrame 的各列为共享同一 CategoricalDtype 的 Categorical, 缓存中存储为 int32 编码和一份字典
+# record: 多字段浮点数据, 字段由因子的 TempData["dtype"] 描述, 算子可以直接返回结构化数组, 缓存中存储为结构化数组, DataFrame 中为 tuple
+DATA_TYPES = ("double", "string", "object", "category", "record")
+
+# 写入因子库时使用的数据类型
+STORAGE_DATA_TYPES = {"category": "string", "record": "object"}
+
+
+# 计算结果的初始数组
+def genStdData(shape, data_type="double"):
+    if data_type == "double": return np.full(shape=shape, fill_value=np.nan, dtype="float")
+    return np.full(shape=shape, fill_value=None, dtype="O")
+
+
+# 空的因子数据
+def genEmptyFrame(index, columns, data_type="double"):
+    if index is None: return pd.DataFrame(columns=columns, dtype=("float" if data_type == "double" else "O"))
+    return pd.DataFrame(index=index, columns=columns, dtype=("float" if data_type == "double" else "O"))
+
+
+# 由编码和字典生成 category 类型的因子数据, codes: array(shape=(nDT, nID)), -1 表示缺失
+def fromCodes(codes, categories, index, columns):
+    DType = pd.CategoricalDtype(categories)
+    Data = pd.DataFrame({i: pd.Categorical.from_codes(codes[:, i], dtype=DType) for i in range(codes.shape[1])},
+                        index=range(codes.shape[0]))
+    Data.index, Data.columns = index, columns
+    return Data
+
+
+# 字典编码, 返回: (array(int32), Index), None 和 nan 编码为 -1
+def encodeCategory(data):
+    if isinstance(data, pd.DataFrame) and (data.shape[1] > 0) and all(isinstance(iDType, pd.CategoricalDtype) for iDType in data.dtypes):
+        DTypes = set(data.dtypes)
+        if len(DTypes) == 1:
+            return np.column_stack([data.iloc[:, i].cat.codes.values for i in range(data.shape[1])]).astype(np.int32), DTypes.pop().categories
+    Data = np.asarray(data, dtype="O")
+    Codes, Categories = pd.factorize(Data.ravel())
+    return Codes.astype(np.int32).reshape(Data.shape), Categories
+
+
+def toCategoryFrame(data, index, columns):
+    Codes, Categories = encodeCategory(data)
+    return fromCodes(Codes.reshape((len(index), len(columns))), Categories, index, columns)
+
+
+def isCategoryFrame(data):
+    return (data.shape[1] > 0) and all(isinstance(iDType, pd.CategoricalDtype) for iDType in data.dtypes)
+
+
+# 转换成结构化数组, data: 结构化数组或者 tuple 的对象数组, None 转换成各字段均为 nan
+def toRecordArray(data, dtype):
+    return np.asarray(data).astype(np.dtype(dtype))
+
+
+# 结构化数组转换成 tuple 的对象数组
+def fromRecordArray(data):
+    Rslt = np.empty(data.shape, dtype="O")
+    Rslt.ravel()[:] = data.ravel().tolist()
+    return Rslt
+
+
+# 由计算结果生成因子数据 DataFrame(index=[时点], columns=[ID]), dtype: record 类型的字段描述
+# record 类型的 DataFrame 在 attrs["dtype"] 中记录字段描述, 缓存据此按结构化数组存储
+def genStdFrame(data, index, columns, data_type="double", dtype=None):
+    if data_type == "category": return toCategoryFrame(data, index, columns)
+    Data = np.asarray(data)
+    if (data_type == "record") and (dtype is not None):
+        Data = pd.DataFrame(fromRecordArray(toRecordArray(Data, dtype)), index=index, columns=columns)
+        Data.attrs["dtype"] = np.dtype(dtype).descr
+        return Data
+    elif Data.dtype.names is not None:
+        Data = fromRecordArray(Data)
+    return pd.DataFrame(Data, index=index, columns=columns)
+
+
+# 写入因子库前的转换, 返回: (因子数据, 数据类型)
+def toStorage(data, data_type):
+    if (data_type == "category") and (data is not None): data = data.astype("O").where(data.notnull(), None)
+    return data, STORAGE_DATA_TYPES.get(data_type, data_type)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""运算模式下的因子依赖图"""
+import datetime as dt
+import hashlib
+import heapq
+import types
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+
+
+# 因子的结构哈希, 算子, 参数以及描述子的结构都相同的两个因子视为同一个因子, 只需要计算一次
+# 因子名不参与哈希, 因此以不同的名称(比如 uuid)重复构造的中间因子能够合并
+class FactorHasher(object):
+    def __init__(self):
+        self._FactorKeys = {}  # {id(因子): 键}
+        self._KeyIDs = {}  # {结构: 键}, 键为 int, 以免嵌套的结构过深
+        self._Refs = []  # 保留参与哈希的对象的引用, 避免 id 被复用
+
+    def _genID(self, structure):
+        return self._KeyIDs.setdefault(structure, len(self._KeyIDs))
+
+    # 返回因子的键, int
+    def genKey(self, factor):
+        Key = self._FactorKeys.get(id(factor))
+        if Key is not None: return Key
+        self._Refs.append(factor)
+        Descriptors = factor.Descriptors
+        if factor.FactorTable is not None:  # 因子表中的因子
+            Structure = ("Factor", type(factor).__name__, id(factor.FactorTable), factor._NameInFT, self._freeze(factor.Args))
+        elif Descriptors or hasattr(factor, "Operator"):  # 衍生因子
+            Structure = (type(factor).__module__, type(factor).__name__, self._freeze(factor.Args),
+                         tuple(self.genKey(iDescriptor) for iDescriptor in Descriptors))
+        else:  # 其他因子, 比如直接赋予数据的因子, 以对象区分
+            Structure = ("Object", id(factor))
+        Key = self._FactorKeys[id(factor)] = self._genID(Structure)
+        return Key
+
+    # 将参数转换成可哈希的结构
+    def _freeze(self, value):
+        if isinstance(value, dict):
+            return ("dict",) + tuple((repr(iKey), self._freeze(iVal)) for iKey, iVal in sorted(value.items(), key=lambda kv: repr(kv[0])))
+        elif isinstance(value, (list, tuple)):
+            return (type(value).__name__,) + tuple(self._freeze(iVal) for iVal in value)
+        elif isinstance(value, np.ndarray) and (value.dtype != np.dtype("O")):
+            return ("ndarray", value.dtype.str, value.shape, hashlib.md5(np.ascontiguousarray(value).tobytes()).hexdigest())
+        elif isinstance(value, (str, bytes)) or (value is None):
+            return value
+        elif isinstance(value, (bool, int, float, complex, np.number, np.bool_)):
+            return (type(value).__name__, repr(value))
+        elif hasattr(value, "Descriptors") and hasattr(value, "FactorTable"):  # 参数中的因子
+            return ("Factor", self.genKey(value))
+        self._Refs.append(value)
+        return ("Object", id(value))  # 函数以及其他对象以对象区分
+
+
+# 因子树的指纹, 与 FactorHasher 不同, 指纹只依赖于因子的结构和参数的内容, 在不同的运行和进程之间保持稳定
+# 因子表中的因子以因子库名, 因子表名, 因子名, 参数以及因子表的版本(元数据 Version)标识, 因子表没有版本时不能缓存, 以免源数据更新后读到旧的结果
+# 函数以模块, 名称, 字节码, 常量, 默认参数, 闭包变量以及引用的全局变量标识
+# 参数中含有无法稳定标识的对象时返回 None, 表示该因子不能跨运行缓存
+class FactorFingerprint(object):
+    def __init__(self):
+        self._Fingerprints = {}  # {id(因子): 指纹}
+        self._Refs = []  # 保留参与计算的因子的引用, 避免 id 被复用
+        self._Functions = set()  # 正在标识的函数的 id, 用于处理函数之间的递归引用
+
+    def genFingerprint(self, factor):
+        if id(factor) in self._Fingerprints: return self._Fingerprints[id(factor)]
+        self._Refs.append(factor)
+        try:
+            FT = factor.FactorTable
+            if FT is not None:  # 因子表中的因子
+                FDB, Version = FT.FactorDB, FT.getMetaData(key="Version")
+                if Version is None: raise TypeError(FT.Name)
+                Structure = ("Factor", type(FT).__name__, (FDB.Name if FDB is not None else None), FT.Name,
+                             factor._NameInFT, self._freeze(factor.Args), self._freeze(Version))
+            elif factor.Descriptors or hasattr(factor, "Operator"):  # 衍生因子
+                Structure = (type(factor).__module__, type(factor).__name__, self._freeze(factor.Args),
+                             tuple(self._freezeFactor(iDescriptor) for iDescriptor in factor.Descriptors))
+            else:
+                raise TypeError(type(factor).__name__)
+            Fingerprint = hashlib.md5(repr(Structure).encode("utf-8")).hexdigest()
+        except TypeError:  # 无法稳定标识
+            Fingerprint = None
+        self._Fingerprints[id(factor)] = Fingerprint
+        return Fingerprint
+
+    def _freezeFactor(self, factor):
+        Fingerprint = self.genFingerprint(factor)
+        if Fingerprint is None: raise TypeError(factor.Name)
+        return ("Factor", Fingerprint)
+
+    # 将参数转换成 repr 稳定的结构, 无法转换时抛出 TypeError
+    def _freeze(self, value):
+        if isinstance(value, dict):
+            return ("dict",) + tuple(sorted((repr(iKey), self._freeze(iVal)) for iKey, iVal in value.items()))
+        elif isinstance(value, (list, tuple)):
+            return (type(value).__name__,) + tuple(self._freeze(iVal) for iVal in value)
+        elif isinstance(value, np.ndarray) and (value.dtype != np.dtype("O")):
+            return ("ndarray", value.dtype.str, value.shape, hashlib.md5(np.ascontiguousarray(value).tobytes()).hexdigest())
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            return (type(value).__name__, repr(getattr(value, "columns", value.name)),
+                    hashlib.md5(pd.util.hash_pandas_object(value, index=True).values.tobytes()).hexdigest())
+        elif isinstance(value, (str, bytes, bool, int, float, complex, np.number, np.bool_, dt.date, dt.timedelta)) or (value is None):
+            return (type(value).__name__, repr(value))
+        elif hasattr(value, "Descriptors") and hasattr(value, "FactorTable"):  # 参数中的因子
+            return self._freezeFactor(value)
+        elif isinstance(value, np.ufunc):
+            return ("ufunc", value.__name__)
+        elif hasattr(value, "__code__"):  # 函数
+            return self._freezeFunction(value)
+        elif isinstance(value, types.ModuleType):
+            return ("module", value.__name__)
+        elif isinstance(value, type) or (hasattr(value, "__module__") and hasattr(value, "__qualname__")):  # 类, 内置函数
+            return ("object", getattr(value, "__module__", None), value.__qualname__)
+        raise TypeError(type(value).__name__)
+
+    def _freezeCode(self, code):
+        return (hashlib.md5(code.co_code).hexdigest(), code.co_names,
+                tuple((self._freezeCode(iConst) if isinstance(iConst, types.CodeType) else self._freeze(iConst)) for iConst in code.co_consts))
+
+    # 闭包变量和引用的全局变量按值标识, 引用的全局函数递归标识, 递归引用自身时只以模块和名称标识
+    def _freezeFunction(self, fun):
+        if id(fun) in self._Functions: return ("function", fun.__module__, fun.__qualname__)
+        self._Functions.add(id(fun))
+        try:
+            Code, Globals = fun.__code__, getattr(fun, "__globals__", {})
+            try:
+                Closure = tuple(iCell.cell_contents for iCell in (fun.__closure__ or ()))
+            except ValueError:  # 闭包变量尚未赋值
+                raise TypeError(fun.__qualname__)
+            return ("function", fun.__module__, fun.__qualname__, self._freezeCode(Code), self._freeze(fun.__defaults__),
+                    self._freeze(fun.__kwdefaults__), self._freeze(Closure),
+                    tuple((iName, self._freeze(Globals[iName])) for iName in Code.co_names if iName in Globals))
+        finally:
+            self._Functions.discard(id(fun))
+
+
+# 生成因子的依赖关系, factor_dict: {因子名: 因子}, 返回: {因子名: [描述子名]}
+# 运算模式下合并了结构相同描述子的因子以其运算描述子(_QS_Descriptors)为依赖
+def genFactorDeps(factor_dict):
+    Names = {id(iFactor): iName for iName, iFactor in factor_dict.items()}
+    return {iName: [Names[id(iDescriptor)] for iDescriptor in getattr(iFactor, "_QS_Descriptors", iFactor.Descriptors)
+                    if id(iDescriptor) in Names]
+            for iName, iFactor in factor_dict.items()}
+
+
+# 反向的依赖关系, 返回: ({节点: [依赖该节点的节点]}, {节点: 尚未完成的依赖数})
+def _genChildren(deps):
+    Children = {iNode: [] for iNode in deps}
+    nPending = {}
+    for iNode, iDeps in deps.items():
+        iDeps = set(iDeps)
+        nPending[iNode] = len(iDeps)
+        for jNode in iDeps: Children[jNode].append(iNode)
+    return Children, nPending
+
+
+# 依赖图的拓扑排序, deps: {节点: [依赖的节点]}, 返回: [节点], 依赖的节点在前, 同一层级的节点保持 deps 中的顺序
+def sortFactorDAG(deps):
+    Rank = {iNode: i for i, iNode in enumerate(deps)}
+    Children, nPending = _genChildren(deps)
+    Ready = [(Rank[iNode], iNode) for iNode, n in nPending.items() if n == 0]
+    heapq.heapify(Ready)
+    Order = []
+    while Ready:
+        _, iNode = heapq.heappop(Ready)
+        Order.append(iNode)
+        for jNode in Children[iNode]:
+            nPending[jNode] -= 1
+            if nPending[jNode] == 0: heapq.heappush(Ready, (Rank[jNode], jNode))
+    if len(Order) < len(deps):
+        from QuantStudio import __QS_Error__
+        raise __QS_Error__("因子之间存在循环依赖: %s" % (", ".join(str(iNode) for iNode in deps if iNode not in Order),))
+    return Order
+
+
+# 裁剪依赖图, 只保留需要执行的节点, deps: {节点: [依赖的节点]}, outputs: 输出节点, is_hit: 判断节点是否命中结果缓存的函数
+# 命中的节点直接读取缓存, 不需要执行其依赖的节点; keep: 必须保留的节点(比如各进程需要一致到达的同步节点)
+# 返回: {节点: [依赖的节点]}, 只包含输出节点, 保留的节点以及未命中的节点所依赖的节点
+def pruneFactorDAG(deps, outputs, is_hit, keep=()):
+    Needed = set(outputs) | set(keep)
+    for iNode in reversed(sortFactorDAG(deps)):
+        if (iNode in Needed) and ((iNode in keep) or (not is_hit(iNode))): Needed.update(deps[iNode])
+    return {iNode: [jNode for jNode in iDeps if jNode in Needed] for iNode, iDeps in deps.items() if iNode in Needed}
+
+
+# 按照依赖图调度执行, deps: {节点: [依赖的节点]}, run_fun: 执行节点的函数, run_fun(节点)
+# barriers: 截面同步节点, 需要所有进程到达后才能完成, 这些节点按照拓扑序逐个执行, 以保证各进程到达同步点的顺序一致
+# 其余节点在依赖完成后即提交到线程池, 等待同步的同时其他无关的节点继续计算
+# thread_num: 线程池的大小, 不含执行同步节点的线程; 不大于 1 时在当前线程按照拓扑序依次执行
+# 大于 1 时多个因子的算子会在不同的线程中同时执行, 算子及其读取的数据源需要是线程安全的
+def runFactorDAG(deps, run_fun, barriers=(), thread_num=1):
+    Order = sortFactorDAG(deps)
+    if thread_num <= 1:
+        for iNode in Order: run_fun(iNode)
+        return Order
+    Rank = {iNode: i for i, iNode in enumerate(Order)}
+    Children, nPending = _genChildren(deps)
+    BarrierSet = set(barriers)
+    Barriers = [iNode for iNode in Order if iNode in BarrierSet]  # 同步节点的执行顺序
+    iBarrier, BarrierReady, BarrierRunning = 0, set(), False
+    Ready = [Rank[iNode] for iNode, n in nPending.items() if n == 0]
+    heapq.heapify(Ready)
+    Running, Finished = {}, []  # {Future: 节点}, [已完成的节点]
+    with ThreadPoolExecutor(max_workers=thread_num) as Executor, ThreadPoolExecutor(max_workers=1) as BarrierExecutor:
+        while True:
+            while Ready:
+                iNode = Order[heapq.heappop(Ready)]
+                if iNode in BarrierSet:
+                    BarrierReady.add(iNode)
+                else:
+                    Running[Executor.submit(run_fun, iNode)] = iNode
+            if (not BarrierRunning) and (iBarrier < len(Barriers)) and (Barriers[iBarrier] in BarrierReady):
+                Running[BarrierExecutor.submit(run_fun, Barriers[iBarrier])] = Barriers[iBarrier]
+                BarrierRunning = True
+            if not Running: break
+            Done, _ = wait(Running, return_when=FIRST_COMPLETED)
+            for iFuture in Done:
+                iNode = Running.pop(iFuture)
+                iFuture.result()  # 节点执行出错时抛出异常
+                Finished.append(iNode)
+                if iNode in BarrierSet:
+                    iBarrier += 1
+                    BarrierRunning = False
+                for jNode in Children[iNode]:
+                    nPending[jNode] -= 1
+                    if nPending[jNode] == 0: heapq.heappush(Ready, Rank[jNode])
+    return Finished
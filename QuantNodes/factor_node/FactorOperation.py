@@ -3,14 +3,19 @@
 import numpy as np
 import os
 import pandas as pd
-import shelve
-from multiprocessing import Queue, Event, Lock
+from multiprocessing import Event, Lock
 from traits.api import Function, Dict, Enum, List, Int, Instance
 
 from QuantStudio import __QS_Error__
 from QuantStudio.FactorDataBase.FactorDB import Factor
 from QuantStudio.Tools.AuxiliaryFun import partitionList, partitionListMovingSampling
 
+from QuantNodes.factor_node.DTIndex import getDTIndex
+from QuantNodes.factor_node.FactorCache import openCacheFile
+from QuantNodes.factor_node.FactorDType import DATA_TYPES, genStdData, genStdFrame, genEmptyFrame
+from QuantNodes.factor_node.PointKernel import POINT_MODES, calcPointData
+from QuantNodes.factor_node.RollingKernel import genWindows
+
 
 def _DefaultOperator(f, idt, iid, x, args):
     return np.nan
@@ -19,10 +24,11 @@ def _DefaultOperator(f, idt, iid, x, args):
 class DerivativeFactor(Factor):
     Operator = Function(default_value=_DefaultOperator, arg_type="Function", label="算子", order=0)
     ModelArgs = Dict(arg_type="Dict", label="参数", order=1)
-    DataType = Enum("double", "string", "object", arg_type="SingleOption", label="数据类型", order=2)
+    DataType = Enum(*DATA_TYPES, arg_type="SingleOption", label="数据类型", order=2)
 
     def __init__(self, name="", descriptors=[], sys_args={}, **kwargs):
         self._Descriptors = descriptors
+        self._OperationDescriptors = None  # 运算模式下的描述子, 由因子表在初始化运算时设置
         self.UserData = {}
         if descriptors: kwargs.setdefault("logger", descriptors[0]._QS_Logger)
         return super().__init__(name=name, ft=None, sys_args=sys_args, config_file=None, **kwargs)
@@ -31,6 +37,15 @@ class DerivativeFactor(Factor):
     def Descriptors(self):
         return self._Descriptors
 
+    # 运算模式下使用的描述子, 结构相同的描述子被合并为同一个因子对象, Descriptors 保持不变
+    @property
+    def _QS_Descriptors(self):
+        return self._Descriptors if self._OperationDescriptors is None else self._OperationDescriptors
+
+    def _exit(self):
+        self._OperationDescriptors = None
+        return super()._exit()
+
     def getMetaData(self, key=None, args={}):
         DataType = args.get("数据类型", self.DataType)
         if key is None:
@@ -58,31 +73,36 @@ class DerivativeFactor(Factor):
 # 如果运算时点参数为单时点, 运算ID参数为多ID, 那么 x 元素为 array(shape=(nID, )), 注意并发时 ID 并不是全截面, 返回 array(shape=(nID,))
 # 如果运算时点参数为多时点, 运算ID参数为单ID, 那么 x 元素为 array(shape=(nDT, )), 返回 array(shape=(nID, ))
 # 如果运算时点参数为多时点, 运算ID参数为多ID, 那么 x 元素为 array(shape=(nDT, nID)), 注意并发时 ID 并不是全截面, 返回 array(shape=(nDT, nID))
+# 单时点单ID 模式下可以通过参数'向量化'或者装饰器 PointKernel.vectorizable 声明算子为逐元素运算, 以 (nDT, nID) 的数组调用一次算子;
+# '向量化'为 numba 时使用 numba 编译算子, 无法编译时退回逐点计算
 class PointOperation(DerivativeFactor):
     """单点运算"""
     DTMode = Enum("单时点", "多时点", arg_type="SingleOption", label="运算时点", order=3)
     IDMode = Enum("单ID", "多ID", arg_type="SingleOption", label="运算ID", order=4)
+    Vectorization = Enum(*POINT_MODES, arg_type="SingleOption", label="向量化", order=5)
 
     def readData(self, ids, dts, **kwargs):
         StdData = self._calcData(ids=ids, dts=dts,
                                  descriptor_data=[iDescriptor.readData(ids=ids, dts=dts, **kwargs).values for
                                                   iDescriptor in self._Descriptors])
-        return pd.DataFrame(StdData, index=dts, columns=ids)
+        return genStdFrame(StdData, dts, ids, self.DataType, dtype=self.TempData.get("dtype"))
 
     def _QS_initOperation(self, start_dt, dt_dict, prepare_ids, id_dict):
         super()._QS_initOperation(start_dt, dt_dict, prepare_ids, id_dict)
-        for i, iDescriptor in enumerate(self._Descriptors):
+        for i, iDescriptor in enumerate(self._QS_Descriptors):
             iDescriptor._QS_initOperation(dt_dict[self.Name], dt_dict, prepare_ids, id_dict)
 
     def _calcData(self, ids, dts, descriptor_data):
         if (self.DTMode == '多时点') and (self.IDMode == '多ID'):
             StdData = self.Operator(self, dts, ids, descriptor_data, self.ModelArgs)
         else:
-            if self.DataType == 'double':
-                StdData = np.full(shape=(len(dts), len(ids)), fill_value=np.nan, dtype='float')
-            else:
-                StdData = np.full(shape=(len(dts), len(ids)), fill_value=None, dtype='O')
+            StdData = genStdData((len(dts), len(ids)), self.DataType)
             if (self.DTMode == '单时点') and (self.IDMode == '单ID'):
+                if calcPointData(self.Operator, self, dts, ids, descriptor_data, self.ModelArgs, StdData,
+                                 mode=self.Vectorization) is not None:
+                    return StdData
+                if self.Vectorization == "numba":
+                    self._QS_Logger.warning("因子 '%s' 的算子无法使用 numba 编译, 退回逐点计算!" % (self.Name,))
                 for i, iDT in enumerate(dts):
                     for j, jID in enumerate(ids):
                         StdData[i, j] = self.Operator(self, iDT, jID, [iData[i, j] for iData in descriptor_data],
@@ -101,7 +121,7 @@ class PointOperation(DerivativeFactor):
         PID = self._OperationMode._iPID
         StartDT = self._OperationMode._FactorStartDT[self.Name]
         EndDT = self._OperationMode.DateTimes[-1]
-        StartInd, EndInd = self._OperationMode.DTRuler.index(StartDT), self._OperationMode.DTRuler.index(EndDT)
+        StartInd, EndInd = getDTIndex(self._OperationMode.DTRuler).index(StartDT), getDTIndex(self._OperationMode.DTRuler).index(EndDT)
         DTs = list(self._OperationMode.DTRuler[StartInd:EndInd + 1])
         IDs = self._OperationMode._FactorPrepareIDs[self.Name]
         if IDs is None:
@@ -112,13 +132,13 @@ class PointOperation(DerivativeFactor):
         if IDs:
             StdData = self._calcData(ids=IDs, dts=DTs,
                                      descriptor_data=[iDescriptor._QS_getData(DTs, pids=[PID]).values for iDescriptor in
-                                                      self._Descriptors])
-            StdData = pd.DataFrame(StdData, index=DTs, columns=IDs)
+                                                      self._QS_Descriptors])
+            StdData = genStdFrame(StdData, DTs, IDs, self.DataType, dtype=self.TempData.get("dtype"))
         else:
-            StdData = pd.DataFrame(index=DTs, columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(DTs, IDs, self.DataType)
         with self._OperationMode._PID_Lock[PID]:
-            with shelve.open(self._OperationMode._CacheDataDir + os.sep + PID + os.sep + self.Name + str(
-                    self._OperationMode._FactorID[self.Name])) as CacheFile:
+            with openCacheFile(self._OperationMode._CacheDataDir + os.sep + PID + os.sep + self.Name + str(
+                    self._OperationMode._FactorID[self.Name]), "c", self._OperationMode.CacheFormat) as CacheFile:
                 CacheFile["StdData"] = StdData
                 CacheFile["_QS_IDs"] = IDs
         self._isCacheDataOK = True
@@ -135,9 +155,12 @@ class PointOperation(DerivativeFactor):
 # 如果运算时点参数为单时点, 运算ID参数为多ID, 那么x元素为array(shape=(回溯期数, nID)), 注意并发时 ID 并不是全截面, 返回 array(shape=(nID, ))
 # 如果运算时点参数为多时点, 运算ID参数为单ID, 那么x元素为array(shape=(回溯期数+nDT, )), 返回 array(shape=(nDate,))
 # 如果运算时点参数为多时点, 运算ID参数为多ID, 那么x元素为array(shape=(回溯期数+nDT, nID)), 注意并发时 ID 并不是全截面, 返回 array(shape=(nDT, nID))
+# 如果运算时点参数为滑动窗口, 运算ID参数为单ID, 那么x元素为array(shape=(nDT, 回溯期数+1)), 返回 array(shape=(nDT, ))
+# 如果运算时点参数为滑动窗口, 运算ID参数为多ID, 那么x元素为array(shape=(nDT, 回溯期数+1, nID)), 返回 array(shape=(nDT, nID))
+# 滑动窗口模式下 x 元素为描述子数据的视图, 算子不能修改 x, 只支持滚动窗口且不能回溯自身, 内置的窗口统计算子见 RollingKernel.reduceOperator
 class TimeOperation(DerivativeFactor):
     """时间序列运算"""
-    DTMode = Enum("单时点", "多时点", arg_type="SingleOption", label="运算时点", order=3)
+    DTMode = Enum("单时点", "多时点", "滑动窗口", arg_type="SingleOption", label="运算时点", order=3)
     IDMode = Enum("单ID", "多ID", arg_type="SingleOption", label="运算ID", order=4)
     LookBack = List(arg_type="ArgList", label="回溯期数", order=5)  # 描述子向前回溯的时点数(不包括当前时点)
     LookBackMode = List(Enum("滚动窗口", "扩张窗口"), arg_type="ArgList", label="回溯模式", order=6)  # 描述子的回溯模式
@@ -151,16 +174,16 @@ class TimeOperation(DerivativeFactor):
 
     def _QS_initOperation(self, start_dt, dt_dict, prepare_ids, id_dict):
         super()._QS_initOperation(start_dt, dt_dict, prepare_ids, id_dict)
-        if len(self._Descriptors) > len(self.LookBack): raise __QS_Error__(
+        if len(self._QS_Descriptors) > len(self.LookBack): raise __QS_Error__(
             "时间序列运算因子 : '%s' 的参数'回溯期数'序列长度小于描述子个数!" % self.Name)
         StartDT = dt_dict[self.Name]
-        StartInd = self._OperationMode.DTRuler.index(StartDT)
+        StartInd = getDTIndex(self._OperationMode.DTRuler).index(StartDT)
         if (self.iLookBackMode == "扩张窗口") and (self.iInitData is not None) and (self.iInitData.shape[0] > 0):
-            if self.iInitData.index[-1] not in self._OperationMode.DTRuler:
+            if self.iInitData.index[-1] not in getDTIndex(self._OperationMode.DTRuler):
                 self._QS_Logger.warning("注意: 因子 '%s' 的初始值不在时点标尺的范围内, 初始值和时点标尺之间的时间间隔将被忽略!" % (self.Name,))
             else:
-                StartInd = min(StartInd, self._OperationMode.DTRuler.index(self.iInitData.index[-1]) + 1)
-        for i, iDescriptor in enumerate(self._Descriptors):
+                StartInd = min(StartInd, getDTIndex(self._OperationMode.DTRuler).index(self.iInitData.index[-1]) + 1)
+        for i, iDescriptor in enumerate(self._QS_Descriptors):
             iStartInd = StartInd - self.LookBack[i]
             if iStartInd < 0: self._QS_Logger.warning(
                 "注意: 对于因子 '%s' 的描述子 '%s', 时点标尺长度不足, 不足的部分将填充 nan!" % (self.Name, iDescriptor.Name))
@@ -169,13 +192,14 @@ class TimeOperation(DerivativeFactor):
 
     def readData(self, ids, dts, **kwargs):
         DTRuler = kwargs.get("dt_ruler", dts)
-        StartInd = (DTRuler.index(dts[0]) if dts[0] in DTRuler else 0)
+        RulerIndex = getDTIndex(DTRuler)
+        StartInd = (RulerIndex.index(dts[0]) if dts[0] in RulerIndex else 0)
         if (self.iLookBackMode == "扩张窗口") and (self.iInitData is not None) and (self.iInitData.shape[0] > 0):
-            if self.iInitData.index[-1] not in DTRuler:
+            if self.iInitData.index[-1] not in RulerIndex:
                 self._QS_Logger.warning("注意: 因子 '%s' 的初始值不在时点标尺的范围内, 初始值和时点标尺之间的时间间隔将被忽略!" % (self.Name,))
             else:
-                StartInd = min(StartInd, DTRuler.index(self.iInitData.index[-1]) + 1)
-        EndInd = (DTRuler.index(dts[-1]) if dts[-1] in DTRuler else len(DTRuler) - 1)
+                StartInd = min(StartInd, RulerIndex.index(self.iInitData.index[-1]) + 1)
+        EndInd = (RulerIndex.index(dts[-1]) if dts[-1] in RulerIndex else len(DTRuler) - 1)
         if StartInd > EndInd: return pd.DataFrame(index=dts, columns=ids)
         nID = len(ids)
         DescriptorData = []
@@ -191,13 +215,23 @@ class TimeOperation(DerivativeFactor):
             DescriptorData.append(iDescriptorData)
         StdData = self._calcData(ids=ids, dts=DTRuler[StartInd:EndInd + 1], descriptor_data=DescriptorData,
                                  dt_ruler=DTRuler)
-        return pd.DataFrame(StdData, index=DTRuler[StartInd:EndInd + 1], columns=ids).loc[dts, :]
+        return genStdFrame(StdData, DTRuler[StartInd:EndInd + 1], ids, self.DataType,
+                           dtype=self.TempData.get("dtype")).loc[dts, :]
+
+    # 滑动窗口模式, 以所有时点的窗口调用一次算子
+    def _calcWindowData(self, ids, dts, descriptor_data):
+        if (self.iLookBack != 0) or (self.iLookBackMode == "扩张窗口") or ("扩张窗口" in self.LookBackMode):
+            raise __QS_Error__("时间序列运算因子 '%s' 的滑动窗口模式不支持扩张窗口和自身回溯!" % self.Name)
+        Windows = [genWindows(iData, self.LookBack[i] + 1) for i, iData in enumerate(descriptor_data)]
+        if self.IDMode == "多ID": return self.Operator(self, dts, ids, Windows, self.ModelArgs)
+        StdData = genStdData((len(dts), len(ids)), self.DataType)
+        for j, jID in enumerate(ids):
+            StdData[:, j] = self.Operator(self, dts, jID, [iWindows[:, :, j] for iWindows in Windows], self.ModelArgs)
+        return StdData
 
     def _calcData(self, ids, dts, descriptor_data, dt_ruler):
-        if self.DataType == 'double':
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=np.nan, dtype='float')
-        else:
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=None, dtype='O')
+        if self.DTMode == "滑动窗口": return self._calcWindowData(ids, dts, descriptor_data)
+        StdData = genStdData((len(dts), len(ids)), self.DataType)
         StartIndAndLen, MaxLookBack, MaxLen = [], 0, 1
         for i in range(len(self._Descriptors)):
             iLookBack = self.LookBack[i]
@@ -227,7 +261,7 @@ class TimeOperation(DerivativeFactor):
                 MaxLen = max(MaxLen, self.iLookBack + 1)
             MaxLookBack = max(MaxLookBack, self.iLookBack)
             descriptor_data.insert(0, StdData)
-        StartInd = dt_ruler.index(dts[0])
+        StartInd = getDTIndex(dt_ruler).index(dts[0])
         if StartInd >= MaxLookBack:
             DTRuler = dt_ruler[StartInd - MaxLookBack:]
         else:
@@ -262,7 +296,7 @@ class TimeOperation(DerivativeFactor):
         PID = self._OperationMode._iPID
         StartDT = self._OperationMode._FactorStartDT[self.Name]
         EndDT = self._OperationMode.DateTimes[-1]
-        StartInd, EndInd = self._OperationMode.DTRuler.index(StartDT), self._OperationMode.DTRuler.index(EndDT)
+        StartInd, EndInd = getDTIndex(self._OperationMode.DTRuler).index(StartDT), getDTIndex(self._OperationMode.DTRuler).index(EndDT)
         DTs = list(self._OperationMode.DTRuler[StartInd:EndInd + 1])
         IDs = self._OperationMode._FactorPrepareIDs[self.Name]
         if IDs is None:
@@ -272,7 +306,7 @@ class TimeOperation(DerivativeFactor):
             IDs = partitionListMovingSampling(IDs, len(self._OperationMode._PIDs))[self._OperationMode._PIDs.index(PID)]
         if IDs:
             DescriptorData = []
-            for i, iDescriptor in enumerate(self._Descriptors):
+            for i, iDescriptor in enumerate(self._QS_Descriptors):
                 iStartInd = StartInd - self.LookBack[i]
                 iDTs = list(self._OperationMode.DTRuler[max(0, iStartInd):StartInd]) + DTs
                 iDescriptorData = iDescriptor._QS_getData(iDTs, pids=[PID]).values
@@ -281,12 +315,12 @@ class TimeOperation(DerivativeFactor):
                 DescriptorData.append(iDescriptorData)
             StdData = self._calcData(ids=IDs, dts=DTs, descriptor_data=DescriptorData,
                                      dt_ruler=self._OperationMode.DTRuler)
-            StdData = pd.DataFrame(StdData, index=DTs, columns=IDs)
+            StdData = genStdFrame(StdData, DTs, IDs, self.DataType, dtype=self.TempData.get("dtype"))
         else:
-            StdData = pd.DataFrame(index=DTs, columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(DTs, IDs, self.DataType)
         with self._OperationMode._PID_Lock[PID]:
-            with shelve.open(self._OperationMode._CacheDataDir + os.sep + PID + os.sep + self.Name + str(
-                    self._OperationMode._FactorID[self.Name])) as CacheFile:
+            with openCacheFile(self._OperationMode._CacheDataDir + os.sep + PID + os.sep + self.Name + str(
+                    self._OperationMode._FactorID[self.Name]), "c", self._OperationMode.CacheFormat) as CacheFile:
                 CacheFile["StdData"] = StdData
                 CacheFile["_QS_IDs"] = IDs
         self._isCacheDataOK = True
@@ -319,32 +353,29 @@ class SectionOperation(DerivativeFactor):
             if iSectionIDs is None: iSectionIDs = SectionIDs
             DescriptorData.append(iDescriptor.readData(ids=iSectionIDs, dts=dts, **kwargs).values)
         StdData = self._calcData(ids=SectionIDs, dts=dts, descriptor_data=DescriptorData)
-        return pd.DataFrame(StdData, index=dts, columns=SectionIDs).loc[:, ids]
+        return genStdFrame(StdData, dts, SectionIDs, self.DataType, dtype=self.TempData.get("dtype")).loc[:, ids]
 
     def _QS_initOperation(self, start_dt, dt_dict, prepare_ids, id_dict):
         OldStartDT = dt_dict.get(self.Name, None)
         if (OldStartDT is None) or (start_dt < OldStartDT):
             dt_dict[self.Name] = start_dt
-            StartInd, EndInd = self._OperationMode.DTRuler.index(dt_dict[self.Name]), self._OperationMode.DTRuler.index(
+            StartInd, EndInd = getDTIndex(self._OperationMode.DTRuler).index(dt_dict[self.Name]), getDTIndex(self._OperationMode.DTRuler).index(
                 self._OperationMode.DateTimes[-1])
             DTs = self._OperationMode.DTRuler[StartInd:EndInd + 1]
             DTPartition = partitionList(DTs, len(self._OperationMode._PIDs))
             self._PID_DTs = {iPID: DTPartition[i] for i, iPID in enumerate(self._OperationMode._PIDs)}
         PrepareIDs = id_dict.setdefault(self.Name, prepare_ids)
         if prepare_ids != PrepareIDs: raise __QS_Error__("因子 %s 指定了不同的截面!" % self.Name)
-        for i, iDescriptor in enumerate(self._Descriptors):
+        for i, iDescriptor in enumerate(self._QS_Descriptors):
             if self.DescriptorSection[i] is None:
                 iDescriptor._QS_initOperation(start_dt, dt_dict, prepare_ids, id_dict)
             else:
                 iDescriptor._QS_initOperation(start_dt, dt_dict, self.DescriptorSection[i], id_dict)
         if (self._OperationMode.SubProcessNum > 0) and (self.Name not in self._OperationMode._Event):
-            self._OperationMode._Event[self.Name] = (Queue(), Event())
+            self._OperationMode._Event[self.Name] = Event()
 
     def _calcData(self, ids, dts, descriptor_data):
-        if self.DataType == "double":
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=np.nan, dtype="float")
-        else:
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=None, dtype="O")
+        StdData = genStdData((len(dts), len(ids)), self.DataType)
         if self.OutputMode == "全截面":
             if self.DTMode == "单时点":
                 for i, iDT in enumerate(dts):
@@ -370,16 +401,16 @@ class SectionOperation(DerivativeFactor):
         if IDs is None: IDs = list(self._OperationMode.IDs)
         if len(DTs) == 0:  # 该进程未分配到计算任务
             iDTs = [self._OperationMode.DateTimes[-1]]
-            for i, iDescriptor in enumerate(self._Descriptors):
+            for i, iDescriptor in enumerate(self._QS_Descriptors):
                 iDescriptor._QS_getData(iDTs, pids=None)
-            StdData = pd.DataFrame(columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(None, IDs, self.DataType)
         elif IDs:
             StdData = self._calcData(ids=IDs, dts=DTs,
                                      descriptor_data=[iDescriptor._QS_getData(DTs, pids=None).values for i, iDescriptor
-                                                      in enumerate(self._Descriptors)])
-            StdData = pd.DataFrame(StdData, index=DTs, columns=IDs)
+                                                      in enumerate(self._QS_Descriptors)])
+            StdData = genStdFrame(StdData, DTs, IDs, self.DataType, dtype=self.TempData.get("dtype"))
         else:
-            StdData = pd.DataFrame(index=DTs, columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(DTs, IDs, self.DataType)
         if self._OperationMode._FactorPrepareIDs[self.Name] is None:
             PID_IDs = self._OperationMode._PID_IDs
         else:
@@ -388,8 +419,8 @@ class SectionOperation(DerivativeFactor):
                        enumerate(partitionListMovingSampling(IDs, len(self._OperationMode._PIDs)))}
         for iPID, iIDs in PID_IDs.items():
             with self._OperationMode._PID_Lock[iPID]:
-                with shelve.open(self._OperationMode._CacheDataDir + os.sep + iPID + os.sep + self.Name + str(
-                        self._OperationMode._FactorID[self.Name])) as CacheFile:
+                with openCacheFile(self._OperationMode._CacheDataDir + os.sep + iPID + os.sep + self.Name + str(
+                        self._OperationMode._FactorID[self.Name]), "c", self._OperationMode.CacheFormat) as CacheFile:
                     if "StdData" in CacheFile:
                         CacheFile["StdData"] = pd.concat([CacheFile["StdData"], StdData.loc[:, iIDs]]).sort_index()
                     else:
@@ -397,9 +428,9 @@ class SectionOperation(DerivativeFactor):
                     CacheFile["_QS_IDs"] = iIDs
         StdData = None  # 释放数据
         if self._OperationMode.SubProcessNum > 0:
-            Sub2MainQueue, PIDEvent = self._OperationMode._Event[self.Name]
-            Sub2MainQueue.put(1)
-            PIDEvent.wait()
+            # 通知主进程该进程已到达同步点, 等待所有进程到达
+            self._OperationMode._Sub2MainQueue.put((self._OperationMode._iPID, 0, ("Barrier", self.Name)))
+            self._OperationMode._Event[self.Name].wait()
         self._isCacheDataOK = True
         return StdData
 
@@ -430,18 +461,18 @@ class PanelOperation(DerivativeFactor):
         self.DescriptorSection = [None] * len(self._Descriptors)
 
     def _QS_initOperation(self, start_dt, dt_dict, prepare_ids, id_dict):
-        if len(self._Descriptors) > len(self.LookBack): raise __QS_Error__(
+        if len(self._QS_Descriptors) > len(self.LookBack): raise __QS_Error__(
             "面板运算因子 : '%s' 的参数'回溯期数'序列长度小于描述子个数!" % self.Name)
         OldStartDT = dt_dict.get(self.Name, None)
         DTRuler = self._OperationMode.DTRuler
         if (OldStartDT is None) or (start_dt < OldStartDT):
             StartDT = dt_dict[self.Name] = start_dt
-            StartInd, EndInd = DTRuler.index(StartDT), DTRuler.index(self._OperationMode.DateTimes[-1])
+            StartInd, EndInd = getDTIndex(DTRuler).index(StartDT), getDTIndex(DTRuler).index(self._OperationMode.DateTimes[-1])
             if (self.iLookBackMode == "扩张窗口") and (self.iInitData is not None) and (self.iInitData.shape[0] > 0):
-                if self.iInitData.index[-1] not in self._OperationMode.DTRuler:
+                if self.iInitData.index[-1] not in getDTIndex(self._OperationMode.DTRuler):
                     self._QS_Logger.warning("注意: 因子 '%s' 的初始值不在时点标尺的范围内, 初始值和时点标尺之间的时间间隔将被忽略!" % (self.Name,))
                 else:
-                    StartInd = min(StartInd, self._OperationMode.DTRuler.index(self.iInitData.index[-1]) + 1)
+                    StartInd = min(StartInd, getDTIndex(self._OperationMode.DTRuler).index(self.iInitData.index[-1]) + 1)
             DTs = DTRuler[StartInd:EndInd + 1]
             if self.iLookBackMode == "扩张窗口":
                 DTPartition = [DTs] + [[]] * (len(self._OperationMode._PIDs) - 1)
@@ -449,10 +480,10 @@ class PanelOperation(DerivativeFactor):
                 DTPartition = partitionList(DTs, len(self._OperationMode._PIDs))
             self._PID_DTs = {iPID: DTPartition[i] for i, iPID in enumerate(self._OperationMode._PIDs)}
         else:
-            StartInd = DTRuler.index(OldStartDT)
+            StartInd = getDTIndex(DTRuler).index(OldStartDT)
         PrepareIDs = id_dict.setdefault(self.Name, prepare_ids)
         if prepare_ids != PrepareIDs: raise __QS_Error__("因子 %s 指定了不同的截面!" % self.Name)
-        for i, iDescriptor in enumerate(self._Descriptors):
+        for i, iDescriptor in enumerate(self._QS_Descriptors):
             iStartInd = StartInd - self.LookBack[i]
             if iStartInd < 0: self._QS_Logger.warning(
                 "注意: 对于因子 '%s' 的描述子 '%s', 时点标尺长度不足!" % (self.Name, iDescriptor.Name))
@@ -462,18 +493,19 @@ class PanelOperation(DerivativeFactor):
             else:
                 iDescriptor._QS_initOperation(iStartDT, dt_dict, self.DescriptorSection[i], id_dict)
         if (self._OperationMode.SubProcessNum > 0) and (self.Name not in self._OperationMode._Event):
-            self._OperationMode._Event[self.Name] = (Queue(), Event())
+            self._OperationMode._Event[self.Name] = Event()
 
     def readData(self, ids, dts, **kwargs):
         DTRuler = kwargs.get("dt_ruler", dts)
         SectionIDs = kwargs.pop("section_ids", ids)
-        StartInd = (DTRuler.index(dts[0]) if dts[0] in DTRuler else 0)
+        RulerIndex = getDTIndex(DTRuler)
+        StartInd = (RulerIndex.index(dts[0]) if dts[0] in RulerIndex else 0)
         if (self.iLookBackMode == "扩张窗口") and (self.iInitData is not None) and (self.iInitData.shape[0] > 0):
-            if self.iInitData.index[-1] not in DTRuler:
+            if self.iInitData.index[-1] not in RulerIndex:
                 self._QS_Logger.warning("注意: 因子 '%s' 的初始值不在时点标尺的范围内, 初始值和时点标尺之间的时间间隔将被忽略!" % (self.Name,))
             else:
-                StartInd = min(StartInd, DTRuler.index(self.iInitData.index[-1]) + 1)
-        EndInd = (DTRuler.index(dts[-1]) if dts[-1] in DTRuler else len(DTRuler) - 1)
+                StartInd = min(StartInd, RulerIndex.index(self.iInitData.index[-1]) + 1)
+        EndInd = (RulerIndex.index(dts[-1]) if dts[-1] in RulerIndex else len(DTRuler) - 1)
         if StartInd > EndInd: return pd.DataFrame(index=dts, columns=ids)
         DescriptorData = []
         for i, iDescriptor in enumerate(self._Descriptors):
@@ -491,13 +523,11 @@ class PanelOperation(DerivativeFactor):
             DescriptorData.append(iDescriptorData)
         StdData = self._calcData(ids=SectionIDs, dts=DTRuler[StartInd:EndInd + 1], descriptor_data=DescriptorData,
                                  dt_ruler=DTRuler)
-        return pd.DataFrame(StdData, index=DTRuler[StartInd:EndInd + 1], columns=SectionIDs).loc[dts, ids]
+        return genStdFrame(StdData, DTRuler[StartInd:EndInd + 1], SectionIDs, self.DataType,
+                           dtype=self.TempData.get("dtype")).loc[dts, ids]
 
     def _calcData(self, ids, dts, descriptor_data, dt_ruler):
-        if self.DataType == 'double':
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=np.nan, dtype='float')
-        else:
-            StdData = np.full(shape=(len(dts), len(ids)), fill_value=None, dtype='O')
+        StdData = genStdData((len(dts), len(ids)), self.DataType)
         StartIndAndLen, MaxLookBack, MaxLen = [], 0, 1
         for i, iDescriptor in enumerate(self._Descriptors):
             iLookBack = self.LookBack[i]
@@ -527,7 +557,7 @@ class PanelOperation(DerivativeFactor):
                 MaxLen = max(MaxLen, self.iLookBack + 1)
             descriptor_data.insert(0, StdData)
             MaxLookBack = max(MaxLookBack, self.iLookBack)
-        StartInd = dt_ruler.index(dts[0])
+        StartInd = getDTIndex(dt_ruler).index(dts[0])
         if StartInd >= MaxLookBack:
             DTRuler = dt_ruler[StartInd - MaxLookBack:]
         else:
@@ -564,12 +594,12 @@ class PanelOperation(DerivativeFactor):
         if IDs is None: IDs = list(self._OperationMode.IDs)
         if len(DTs) == 0:  # 该进程未分配到计算任务
             iDTs = [self._OperationMode.DateTimes[-1]]
-            for i, iDescriptor in enumerate(self._Descriptors):
+            for i, iDescriptor in enumerate(self._QS_Descriptors):
                 iDescriptor._QS_getData(iDTs, pids=None)
-            StdData = pd.DataFrame(columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(None, IDs, self.DataType)
         elif IDs:
-            DescriptorData, StartInd = [], self._OperationMode.DTRuler.index(DTs[0])
-            for i, iDescriptor in enumerate(self._Descriptors):
+            DescriptorData, StartInd = [], getDTIndex(self._OperationMode.DTRuler).index(DTs[0])
+            for i, iDescriptor in enumerate(self._QS_Descriptors):
                 iStartInd = StartInd - self.LookBack[i]
                 iDTs = list(self._OperationMode.DTRuler[max(0, iStartInd):StartInd]) + DTs
                 iDescriptorData = iDescriptor._QS_getData(iDTs, pids=None).values
@@ -578,9 +608,10 @@ class PanelOperation(DerivativeFactor):
                 DescriptorData.append(iDescriptorData)
             StdData = self._calcData(ids=IDs, dts=DTs, descriptor_data=DescriptorData,
                                      dt_ruler=self._OperationMode.DTRuler)
-            DescriptorData, iDescriptorData, StdData = None, None, pd.DataFrame(StdData, index=DTs, columns=IDs)
+            DescriptorData, iDescriptorData = None, None
+            StdData = genStdFrame(StdData, DTs, IDs, self.DataType, dtype=self.TempData.get("dtype"))
         else:
-            StdData = pd.DataFrame(index=DTs, columns=IDs, dtype=("float" if self.DataType == "double" else "O"))
+            StdData = genEmptyFrame(DTs, IDs, self.DataType)
         if self._OperationMode._FactorPrepareIDs[self.Name] is None:
             PID_IDs = self._OperationMode._PID_IDs
         else:
@@ -589,8 +620,8 @@ class PanelOperation(DerivativeFactor):
                        enumerate(partitionListMovingSampling(IDs, len(self._OperationMode._PIDs)))}
         for iPID, iIDs in PID_IDs.items():
             with self._OperationMode._PID_Lock[iPID]:
-                with shelve.open(self._OperationMode._CacheDataDir + os.sep + iPID + os.sep + self.Name + str(
-                        self._OperationMode._FactorID[self.Name])) as CacheFile:
+                with openCacheFile(self._OperationMode._CacheDataDir + os.sep + iPID + os.sep + self.Name + str(
+                        self._OperationMode._FactorID[self.Name]), "c", self._OperationMode.CacheFormat) as CacheFile:
                     if "StdData" in CacheFile:
                         CacheFile["StdData"] = pd.concat([CacheFile["StdData"], StdData.loc[:, iIDs]]).sort_index()
                     else:
@@ -598,8 +629,8 @@ class PanelOperation(DerivativeFactor):
                     CacheFile["_QS_IDs"] = iIDs
         StdData = None  # 释放数据
         if self._OperationMode.SubProcessNum > 0:
-            Sub2MainQueue, PIDEvent = self._OperationMode._Event[self.Name]
-            Sub2MainQueue.put(1)
-            PIDEvent.wait()
+            # 通知主进程该进程已到达同步点, 等待所有进程到达
+            self._OperationMode._Sub2MainQueue.put((self._OperationMode._iPID, 0, ("Barrier", self.Name)))
+            self._OperationMode._Event[self.Name].wait()
         self._isCacheDataOK = True
         return StdData
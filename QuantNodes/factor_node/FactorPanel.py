@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""三维因子数据"""
+import numpy as np
+import pandas as pd
+
+
+# 缺失值填充值
+def _genNA(dtype):
+    return (None if dtype == np.dtype("O") else np.nan)
+
+
+# 可以容纳缺失值的数据类型
+def _genNADType(dtype):
+    if dtype.kind in "iu": return np.dtype(np.float64)
+    if dtype.kind == "b": return np.dtype("O")
+    return dtype
+
+
+# 多个 DataFrame 的公共数据类型
+def _genCommonDType(dtypes):
+    dtypes = [iDType for iDType in dtypes if iDType is not None]
+    if not dtypes: return np.dtype(np.float64)
+    if not all(isinstance(iDType, np.dtype) for iDType in dtypes): return np.dtype("O")
+    try:
+        return np.result_type(*dtypes)
+    except TypeError:  # 比如时间和数值混合
+        return np.dtype("O")
+
+
+# 位置数组, 如果位置连续则转换成 slice 以保证切片是视图
+def _toSlice(pos):
+    if (pos.shape[0] > 0) and (pos.min() >= 0) and ((pos.shape[0] == 1) or (np.diff(pos) == 1).all()):
+        return slice(int(pos[0]), int(pos[-1]) + 1)
+    return pos
+
+
+# 生成某个维度上的索引, 返回: (位置 int/slice/array, 新的维度索引 or None(降维), 缺失位置 array or None)
+def _genIndexer(index, key, by_label):
+    if isinstance(key, slice):
+        if key == slice(None): return key, index, None
+        if by_label: key = index.slice_indexer(key.start, key.stop, key.step)
+        return key, index[key], None
+    if not pd.api.types.is_list_like(key):
+        if by_label: return index.get_loc(key), None, None
+        return int(key), None, None
+    Key = np.asarray(key)
+    if (Key.dtype == np.dtype(bool)) and (Key.shape[0] == index.shape[0]):
+        Pos = np.flatnonzero(Key)
+        return _toSlice(Pos), index[Pos], None
+    if by_label:
+        Pos = index.get_indexer(key)
+        NewIndex = pd.Index(key) if not isinstance(key, pd.Index) else key
+        Mask = (Pos < 0)
+        if Mask.any(): return Pos, NewIndex, Mask
+        return _toSlice(Pos), NewIndex, None
+    Pos = Key.astype(np.int64)
+    Pos[Pos < 0] += index.shape[0]
+    return _toSlice(Pos), index[Pos], None
+
+
+# 三维因子数据: 因子 × 时点 × ID, 数据保存为一个连续的 ndarray, shape=(因子数, 时点数, ID 数)
+# 接口与 pd.Panel 的常用部分保持一致: items=[因子], major_axis=[时点], minor_axis=[ID]
+class FactorPanel(object):
+    def __init__(self, data=None, items=None, major_axis=None, minor_axis=None, dtype=None):
+        if isinstance(data, FactorPanel):
+            Values, Items, MajorAxis, MinorAxis = data._Values, data.items, data.major_axis, data.minor_axis
+            if (items is not None) or (major_axis is not None) or (minor_axis is not None):
+                Values = data.reindex(items=items, major_axis=major_axis, minor_axis=minor_axis)._Values
+                Items = (Items if items is None else pd.Index(items))
+                MajorAxis = (MajorAxis if major_axis is None else pd.Index(major_axis))
+                MinorAxis = (MinorAxis if minor_axis is None else pd.Index(minor_axis))
+        elif isinstance(data, dict):
+            Values, Items, MajorAxis, MinorAxis = self._fromFrames(data, items, major_axis, minor_axis, dtype)
+        else:
+            Items = pd.Index([] if items is None else items)
+            MajorAxis = pd.Index([] if major_axis is None else major_axis)
+            MinorAxis = pd.Index([] if minor_axis is None else minor_axis)
+            Shape = (Items.shape[0], MajorAxis.shape[0], MinorAxis.shape[0])
+            if data is None:
+                DType = np.dtype(np.float64 if dtype is None else dtype)
+                Values = np.full(Shape, _genNA(DType), dtype=DType)
+            else:
+                Values = np.asarray(data, dtype=dtype)
+                if Values.ndim != 3: raise ValueError("FactorPanel 的数据必须是三维数组!")
+                if Values.shape != Shape: raise ValueError("数据的形状 %s 与索引的形状 %s 不一致!" % (Values.shape, Shape))
+        if dtype is not None: Values = Values.astype(dtype, copy=False)
+        self._Values, self.items, self.major_axis, self.minor_axis = Values, Items, MajorAxis, MinorAxis
+
+    # 由 {因子: DataFrame(index=[时点], columns=[ID])} 构造, 未给定的时点和 ID 取各 DataFrame 的并集
+    @staticmethod
+    def _fromFrames(data, items, major_axis, minor_axis, dtype):
+        Items = pd.Index(list(data.keys()) if items is None else items)
+        Frames = [data.get(iItem) for iItem in Items]
+        if major_axis is None:
+            MajorAxis = None
+            for iFrame in Frames:
+                if iFrame is None: continue
+                MajorAxis = (iFrame.index if MajorAxis is None else (MajorAxis if MajorAxis.equals(iFrame.index) else MajorAxis.union(iFrame.index)))
+            MajorAxis = (pd.Index([]) if MajorAxis is None else MajorAxis)
+        else:
+            MajorAxis = pd.Index(major_axis)
+        if minor_axis is None:
+            MinorAxis = None
+            for iFrame in Frames:
+                if iFrame is None: continue
+                MinorAxis = (iFrame.columns if MinorAxis is None else (MinorAxis if MinorAxis.equals(iFrame.columns) else MinorAxis.union(iFrame.columns)))
+            MinorAxis = (pd.Index([]) if MinorAxis is None else MinorAxis)
+        else:
+            MinorAxis = pd.Index(minor_axis)
+        # 计算每个 DataFrame 的行列位置, 相同的索引对象只计算一次
+        Positions, Cache, hasNA = [], {}, False
+        for iFrame in Frames:
+            if iFrame is None:
+                Positions.append(None)
+                hasNA = True
+                continue
+            for iIndex, iAxis in ((iFrame.index, MajorAxis), (iFrame.columns, MinorAxis)):
+                if id(iIndex) not in Cache:
+                    iPos = (slice(None) if iIndex.equals(iAxis) else iIndex.get_indexer(iAxis))
+                    Cache[id(iIndex)] = (iIndex, iPos)  # 保留索引对象的引用, 避免 id 被复用
+            iRowPos, iColPos = Cache[id(iFrame.index)][1], Cache[id(iFrame.columns)][1]
+            hasNA = hasNA or any((not isinstance(iPos, slice)) and (iPos < 0).any() for iPos in (iRowPos, iColPos))
+            Positions.append((iRowPos, iColPos))
+        if dtype is None:
+            DType = _genCommonDType([(iFrame.values.dtype if iFrame.shape[1] > 0 else None) for iFrame in Frames if iFrame is not None])
+            if hasNA: DType = _genNADType(DType)
+        else:
+            DType = np.dtype(dtype)
+        Values = np.empty((Items.shape[0], MajorAxis.shape[0], MinorAxis.shape[0]), dtype=DType)
+        for i, iFrame in enumerate(Frames):
+            if iFrame is None:
+                Values[i] = _genNA(DType)
+                continue
+            iRowPos, iColPos = Positions[i]
+            iData = iFrame.values
+            if isinstance(iRowPos, slice) and isinstance(iColPos, slice):
+                Values[i] = iData
+                continue
+            if Values.shape[1] * Values.shape[2] == 0: continue
+            Values[i] = iData[iRowPos][:, iColPos] if iData.size > 0 else _genNA(DType)
+            if not isinstance(iRowPos, slice): Values[i, iRowPos < 0, :] = _genNA(DType)
+            if not isinstance(iColPos, slice): Values[i, :, iColPos < 0] = _genNA(DType)
+        return Values, Items, MajorAxis, MinorAxis
+
+    @property
+    def values(self):
+        return self._Values
+
+    @property
+    def shape(self):
+        return self._Values.shape
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        return self._Values.dtype
+
+    @property
+    def axes(self):
+        return [self.items, self.major_axis, self.minor_axis]
+
+    @property
+    def loc(self):
+        return _Indexer(self, by_label=True)
+
+    @property
+    def iloc(self):
+        return _Indexer(self, by_label=False)
+
+    def __repr__(self):
+        return "<FactorPanel: %d (items) x %d (major_axis) x %d (minor_axis)>" % self.shape
+
+    def __len__(self):
+        return self.items.shape[0]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def keys(self):
+        return self.items
+
+    def __getitem__(self, key):
+        if pd.api.types.is_list_like(key) or isinstance(key, slice): return self.loc[key]
+        return pd.DataFrame(self._Values[self.items.get_loc(key)], index=self.major_axis, columns=self.minor_axis, copy=False)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, pd.DataFrame):  # 按照时点和 ID 对齐
+            value = self._fromFrames({key: value}, None, self.major_axis, self.minor_axis, None)[0][0]
+        if key in self.items:
+            self.loc[key] = value
+            return
+        Data = np.broadcast_to(np.asarray(value), self.shape[1:])[np.newaxis]
+        self._Values = np.concatenate((self._Values, Data), axis=0)
+        self.items = self.items.append(pd.Index([key]))
+
+    # 选取数据, 根据降维的维度返回 FactorPanel, DataFrame, Series 或者标量, 与 pd.Panel 保持一致
+    def _getItem(self, key, by_label):
+        if not isinstance(key, tuple): key = (key,)
+        if len(key) > 3: raise IndexError("FactorPanel 最多只有三个维度!")
+        key = key + (slice(None),) * (3 - len(key))
+        Data, Axes = self._Values, []
+        for iAxis, (iIndex, iKey) in enumerate(zip(self.axes, key)):
+            iPos, iNewIndex, iMask = _genIndexer(iIndex, iKey, by_label)
+            Axes.append(iNewIndex)
+            if isinstance(iPos, (int, np.integer)): iPos = slice(iPos, iPos + 1) if iPos != -1 else slice(-1, None)
+            if iMask is None:
+                Data = Data[(slice(None),) * iAxis + (iPos,)]
+            else:
+                DType = _genNADType(Data.dtype)
+                Shape = list(Data.shape)
+                Shape[iAxis] = iPos.shape[0]
+                NewData = np.full(Shape, _genNA(DType), dtype=DType)
+                if Data.shape[iAxis] > 0:
+                    NewData[(slice(None),) * iAxis + (~iMask,)] = Data.take(iPos[~iMask], axis=iAxis)
+                Data = NewData
+        Reduced = tuple(i for i, iIndex in enumerate(Axes) if iIndex is None)
+        if not Reduced: return FactorPanel(Data, items=Axes[0], major_axis=Axes[1], minor_axis=Axes[2])
+        elif Reduced == (0,): return pd.DataFrame(Data[0], index=Axes[1], columns=Axes[2], copy=False)
+        elif Reduced == (1,): return pd.DataFrame(Data[:, 0, :].T, index=Axes[2], columns=Axes[0], copy=False)
+        elif Reduced == (2,): return pd.DataFrame(Data[:, :, 0].T, index=Axes[1], columns=Axes[0], copy=False)
+        elif Reduced == (0, 1): return pd.Series(Data[0, 0, :], index=Axes[2])
+        elif Reduced == (0, 2): return pd.Series(Data[0, :, 0], index=Axes[1])
+        elif Reduced == (1, 2): return pd.Series(Data[:, 0, 0], index=Axes[0])
+        return Data[0, 0, 0]
+
+    # 原地赋值, value: 标量, ndarray, DataFrame 或者 FactorPanel
+    def _setItem(self, key, value, by_label):
+        if not isinstance(key, tuple): key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        Indexers, Reduced = [], []
+        for i, (iIndex, iKey) in enumerate(zip(self.axes, key)):
+            iPos, iNewIndex, iMask = _genIndexer(iIndex, iKey, by_label)
+            if iMask is not None: raise KeyError("FactorPanel 中不存在标签: %s" % (np.asarray(iKey, dtype="O")[iMask][:5].tolist(),))
+            if iNewIndex is None: Reduced.append(i)
+            Indexers.append(iPos)
+        if isinstance(value, FactorPanel):
+            value = value._Values
+        elif isinstance(value, pd.DataFrame):
+            value = (value.values.T if tuple(Reduced) in ((1,), (2,)) else value.values)
+        elif isinstance(value, pd.Series):
+            value = value.values
+        elif (value is None) and (self._Values.dtype != np.dtype("O")):
+            value = np.nan
+        if sum(isinstance(iPos, np.ndarray) for iPos in Indexers) > 1:  # 多个数组索引需要转换成网格索引
+            Indexers = [(np.arange(self.shape[i])[iPos] if isinstance(iPos, slice) else iPos) for i, iPos in enumerate(Indexers)]
+            Mesh = np.ix_(*[np.atleast_1d(iPos) for iPos in Indexers])
+            Indexers = [(int(iPos) if i in Reduced else Mesh[i]) for i, iPos in enumerate(Indexers)]
+        self._Values[tuple(Indexers)] = value
+
+    def copy(self):
+        return FactorPanel(self._Values.copy(), items=self.items, major_axis=self.major_axis, minor_axis=self.minor_axis)
+
+    def reindex(self, items=None, major_axis=None, minor_axis=None):
+        return self.loc[(slice(None) if items is None else items), (slice(None) if major_axis is None else major_axis),
+                        (slice(None) if minor_axis is None else minor_axis)]
+
+    def swapaxes(self, axis1, axis2):
+        Axes = self.axes
+        Axes[axis1], Axes[axis2] = Axes[axis2], Axes[axis1]
+        return FactorPanel(np.swapaxes(self._Values, axis1, axis2), items=Axes[0], major_axis=Axes[1], minor_axis=Axes[2])
+
+    # 沿因子维度合并, how: 时点和 ID 的合并方式, left, right, inner, outer
+    def join(self, other, how="left"):
+        if isinstance(other, (list, tuple)):
+            Rslt = self
+            for iOther in other: Rslt = Rslt.join(iOther, how=how)
+            return Rslt
+        if how == "left":
+            MajorAxis, MinorAxis = self.major_axis, self.minor_axis
+        elif how == "right":
+            MajorAxis, MinorAxis = other.major_axis, other.minor_axis
+        elif how == "inner":
+            MajorAxis, MinorAxis = self.major_axis.intersection(other.major_axis), self.minor_axis.intersection(other.minor_axis)
+        else:
+            MajorAxis, MinorAxis = self.major_axis.union(other.major_axis), self.minor_axis.union(other.minor_axis)
+        Values = [iPanel.reindex(major_axis=MajorAxis, minor_axis=MinorAxis)._Values for iPanel in (self, other)]
+        return FactorPanel(np.concatenate(Values, axis=0), items=self.items.append(other.items), major_axis=MajorAxis,
+                           minor_axis=MinorAxis)
+
+    def fillna(self, value, inplace=False):
+        Rslt = (self if inplace else self.copy())
+        Mask = pd.isna(Rslt._Values)
+        if Mask.any():
+            if (Rslt._Values.dtype.kind == "f") and (not isinstance(value, (int, float, np.number))):
+                Rslt._Values = Rslt._Values.astype("O")
+            Rslt._Values[Mask] = value
+        return (None if inplace else Rslt)
+
+    def where(self, cond, other=np.nan):
+        if isinstance(cond, FactorPanel): cond = cond._Values
+        if isinstance(other, FactorPanel): other = other._Values
+        return FactorPanel(np.where(cond, self._Values, other), items=self.items, major_axis=self.major_axis,
+                           minor_axis=self.minor_axis)
+
+    def _compare(self, other, op):
+        if isinstance(other, FactorPanel): other = other._Values
+        return FactorPanel(op(self._Values, other), items=self.items, major_axis=self.major_axis, minor_axis=self.minor_axis)
+
+    def __eq__(self, other):
+        return self._compare(other, np.equal)
+
+    def __ne__(self, other):
+        return self._compare(other, np.not_equal)
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    __hash__ = None
+
+    # 转换成 DataFrame(index=[(时点, ID)], columns=[因子]), filter_observations: 是否剔除含有缺失值的行
+    def to_frame(self, filter_observations=True):
+        Index = pd.MultiIndex.from_product([self.major_axis, self.minor_axis], names=["major", "minor"])
+        Data = pd.DataFrame(self._Values.reshape((self.shape[0], -1)).T, index=Index, columns=self.items)
+        if filter_observations: Data = Data[pd.notna(Data.values).all(axis=1)]
+        return Data
+
+
+class _Indexer(object):
+    def __init__(self, panel, by_label):
+        self._Panel = panel
+        self._ByLabel = by_label
+
+    def __getitem__(self, key):
+        return self._Panel._getItem(key, self._ByLabel)
+
+    def __setitem__(self, key, value):
+        self._Panel._setItem(key, value, self._ByLabel)
@@ -5,6 +5,7 @@ import json
 import numpy as np
 import pandas as pd
 import statsmodels.api as sm
+from scipy.stats import norm
 import uuid
 
 from QuantStudio import __QS_Error__
@@ -12,6 +13,11 @@ from QuantStudio.FactorDataBase.FactorDB import Factor
 from QuantStudio.FactorDataBase.FactorOperation import PointOperation, TimeOperation, SectionOperation
 from QuantStudio.Tools import DataPreprocessingFun
 
+from QuantNodes.factor_node import RollingKernel, SectionKernel, ExpandingKernel
+from QuantNodes.factor_node import FactorOperation
+from QuantNodes.factor_node.DTIndex import DTIndex
+from QuantNodes.factor_node.FactorDType import fromRecordArray
+
 
 def _genMultivariateOperatorInfo(*factors):
     Args = {}
@@ -434,8 +440,10 @@ def regress_change_rate(*factors, **kwargs):
 def _tolist(f, idt, iid, x, args):
     Data = [(iData if isinstance(iData, np.ndarray) else np.full(shape=(len(idt), len(iid)), fill_value=iData)) for
             iData in _genOperatorData(f, idt, iid, x, args)]
-    return pd.Panel({i: iData for i, iData in enumerate(Data)}).sort_index(axis=0).to_frame(
-        filter_observations=False).apply(lambda s: s.tolist(), axis=1).unstack().values
+    Data = np.stack(Data, axis=-1)
+    Rslt = np.empty(Data.shape[0] * Data.shape[1], dtype="O")
+    for i, iData in enumerate(Data.reshape((Rslt.shape[0], Data.shape[-1])).tolist()): Rslt[i] = iData
+    return Rslt.reshape(Data.shape[:2])
 
 
 def tolist(*factors, **kwargs):
@@ -503,16 +511,15 @@ def strptime(f, dt_format="%Y%m%d", is_datetime=True, **kwargs):
 
 
 # ----------------------时间序列运算--------------------------------
+# 未指定 win_type 的滚动运算使用 RollingKernel 中的 O(n) 算法, 指定了 win_type 时使用 pandas 的窗口函数
 def _rolling_mean(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    if "weights" not in args["OperatorArg"]:
-        return Data.rolling(**args["OperatorArg"]).mean().values[args["OperatorArg"]["window"] - 1:]
-    else:
-        weights = np.array(args["OperatorArg"]["weights"])
-        TotalWeight = np.nansum(weights)
-        return Data.rolling(**args["OperatorArg"]).apply(
-            lambda x: np.nansum(x * weights) / np.nansum(pd.notnull(x) * weights), raw=True).values[
-               args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if "weights" in OperatorArg:
+        return RollingKernel.rollingWeightedMean(Data, OperatorArg["weights"], min_periods=OperatorArg["min_periods"])
+    elif OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingMean(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).mean().values[OperatorArg["window"] - 1:]
 
 
 def rolling_mean(f, window, min_periods=1, win_type=None, weights=None, **kwargs):
@@ -532,8 +539,11 @@ def rolling_mean(f, window, min_periods=1, win_type=None, weights=None, **kwargs
 
 
 def _rolling_sum(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).sum().values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingSum(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).sum().values[OperatorArg["window"] - 1:]
 
 
 def rolling_sum(f, window, min_periods=1, win_type=None, **kwargs):
@@ -546,24 +556,24 @@ def rolling_sum(f, window, min_periods=1, win_type=None, **kwargs):
 
 def _rolling_prod(f, idt, iid, x, args):
     Data = _genOperatorData(f, idt, iid, x, args)[0]
-    Rslt = np.nanprod(Data, axis=0)
-    Rslt[np.sum(pd.notnull(Data), axis=0) < args["OperatorArg"]["min_periods"]] = np.nan
-    return Rslt
+    return RollingKernel.rollingProd(Data, args["OperatorArg"]["window"], min_periods=args["OperatorArg"]["min_periods"])
 
 
 def rolling_prod(f, window, min_periods=1, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
     Args["OperatorArg"] = {"window": window, "min_periods": min_periods}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
-                         {"算子": _rolling_prod, "参数": Args, "回溯期数": [window - 1] * len(Descriptors), "运算时点": "单时点",
+                         {"算子": _rolling_prod, "参数": Args, "回溯期数": [window - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _rolling_std(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
     OperatorArg = args["OperatorArg"].copy()
     SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.rolling(**OperatorArg).apply(lambda x: np.nanstd(x, **SubOperatorArg), raw=True).values[
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingStd(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"], **SubOperatorArg)
+    return pd.DataFrame(Data).rolling(**OperatorArg).apply(lambda x: np.nanstd(x, **SubOperatorArg), raw=True).values[
            args["OperatorArg"]["window"] - 1:]
 
 
@@ -577,8 +587,11 @@ def rolling_std(f, window, min_periods=1, win_type=None, ddof=1, **kwargs):
 
 
 def _rolling_max(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).max().values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingMax(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).max().values[OperatorArg["window"] - 1:]
 
 
 def rolling_max(f, window, min_periods=1, win_type=None, **kwargs):
@@ -590,8 +603,11 @@ def rolling_max(f, window, min_periods=1, win_type=None, **kwargs):
 
 
 def _rolling_min(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).min().values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingMin(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).min().values[OperatorArg["window"] - 1:]
 
 
 def rolling_min(f, window, min_periods=1, win_type=None, **kwargs):
@@ -603,8 +619,12 @@ def rolling_min(f, window, min_periods=1, win_type=None, **kwargs):
 
 
 def _rolling_argmax(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).apply(np.nanargmax).values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.reduceWindows(RollingKernel.genWindows(np.asarray(Data, dtype=np.float64), OperatorArg["window"]),
+                                           "argmax", min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).apply(np.nanargmax).values[OperatorArg["window"] - 1:]
 
 
 def rolling_argmax(f, window, min_periods=1, win_type=None, **kwargs):
@@ -616,8 +636,12 @@ def rolling_argmax(f, window, min_periods=1, win_type=None, **kwargs):
 
 
 def _rolling_argmin(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).apply(np.nanargmin).values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.reduceWindows(RollingKernel.genWindows(np.asarray(Data, dtype=np.float64), OperatorArg["window"]),
+                                           "argmin", min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).apply(np.nanargmin).values[OperatorArg["window"] - 1:]
 
 
 def rolling_argmin(f, window, min_periods=1, win_type=None, **kwargs):
@@ -629,8 +653,11 @@ def rolling_argmin(f, window, min_periods=1, win_type=None, **kwargs):
 
 
 def _rolling_median(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).median().values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingMedian(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).median().values[OperatorArg["window"] - 1:]
 
 
 def rolling_median(f, window, min_periods=1, win_type=None, **kwargs):
@@ -668,10 +695,12 @@ def rolling_kurt(f, window, min_periods=1, win_type=None, **kwargs):
 
 
 def _rolling_var(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
     OperatorArg = args["OperatorArg"].copy()
     SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.rolling(**OperatorArg).apply(lambda x: np.nanvar(x, **SubOperatorArg), raw=True).values[
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingVar(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"], **SubOperatorArg)
+    return pd.DataFrame(Data).rolling(**OperatorArg).apply(lambda x: np.nanvar(x, **SubOperatorArg), raw=True).values[
            args["OperatorArg"]["window"] - 1:]
 
 
@@ -685,10 +714,12 @@ def rolling_var(f, window, min_periods=1, win_type=None, ddof=1, **kwargs):
 
 
 def _rolling_quantile(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
     OperatorArg = args["OperatorArg"].copy()
     SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.rolling(**OperatorArg).quantile(**SubOperatorArg).values[args["OperatorArg"]["window"] - 1:]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingQuantile(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"], **SubOperatorArg)
+    return pd.DataFrame(Data).rolling(**OperatorArg).quantile(**SubOperatorArg).values[OperatorArg["window"] - 1:]
 
 
 def rolling_quantile(f, window, quantile=0.5, min_periods=1, win_type=None, **kwargs):
@@ -701,8 +732,8 @@ def rolling_quantile(f, window, quantile=0.5, min_periods=1, win_type=None, **kw
 
 
 def _rolling_count(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).count().values[args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    return RollingKernel.rollingCount(Data, args["OperatorArg"]["window"])
 
 
 def rolling_count(f, window, **kwargs):
@@ -735,9 +766,12 @@ def rolling_change_rate(f, window, **kwargs):
 
 
 def _rolling_rank(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.rolling(**args["OperatorArg"]).apply(lambda s: np.sort(s).searchsorted(s[-1])).values[
-           args["OperatorArg"]["window"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+    if OperatorArg.get("win_type", None) is None:
+        return RollingKernel.rollingRank(Data, OperatorArg["window"], min_periods=OperatorArg["min_periods"])
+    return pd.DataFrame(Data).rolling(**OperatorArg).apply(lambda s: np.sort(s).searchsorted(s[-1]), raw=True).values[
+           OperatorArg["window"] - 1:]
 
 
 def rolling_rank(f, window, min_periods=1, win_type=None, **kwargs):
@@ -748,68 +782,111 @@ def rolling_rank(f, window, min_periods=1, win_type=None, **kwargs):
                           "运算ID": "多ID"}, **kwargs)
 
 
+# 扩张窗口和指数加权运算的递推计算, fun(data, state) 返回 (结果, 状态), 算子的结果为去掉回溯期后的部分
+# resume 为 True 时, 计算状态保存在 f.TempData 中, 若本次计算的第一个时点紧接上次计算的最后时点且 ID 包含于上次的 ID, 则从保存的状态接续计算,
+# 结果与从上次计算的起点一次计算至今相同, 以便按时间分段计算和增量更新
+def _calcRecursive(f, idt, iid, data, args, fun):
+    LookBack = max([0] + list(f.LookBack))
+    nRow = data[0].shape[0]
+    if not args["OperatorArg"].get("resume", False):
+        return fun(data, None)[0][LookBack:]
+    Saved, State = f.TempData.get("RecursiveState", None), None
+    if Saved is not None:
+        isNext = (LookBack < len(idt)) and (Saved["NextDT"] is not None) and (idt[LookBack] == Saved["NextDT"])
+        isNext = isNext or ((LookBack > 0) and (Saved["LastDT"] is not None) and (idt[LookBack - 1] == Saved["LastDT"]))
+        Index = pd.Index(Saved["IDs"]).get_indexer(list(iid))
+        if isNext and (Index >= 0).all():
+            State = {iKey: iVal[..., Index] for iKey, iVal in Saved["State"].items()}
+    if State is None:
+        Rslt, State = fun(data, None)
+        Rslt = Rslt[LookBack:]
+    else:
+        Rslt, State = fun([iData[LookBack:] for iData in data], State)
+    f.TempData["RecursiveState"] = {"LastDT": idt[nRow - 1], "NextDT": (idt[nRow] if len(idt) > nRow else None),
+                                    "IDs": list(iid), "State": State}
+    return Rslt
+
+
+def _calcExpanding(f, idt, iid, x, args, how):
+    Data = _genOperatorData(f, idt, iid, x, args)[0]
+    OperatorArg = args["OperatorArg"]
+
+    def _fun(data, state):
+        return ExpandingKernel.expanding(data[0], how, state=state, min_periods=OperatorArg["min_periods"],
+                                         **OperatorArg.get("SubOperatorArg", {}))
+
+    return _calcRecursive(f, idt, iid, [Data], args, _fun)
+
+
+def _calcEWM(f, idt, iid, x, args, how):
+    Data = _genOperatorData(f, idt, iid, x, args)
+    OperatorArg = args["OperatorArg"]
+    Alpha = ExpandingKernel.genEWMAlpha(com=OperatorArg["com"], span=OperatorArg["span"], halflife=OperatorArg["halflife"],
+                                        alpha=OperatorArg["alpha"])
+
+    def _fun(data, state):
+        return ExpandingKernel.ewm(data[0], Alpha, how, state=state, data2=(data[1] if len(data) > 1 else None),
+                                   min_periods=OperatorArg["min_periods"], adjust=OperatorArg["adjust"],
+                                   ignore_na=OperatorArg["ignore_na"], **OperatorArg.get("SubOperatorArg", {}))
+
+    return _calcRecursive(f, idt, iid, Data, args, _fun)
+
+
 def _expanding_mean(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).mean().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "mean")
 
 
-def expanding_mean(f, min_periods=1, **kwargs):
+def expanding_mean(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_mean, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors),
                           "运算时点": "多时点", "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_sum(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).sum().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "sum")
 
 
-def expanding_sum(f, min_periods=1, **kwargs):
+def expanding_sum(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_sum, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_std(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.expanding(**OperatorArg).std(**SubOperatorArg).values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "std")
 
 
-def expanding_std(f, min_periods=1, ddof=1, **kwargs):
+def expanding_std(f, min_periods=1, ddof=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods, "SubOperatorArg": {"ddof": ddof}}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume, "SubOperatorArg": {"ddof": ddof}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_std, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_max(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).max().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "max")
 
 
-def expanding_max(f, min_periods=1, **kwargs):
+def expanding_max(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_max, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_min(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).min().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "min")
 
 
-def expanding_min(f, min_periods=1, **kwargs):
+def expanding_min(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_min, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
@@ -829,41 +906,36 @@ def expanding_median(f, min_periods=1, **kwargs):
 
 
 def _expanding_skew(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).skew().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "skew")
 
 
-def expanding_skew(f, min_periods=1, **kwargs):
+def expanding_skew(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_skew, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors),
                           "运算时点": "多时点", "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_kurt(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).kurt().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "kurt")
 
 
-def expanding_kurt(f, min_periods=1, **kwargs):
+def expanding_kurt(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_kurt, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors),
                           "运算时点": "多时点", "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_var(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.expanding(**OperatorArg).var(**SubOperatorArg).values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "var")
 
 
-def expanding_var(f, min_periods=1, ddof=1, **kwargs):
+def expanding_var(f, min_periods=1, ddof=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods, "SubOperatorArg": {"ddof": ddof}}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume, "SubOperatorArg": {"ddof": ddof}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_var, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
@@ -885,61 +957,54 @@ def expanding_quantile(f, quantile=0.5, min_periods=1, **kwargs):
 
 
 def _expanding_count(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.expanding(**args["OperatorArg"]).count().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcExpanding(f, idt, iid, x, args, "count")
 
 
-def expanding_count(f, min_periods=1, **kwargs):
+def expanding_count(f, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_count, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors),
                           "运算时点": "多时点", "运算ID": "多ID"}, **kwargs)
 
 
 def _ewm_mean(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    return Data.ewm(**args["OperatorArg"]).mean().values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcEWM(f, idt, iid, x, args, "mean")
 
 
-def ewm_mean(f, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False, **kwargs):
+def ewm_mean(f, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False, resume=False,
+             **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
     Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "alpha": alpha,
-                           "min_periods": min_periods, "adjust": adjust, "ignore_na": ignore_na}
+                           "min_periods": min_periods, "adjust": adjust, "ignore_na": ignore_na, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _ewm_mean, "参数": Args, "回溯期数": [min_periods] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _ewm_std(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.ewm(**OperatorArg).std(**SubOperatorArg).values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcEWM(f, idt, iid, x, args, "std")
 
 
 def ewm_std(f, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False, bias=False,
-            **kwargs):
+            resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
     Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "alpha": alpha, "min_periods": min_periods,
-                           "adjust": adjust, "ignore_na": ignore_na, "SubOperatorArg": {"bias": bias}}
+                           "adjust": adjust, "ignore_na": ignore_na, "resume": resume, "SubOperatorArg": {"bias": bias}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _ewm_std, "参数": Args, "回溯期数": [min_periods] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _ewm_var(f, idt, iid, x, args):
-    Data = pd.DataFrame(_genOperatorData(f, idt, iid, x, args)[0])
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return Data.ewm(**OperatorArg).var(**SubOperatorArg).values[args["OperatorArg"]["min_periods"] - 1:]
+    return _calcEWM(f, idt, iid, x, args, "var")
 
 
 def ewm_var(f, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False, bias=False,
-            **kwargs):
+            resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f)
     Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "alpha": alpha, "min_periods": min_periods,
-                           "adjust": adjust, "ignore_na": ignore_na, "SubOperatorArg": {"bias": bias}}
+                           "adjust": adjust, "ignore_na": ignore_na, "resume": resume, "SubOperatorArg": {"bias": bias}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _ewm_var, "参数": Args, "回溯期数": [min_periods] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
@@ -970,6 +1035,8 @@ def _rolling_corr(f, idt, iid, x, args):
                                            min_periods=args["OperatorArg"]["min_periods"],
                                            win_type=args["OperatorArg"]["win_type"]).corr(pd.DataFrame(Data2)).values[
                args["OperatorArg"]["window"] - 1:]
+    if Method == "spearman":
+        return RollingKernel.spearmanCorr(Data1, Data2, min_periods=args["OperatorArg"]["min_periods"])
     Mask = np.sum(pd.notnull(Data1) & pd.notnull(Data2), axis=0)
     Rslt = pd.DataFrame(Data1).corrwith(pd.DataFrame(Data2), axis=0, drop=False, method=Method).values
     Rslt[Mask < args["OperatorArg"]["min_periods"]] = np.nan
@@ -990,46 +1057,42 @@ def rolling_corr(f1, f2, window, min_periods=1, method="pearson", win_type=None,
                               "运算ID": "多ID"}, **kwargs)
 
 
+# 滚动回归, 由 RollingKernel.rollingRegress 批量求解, 只有退化的窗口(样本不足或者共线)逐个使用 statsmodels 回归
 def _rolling_regress(f, idt, iid, x, args):
     X = _genOperatorData(f, idt, iid, x, args)
     Y = X[0]
-    if args["OperatorArg"]['constant']:
-        X = np.array([np.ones(Y.shape)] + X[1:])
-    else:
-        X = np.array(X[1:])
-    Window = args["OperatorArg"]['window']
-    Weight = (0.5 ** (1 / args["OperatorArg"]['half_life'])) ** np.arange(Window)
-    Weight = Weight[::-1] / np.sum(Weight)
-    Rslt = np.empty((Y.shape[0] - Window + 1, Y.shape[1]), dtype="O")
-    for i in range(Rslt.shape[0]):
-        for j in range(Rslt.shape[1]):
+    Window, Constant = args["OperatorArg"]['window'], args["OperatorArg"]['constant']
+    Rslt, Degenerate = RollingKernel.rollingRegress(Y, X[1:], Window, constant=Constant, half_life=args["OperatorArg"]['half_life'])
+    if Degenerate.any():
+        if Constant:
+            X = np.array([np.ones(Y.shape)] + X[1:])
+        else:
+            X = np.array(X[1:])
+        Weight = (0.5 ** (1 / args["OperatorArg"]['half_life'])) ** np.arange(Window)
+        Weight = Weight[::-1] / np.sum(Weight)
+        for i, j in zip(*np.nonzero(Degenerate)):
             iY = Y[i:i + Window, j]
             iX = X[:, i:i + Window, j].T
             try:
-                iRslt = sm.WLS(iY, iX, missing='drop').fit()
+                iRslt = sm.WLS(iY, iX, weights=Weight, missing='drop').fit()
                 Rslt[i, j] = tuple(iRslt.params) + tuple(iRslt.tvalues) + (
                     iRslt.fvalue, iRslt.rsquared, iRslt.rsquared_adj)
             except:
-                Rslt[i, j] = (np.nan,) * int(X.shape[0] * 2 + 3)
-    return Rslt
+                pass
+    # 因子的数据类型为 record 时直接返回结构化数组, 否则(如 QuantStudio 的运算因子)返回 tuple 的对象数组
+    if getattr(f, "DataType", None) == "record": return Rslt
+    return fromRecordArray(Rslt)
 
 
 def rolling_regress(Y, *X, window=20, constant=True, half_life=np.inf, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(*((Y,) + X))
     Args["OperatorArg"] = {"window": window, "constant": constant, "half_life": half_life}
     nX = len(X)
-
-    f = TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
-                      {"算子": _rolling_regress, "参数": Args, "回溯期数": [window - 1] * len(Descriptors), "运算时点": "多时点",
-                       "运算ID": "多ID", "数据类型": "object"}, **kwargs)
-    if constant:
-        DataType = [('alpha', np.float)] + [('beta' + str(i), np.float) for i in range(nX)]
-        DataType += [('t_alpha', np.float)] + [('t_beta' + str(i), np.float) for i in range(nX)]
-    else:
-        DataType = [('beta' + str(i), np.float) for i in range(nX)]
-        DataType += [('t_beta' + str(i), np.float) for i in range(nX)]
-    DataType += [('fvalue', np.float), ('rsquared', np.float), ('rsquared_adj', np.float)]
-    f.TempData["dtype"] = DataType
+    # record 类型只有 QuantNodes 的运算因子支持
+    f = FactorOperation.TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
+                                      {"算子": _rolling_regress, "参数": Args, "回溯期数": [window - 1] * len(Descriptors),
+                                       "运算时点": "多时点", "运算ID": "多ID", "数据类型": "record"}, **kwargs)
+    f.TempData["dtype"] = RollingKernel.genRegressDType(nX, constant=constant).descr
     return f
 
 
@@ -1054,64 +1117,64 @@ def rolling_regress_change(f, window=20, min_periods=2, **kwargs):
 
 
 def _expanding_cov(f, idt, iid, x, args):
-    Data1, Data2 = _genOperatorData(f, idt, iid, x, args)
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return pd.DataFrame(Data1).expanding(**OperatorArg).cov(pd.DataFrame(Data2), **SubOperatorArg).values[
-           args["OperatorArg"]["min_periods"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)
+    OperatorArg = args["OperatorArg"]
+
+    def _fun(data, state):
+        return ExpandingKernel.expandingCov(data[0], data[1], "cov", state=state, min_periods=OperatorArg["min_periods"],
+                                            **OperatorArg.get("SubOperatorArg", {}))
+
+    return _calcRecursive(f, idt, iid, Data, args, _fun)
 
 
-def expanding_cov(f1, f2, min_periods=1, ddof=1, **kwargs):
+def expanding_cov(f1, f2, min_periods=1, ddof=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f1, f2)
-    Args["OperatorArg"] = {"min_periods": min_periods, "SubOperatorArg": {"ddof": ddof}}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume, "SubOperatorArg": {"ddof": ddof}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_cov, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _expanding_corr(f, idt, iid, x, args):
-    Data1, Data2 = _genOperatorData(f, idt, iid, x, args)
-    return pd.DataFrame(Data1).expanding(**args["OperatorArg"]).corr(pd.DataFrame(Data2)).values[
-           args["OperatorArg"]["min_periods"] - 1:]
+    Data = _genOperatorData(f, idt, iid, x, args)
+
+    def _fun(data, state):
+        return ExpandingKernel.expandingCov(data[0], data[1], "corr", state=state, min_periods=args["OperatorArg"]["min_periods"])
 
+    return _calcRecursive(f, idt, iid, Data, args, _fun)
 
-def expanding_corr(f1, f2, min_periods=1, **kwargs):
+
+def expanding_corr(f1, f2, min_periods=1, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f1, f2)
-    Args["OperatorArg"] = {"min_periods": min_periods}
+    Args["OperatorArg"] = {"min_periods": min_periods, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _expanding_corr, "参数": Args, "回溯期数": [min_periods - 1] * len(Descriptors),
                           "运算时点": "多时点", "运算ID": "多ID"}, **kwargs)
 
 
 def _ewm_cov(f, idt, iid, x, args):
-    Data1, Data2 = _genOperatorData(f, idt, iid, x, args)
-    OperatorArg = args["OperatorArg"].copy()
-    SubOperatorArg = OperatorArg.pop("SubOperatorArg", {})
-    return pd.DataFrame(Data1).ewm(**OperatorArg).cov(pd.DataFrame(Data2), **SubOperatorArg).values[
-           args["OperatorArg"]["min_periods"] - 1:]
+    return _calcEWM(f, idt, iid, x, args, "cov")
 
 
 def ewm_cov(f1, f2, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False,
-            bias=False, **kwargs):
+            bias=False, resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f1, f2)
-    Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "min_periods": min_periods,
-                           "adjust": adjust, "ignore_na": ignore_na, "SubOperatorArg": {"bias": bias}}
+    Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "alpha": alpha, "min_periods": min_periods,
+                           "adjust": adjust, "ignore_na": ignore_na, "resume": resume, "SubOperatorArg": {"bias": bias}}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _ewm_cov, "参数": Args, "回溯期数": [min_periods] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
 
 
 def _ewm_corr(f, idt, iid, x, args):
-    Data1, Data2 = _genOperatorData(f, idt, iid, x, args)
-    return pd.DataFrame(Data1).ewm(**args["OperatorArg"]).corr(pd.DataFrame(Data2)).values[
-           args["OperatorArg"]["min_periods"] - 1:]
+    return _calcEWM(f, idt, iid, x, args, "corr")
 
 
 def ewm_corr(f1, f2, com=None, span=None, halflife=None, alpha=None, min_periods=0, adjust=True, ignore_na=False,
-             **kwargs):
+             resume=False, **kwargs):
     Descriptors, Args = _genMultivariateOperatorInfo(f1, f2)
-    Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "min_periods": min_periods,
-                           "adjust": adjust, "ignore_na": ignore_na}
+    Args["OperatorArg"] = {"com": com, "span": span, "halflife": halflife, "alpha": alpha, "min_periods": min_periods,
+                           "adjust": adjust, "ignore_na": ignore_na, "resume": resume}
     return TimeOperation(kwargs.pop("factor_name", str(uuid.uuid1())), Descriptors,
                          {"算子": _ewm_corr, "参数": Args, "回溯期数": [min_periods] * len(Descriptors), "运算时点": "多时点",
                           "运算ID": "多ID"}, **kwargs)
@@ -1120,16 +1183,9 @@ def ewm_corr(f1, f2, com=None, span=None, halflife=None, alpha=None, min_periods
 def _lag(f, idt, iid, x, args):
     if args["OperatorArg"]['dt_change_fun'] is None: return x[0][args["OperatorArg"]['window'] - args["OperatorArg"][
         'lag_period']:x[0].shape[0] - args["OperatorArg"]['lag_period']]
-    TargetDTs = args["OperatorArg"]['dt_change_fun'](idt)
-    Data = pd.DataFrame(x[0], index=idt)
-    TargetData = Data.loc[TargetDTs].values
-    TargetData[args["OperatorArg"]['lag_period']:] = TargetData[:-args["OperatorArg"]['lag_period']]
-    if f.FactorDataType != "double":
-        Data = pd.DataFrame(np.empty(Data.shape, dtype="O"), index=Data.index, columns=iid)
-    else:
-        Data = pd.DataFrame(index=Data.index, columns=iid, dtype="float")
-    Data.loc[TargetDTs] = TargetData
-    return Data.fillna(method='pad').values[args["OperatorArg"]['window']:]
+    TargetPos = DTIndex(idt).getIndexer(args["OperatorArg"]['dt_change_fun'](idt))
+    TargetPos = np.sort(TargetPos[TargetPos >= 0])
+    return RollingKernel.lagTargets(x[0], TargetPos, args["OperatorArg"]['lag_period'])[args["OperatorArg"]['window']:]
 
 
 def lag(f, lag_period=1, window=1, dt_change_fun=None, **kwargs):
@@ -1158,7 +1214,7 @@ def _fillna(f, idt, iid, x, args):
 
     if args["OperatorArg"]["value"] is None:
         LookBack = args["OperatorArg"]["lookback"]
-        return pd.DataFrame(Data).fillna(method="pad", limit=LookBack).values[LookBack:]
+        return RollingKernel.forwardFill(Data, limit=LookBack)[LookBack:]
     else:
         Data[pd.isnull(Data)] = args["OperatorArg"]["value"]
         return Data
@@ -1195,6 +1251,14 @@ def nav(ret, init=None, **kwargs):
 
 
 # ----------------------单截面运算--------------------------------
+# 默认的统计量和方法由 SectionKernel 对所有截面一次计算, 其余情况逐截面调用 DataPreprocessingFun
+# 将按照截面打包的多个描述子数据 array(shape=(nDT, n, nID)) 还原成 [array(shape=(nDT, nID))]
+def _unpackSectionData(data):
+    if data is None: return None
+    elif data.ndim == 3: return [data[:, i] for i in range(data.shape[1])]
+    return [data]
+
+
 def _standardizeZScore(f, idt, iid, x, args):
     Data = _genOperatorData(f, idt, iid, x, args)
     OperatorArg = args["OperatorArg"].copy()
@@ -1219,6 +1283,12 @@ def _standardizeZScore(f, idt, iid, x, args):
     DispersionWeight = OperatorArg.pop("dispersion_weight")
     if DispersionWeight is not None:
         DispersionWeight = Data[StartInd]
+    if (OperatorArg["avg_statistics"] in SectionKernel.AVG_STATISTICS) and (
+            OperatorArg["dispersion_statistics"] in SectionKernel.DISPERSION_STATISTICS) and (
+            (AvgWeight is None) or (OperatorArg["avg_statistics"] == "平均值")) and (
+            (DispersionWeight is None) or (OperatorArg["dispersion_statistics"] == "标准差")):
+        return SectionKernel.standardizeZScore(FactorData, mask=Mask, cat_data=_unpackSectionData(CatData),
+                                               avg_weight=AvgWeight, dispersion_weight=DispersionWeight, **OperatorArg)
     Rslt = np.zeros(FactorData.shape) + np.nan
     for i in range(FactorData.shape[0]):
         Rslt[i] = DataPreprocessingFun.standardizeZScore(FactorData[i], mask=(Mask[i] if Mask is not None else None),
@@ -1280,12 +1350,7 @@ def _standardizeRank(f, idt, iid, x, args):
     elif CatData is not None:
         CatData = Data[StartInd:StartInd + CatData]
         CatData = np.array(list(zip(*CatData)))
-    Rslt = np.zeros(FactorData.shape) + np.nan
-    for i in range(FactorData.shape[0]):
-        Rslt[i] = DataPreprocessingFun.standardizeRank(FactorData[i], mask=(Mask[i] if Mask is not None else None),
-                                                       cat_data=(CatData[i].T if CatData is not None else None),
-                                                       **OperatorArg)
-    return Rslt
+    return SectionKernel.standardizeRank(FactorData, mask=Mask, cat_data=_unpackSectionData(CatData), **OperatorArg)
 
 
 def standardizeRank(f, mask=None, cat_data=None, ascending=True, uniformization=True, perturbation=False, offset=0.5,
@@ -1328,11 +1393,12 @@ def _standardizeQuantile(f, idt, iid, x, args):
     elif CatData is not None:
         CatData = Data[StartInd:StartInd + CatData]
         CatData = np.array(list(zip(*CatData)))
-    Rslt = np.zeros(FactorData.shape) + np.nan
-    for i in range(FactorData.shape[0]):
-        Rslt[i] = DataPreprocessingFun.standardizeQuantile(FactorData[i], mask=(Mask[i] if Mask is not None else None),
-                                                           cat_data=(CatData[i].T if CatData is not None else None),
-                                                           **OperatorArg)
+    # 均匀化的排名 (排名 - 0.5) / 有效数据个数 经过标准正态分布的分位数函数转换
+    Rslt = norm.ppf(SectionKernel.standardizeRank(FactorData, mask=Mask, cat_data=_unpackSectionData(CatData),
+                                                  ascending=OperatorArg["ascending"], uniformization=True,
+                                                  perturbation=OperatorArg["perturbation"], offset=0.5))
+    if (OperatorArg["other_handle"] == "保持不变") and (Mask is not None):
+        Rslt[~Mask] = FactorData[~Mask]
     return Rslt
 
 
@@ -1405,18 +1471,8 @@ def _fillNaNByFun(f, idt, iid, x, args):
         CatData = Data[StartInd:StartInd + CatData]
         CatData = np.array(list(zip(*CatData)))
     ValFun = OperatorArg.pop("val_fun")
-    if ValFun == "平均值":
-        ValFun = (lambda x, n: np.zeros(n) + np.nanmean(x))
-    elif ValFun == "中位数":
-        ValFun = (lambda x, n: np.zeros(n) + np.nanmedian(x))
-    elif ValFun == "最大值":
-        ValFun = (lambda x, n: np.zeros(n) + np.nanmax(x))
-    elif ValFun == "最小值":
-        ValFun = (lambda x, n: np.zeros(n) + np.nanmin(x))
-    elif ValFun == "高斯随机数":
-        ValFun = (lambda x, n: np.random.randn(n) * np.nanstd(x) + np.nanmean(x))
-    elif ValFun == "均匀随机数":
-        ValFun = (lambda x, n: np.random.rand(n) * (np.nanmax(x) - np.nanmin(x)) + np.nanmin(x))
+    if ValFun in SectionKernel.FILL_FUNS:
+        return SectionKernel.fillNaNByFun(FactorData, mask=Mask, cat_data=_unpackSectionData(CatData), val_fun=ValFun)
     Rslt = np.zeros(FactorData.shape) + np.nan
     for i in range(FactorData.shape[0]):
         Rslt[i] = DataPreprocessingFun.fillNaNByFun(FactorData[i], mask=(Mask[i] if Mask is not None else None),
@@ -1480,14 +1536,8 @@ def _fillNaNByRegress(f, idt, iid, x, args):
         DummyData = Data[StartInd:StartInd + DummyData]
         StartInd += len(DummyData)
         DummyData = np.array(list(zip(*DummyData)))
-    Rslt = np.zeros(FactorData.shape) + np.nan
-    for i in range(FactorData.shape[0]):
-        Rslt[i] = DataPreprocessingFun.fillNaNByRegress(FactorData[i], X=(X[i].T if X is not None else None),
-                                                        mask=(Mask[i] if Mask is not None else None),
-                                                        cat_data=(CatData[i].T if CatData is not None else None),
-                                                        dummy_data=(DummyData[i].T if DummyData is not None else None),
-                                                        **OperatorArg)
-    return Rslt
+    return SectionKernel.fillNaNByRegress(FactorData, X=_unpackSectionData(X), mask=Mask, cat_data=_unpackSectionData(CatData),
+                                          dummy_data=_unpackSectionData(DummyData), **OperatorArg)
 
 
 def fillNaNByRegress(Y, X, mask=None, cat_data=None, constant=False, dummy_data=None, drop_dummy_na=False, **kwargs):
@@ -1544,6 +1594,13 @@ def _winsorize(f, idt, iid, x, args):
     elif CatData is not None:
         CatData = Data[StartInd:StartInd + CatData]
         CatData = np.array(list(zip(*CatData)))
+    if (OperatorArg["method"] in SectionKernel.WINSORIZE_METHODS) and (
+            OperatorArg["avg_statistics"] in SectionKernel.AVG_STATISTICS) and (
+            OperatorArg["dispersion_statistics"] in SectionKernel.DISPERSION_STATISTICS):
+        return SectionKernel.winsorize(FactorData, mask=Mask, cat_data=_unpackSectionData(CatData), method=OperatorArg["method"],
+                                       avg_statistics=OperatorArg["avg_statistics"],
+                                       dispersion_statistics=OperatorArg["dispersion_statistics"],
+                                       std_multiplier=OperatorArg["std_multiplier"], other_handle=OperatorArg["other_handle"])
     Rslt = np.zeros(FactorData.shape) + np.nan
     for i in range(FactorData.shape[0]):
         Rslt[i] = DataPreprocessingFun.winsorize(FactorData[i], mask=(Mask[i] if Mask is not None else None),
@@ -1601,13 +1658,8 @@ def _orthogonalize(f, idt, iid, x, args):
     elif DummyData is not None:
         DummyData = Data[StartInd:StartInd + DummyData]
         DummyData = np.array(list(zip(*DummyData)))
-    Rslt = np.zeros(FactorData.shape) + np.nan
-    for i in range(FactorData.shape[0]):
-        Rslt[i] = DataPreprocessingFun.orthogonalize(FactorData[i], X=(X[i].T if X is not None else None),
-                                                     mask=(Mask[i] if Mask is not None else None),
-                                                     dummy_data=(DummyData[i].T if DummyData is not None else None),
-                                                     **OperatorArg)
-    return Rslt
+    return SectionKernel.orthogonalize(FactorData, X=_unpackSectionData(X), mask=Mask, dummy_data=_unpackSectionData(DummyData),
+                                       **OperatorArg)
 
 
 def orthogonalize(Y, X, mask=None, constant=False, dummy_data=None, drop_dummy_na=False, other_handle='填充None',
@@ -1645,31 +1697,11 @@ def orthogonalize(Y, X, mask=None, constant=False, dummy_data=None, drop_dummy_n
 # ----------------------多截面运算--------------------------------
 def _aggregate(f, idt, iid, x, args):
     Data = _genOperatorData(f, idt, iid, x, args)
-    nID = len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
     AggrFun = args["OperatorArg"]["aggr_fun"]
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nID,), fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                Rslt[i] = AggrFun(FactorData[iMask])
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                Rslt[iMask] = AggrFun(FactorData[iMask])
-    else:
-        Rslt = np.full(shape=(nID,), fill_value=AggrFun(FactorData[Mask]))
-    return Rslt
+    Mask = ((Data[1] == 1)[np.newaxis] if args["OperatorArg"]["Mask"] else None)
+    CatData = (Data[-1][np.newaxis] if args["OperatorArg"]["CatData"] else None)
+    return SectionKernel.aggregate(Data[0][np.newaxis], mask=Mask, cat_data=CatData, how=SectionKernel.REDUCE_FUNS.get(AggrFun, AggrFun),
+                                   target_ids=(iid if args["OperatorArg"]["SectionChged"] or (CatData is None) else None))[0]
 
 
 def aggregate(f, aggr_fun=np.nansum, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -1689,17 +1721,10 @@ def aggregate(f, aggr_fun=np.nansum, mask=None, cat_data=None, descriptor_ids=No
 
 def _disaggregate(f, idt, iid, x, args):
     Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
     FactorData = Data[0]
     if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        for i, iID in enumerate(args["OperatorArg"]["aggr_ids"]):
-            iMask = (CatData == iID)
-            Rslt[iMask] = FactorData[:, [i]].repeat(nID, axis=1)[iMask]
-    else:
-        Rslt = FactorData.repeat(nID, axis=1)
-    return Rslt
+        return SectionKernel.disaggregate(FactorData, Data[-1], args["OperatorArg"]["aggr_ids"])
+    return FactorData.repeat(len(iid), axis=1)
 
 
 def disaggregate(f, aggr_ids, cat_data=None, disaggr_ids=None, **kwargs):  # 将聚合因子分解成为普通因子
@@ -1715,32 +1740,18 @@ def disaggregate(f, aggr_ids, cat_data=None, disaggr_ids=None, **kwargs):  # 将
                             {"算子": _disaggregate, "参数": Args, "运算时点": "多时点", "描述子截面": DescriptorIDs}, **kwargs)
 
 
-def _aggr_sum(f, idt, iid, x, args):
+# 多截面的聚合运算由 SectionKernel.aggregate 分组计算, how: 统计量
+def _aggrSection(f, idt, iid, x, args, how, factor_data=None, **kwargs):
     Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                Rslt[:, i] = np.nansum(iMask * FactorData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                Rslt[iMask] = np.nansum(iMask * FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        Rslt = np.nansum(FactorData * Mask, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    FactorData = (Data[0] if factor_data is None else factor_data(Data[0]))
+    Mask = ((Data[1] == 1) if args["OperatorArg"]["Mask"] else None)
+    CatData = (Data[-1] if args["OperatorArg"]["CatData"] else None)
+    return SectionKernel.aggregate(FactorData, mask=Mask, cat_data=CatData, how=how,
+                                   target_ids=(iid if args["OperatorArg"]["SectionChged"] or (CatData is None) else None), **kwargs)
+
+
+def _aggr_sum(f, idt, iid, x, args):
+    return _aggrSection(f, idt, iid, x, args, "sum")
 
 
 def aggr_sum(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -1759,38 +1770,7 @@ def aggr_sum(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
 
 
 def _aggr_prod(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanprod(iData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = np.nanprod(iData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanprod(FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "prod")
 
 
 def aggr_prod(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -1809,38 +1789,7 @@ def aggr_prod(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
 
 
 def _aggr_max(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if FactorData.shape[1] == 0: return np.full(shape=(nDT, nID), fill_value=np.nan)
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanmax(iData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = np.nanmax(iData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanmax(FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "max")
 
 
 def aggr_max(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -1859,38 +1808,7 @@ def aggr_max(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
 
 
 def _aggr_min(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if FactorData.shape[1] == 0: return np.full(shape=(nDT, nID), fill_value=np.nan)
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanmin(iData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = np.nanmin(iData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanmin(FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "min")
 
 
 def aggr_min(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -1909,39 +1827,10 @@ def aggr_min(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
 
 
 def _aggr_mean(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
+    Weight = None
     if args["OperatorArg"]["Weight"]:
-        WeightData = Data[2 - args["OperatorArg"]["Mask"]]
-    else:
-        WeightData = np.ones(FactorData.shape)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                Rslt[:, i] = np.nansum(iMask * WeightData * FactorData, axis=1) / np.nansum(iMask * WeightData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                Rslt[iMask] = \
-                    (np.nansum(iMask * WeightData * FactorData, axis=1) / np.nansum(iMask * WeightData,
-                                                                                    axis=1)).reshape(
-                        (nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        Rslt = (np.nansum(FactorData * WeightData * Mask, axis=1) / np.nansum(WeightData * Mask, axis=1)).reshape(
-            (nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+        Weight = _genOperatorData(f, idt, iid, x, args)[2 - args["OperatorArg"]["Mask"]]
+    return _aggrSection(f, idt, iid, x, args, "mean", weight=Weight)
 
 
 def aggr_mean(f, mask=None, cat_data=None, weight_data=None, descriptor_ids=None, **kwargs):
@@ -1962,39 +1851,7 @@ def aggr_mean(f, mask=None, cat_data=None, weight_data=None, descriptor_ids=None
 
 
 def _aggr_std(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanstd(iData, axis=1, ddof=args["OperatorArg"]["ddof"])
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = \
-                    np.nanstd(iData, axis=1, ddof=args["OperatorArg"]["ddof"]).reshape((nDT, 1)).repeat(nID, axis=1)[
-                        iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanstd(FactorData, axis=1, ddof=args["OperatorArg"]["ddof"]).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "std", ddof=args["OperatorArg"]["ddof"])
 
 
 def aggr_std(f, ddof=1, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -2013,39 +1870,7 @@ def aggr_std(f, ddof=1, mask=None, cat_data=None, descriptor_ids=None, **kwargs)
 
 
 def _aggr_var(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanvar(iData, axis=1, ddof=args["OperatorArg"]["ddof"])
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = \
-                    np.nanvar(iData, axis=1, ddof=args["OperatorArg"]["ddof"]).reshape((nDT, 1)).repeat(nID, axis=1)[
-                        iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanvar(FactorData, axis=1, ddof=args["OperatorArg"]["ddof"]).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "var", ddof=args["OperatorArg"]["ddof"])
 
 
 def aggr_var(f, ddof=1, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -2064,37 +1889,7 @@ def aggr_var(f, ddof=1, mask=None, cat_data=None, descriptor_ids=None, **kwargs)
 
 
 def _aggr_median(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanmedian(iData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = np.nanmedian(iData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanmedian(FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "median")
 
 
 def aggr_median(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -2112,42 +1907,7 @@ def aggr_median(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
 
 
 def _aggr_quantile(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = Data[0]
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        iData = np.full(shape=FactorData.shape, fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[:, i] = np.nanpercentile(iData, q=args["OperatorArg"]["quantile"] * 100, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                iData[:] = np.nan
-                iData[iMask] = FactorData[iMask]
-                Rslt[iMask] = \
-                    np.nanpercentile(iData, q=args["OperatorArg"]["quantile"] * 100, axis=1).reshape((nDT, 1)).repeat(
-                        nID,
-                        axis=1)[
-                        iMask]
-    else:
-        FactorData[~Mask] = np.nan
-        Rslt = np.nanpercentile(FactorData, q=args["OperatorArg"]["quantile"] * 100, axis=1).reshape((nDT, 1)).repeat(
-            nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "quantile", quantile=args["OperatorArg"]["quantile"])
 
 
 def aggr_quantile(f, quantile=0.5, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
@@ -2165,31 +1925,7 @@ def aggr_quantile(f, quantile=0.5, mask=None, cat_data=None, descriptor_ids=None
 
 
 def _aggr_count(f, idt, iid, x, args):
-    Data = _genOperatorData(f, idt, iid, x, args)
-    nDT, nID = len(idt), len(iid)
-    FactorData = pd.notnull(Data[0])
-    if args["OperatorArg"]["Mask"]:
-        Mask = (Data[1] == 1)
-    else:
-        Mask = np.full(FactorData.shape, fill_value=True)
-    if args["OperatorArg"]["CatData"]:
-        CatData = Data[-1]
-        Rslt = np.full(shape=(nDT, nID), fill_value=np.nan)
-        if args["OperatorArg"]["SectionChged"]:
-            for i, iID in enumerate(iid):
-                iMask = ((CatData == iID) & Mask)
-                Rslt[:, i] = np.nansum(iMask * FactorData, axis=1)
-        else:
-            AllCats = pd.unique(CatData.flatten())
-            for i, iCat in enumerate(AllCats):
-                if pd.isnull(iCat):
-                    iMask = (pd.isnull(CatData) & Mask)
-                else:
-                    iMask = ((CatData == iCat) & Mask)
-                Rslt[iMask] = np.nansum(iMask * FactorData, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)[iMask]
-    else:
-        Rslt = np.nansum(FactorData * Mask, axis=1).reshape((nDT, 1)).repeat(nID, axis=1)
-    return Rslt
+    return _aggrSection(f, idt, iid, x, args, "count", factor_data=lambda x: np.where(pd.notnull(x), 1.0, np.nan))
 
 
 def aggr_count(f, mask=None, cat_data=None, descriptor_ids=None, **kwargs):
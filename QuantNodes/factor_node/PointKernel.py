@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""单点运算的批量计算"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 单时点单ID 模式的计算方式
+# 无: 逐个 (时点, ID) 调用算子
+# 向量化: 以 (nDT, nID) 的描述子数组调用一次算子, 要求算子是逐元素的运算, 此时 idt 为 [时点], iid 为 [ID]
+# numba: 使用 numba 编译算子, 在编译后的循环中逐点调用, 算子只能使用 x, 调用时 f, idt, iid, args 均为 None, x 为 tuple
+POINT_MODES = ("无", "向量化", "numba")
+
+_NUMBA_LOOPS = {}  # 已编译的循环, {描述子个数: 函数}
+_NUMBA_KERNELS = {}  # 已编译的算子, {id(算子): (算子, 编译后的算子)}
+
+
+# 装饰器, 声明算子是逐元素的运算, 单时点单ID 模式下自动以 (nDT, nID) 的数组调用一次
+def vectorizable(fun):
+    fun._QS_Vectorizable = True
+    return fun
+
+
+def isVectorizable(fun):
+    return getattr(fun, "_QS_Vectorizable", False)
+
+
+# 单时点单ID 模式的批量计算, 结果写入 out, 返回: out, 无法批量计算时返回 None, 由调用方逐点计算
+def calcPointData(operator, f, dts, ids, descriptor_data, args, out, mode="无"):
+    if (mode == "向量化") or ((mode == "无") and isVectorizable(operator)):
+        out[:] = np.broadcast_to(np.asarray(operator(f, dts, ids, descriptor_data, args)), out.shape)
+        return out
+    elif mode == "numba":
+        return _calcByNumba(operator, descriptor_data, out)
+    return None
+
+
+def _genNumbaLoop(n):
+    Loop = _NUMBA_LOOPS.get(n)
+    if Loop is not None: return Loop
+    Args = ", ".join("x%d" % i for i in range(n))
+    Elements = "".join("x%d[i, j], " % i for i in range(n))
+    Source = "\n".join(["def _QS_Loop(kernel, out, %s):" % Args,
+                        "    for i in range(out.shape[0]):",
+                        "        for j in range(out.shape[1]):",
+                        "            out[i, j] = kernel(None, None, None, (%s), None)" % Elements])
+    Namespace = {}
+    exec(compile(Source, "<PointKernel>", "exec"), Namespace)
+    Loop = _NUMBA_LOOPS[n] = numba.njit(cache=False)(Namespace["_QS_Loop"])
+    return Loop
+
+
+def _calcByNumba(operator, descriptor_data, out):
+    if (numba is None) or (out.dtype.kind != "f") or (not descriptor_data): return None
+    if any(np.asarray(iData).dtype.kind not in "biuf" for iData in descriptor_data): return None
+    Kernel = _NUMBA_KERNELS.get(id(operator))
+    if (Kernel is None) or (Kernel[0] is not operator):
+        Kernel = _NUMBA_KERNELS[id(operator)] = (operator, numba.njit(cache=False)(operator))
+    try:
+        _genNumbaLoop(len(descriptor_data))(Kernel[1], out, *[np.asarray(iData, dtype=np.float64) for iData in descriptor_data])
+    except Exception:  # 算子无法编译, 比如使用了 f, idt, iid, args 或者不支持的 Python 特性
+        return None
+    return out
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""跨运行的因子结果缓存"""
+import hashlib
+import os
+import shutil
+import uuid
+
+from QuantNodes.factor_node.FactorCache import openCacheFile, detectCacheFormat
+
+_DATA_FILE = "Data"  # 缓存条目文件夹中的缓存文件名
+_TMP_SUFFIX = ".tmp"  # 正在写入的缓存条目的后缀
+
+
+# 生成缓存键, parts: 参与哈希的对象, 要求其 repr 在不同运行之间稳定
+def genResultKey(*parts):
+    return hashlib.md5(repr(parts).encode("utf-8")).hexdigest()
+
+
+# 持久化的结果缓存, 每个条目是 cache_dir 下以缓存键命名的文件夹, 其中存放一个缓存文件: {键: 值}
+# 条目先写入临时文件夹再重命名, 多个进程同时读写时不会读到写了一半的条目
+# 条目文件夹的修改时间作为最近访问时间, 总大小超过 max_size 时按照最近最少使用的顺序淘汰
+class ResultCache(object):
+    def __init__(self, cache_dir, max_size=0, cache_format="mmap"):
+        self._CacheDir = cache_dir
+        self._MaxSize = max_size  # 缓存容量(字节), 0 表示不限制
+        self._CacheFormat = cache_format
+        os.makedirs(self._CacheDir, exist_ok=True)
+
+    @property
+    def CacheDir(self):
+        return self._CacheDir
+
+    def _genPath(self, key):
+        return os.path.join(self._CacheDir, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._genPath(key))
+
+    # 读取缓存条目, 返回: {键: 值}, 未命中返回 None
+    def get(self, key):
+        DirPath = self._genPath(key)
+        FilePath = os.path.join(DirPath, _DATA_FILE)
+        try:
+            CacheFormat = detectCacheFormat(FilePath, self._CacheFormat)
+            if CacheFormat is None: return None
+            with openCacheFile(FilePath, "r", CacheFormat) as File:
+                Data = {iKey: File[iKey] for iKey in File.keys()}
+            os.utime(DirPath)
+        except (OSError, KeyError, EOFError):  # 条目正在被其他进程淘汰
+            return None
+        return Data
+
+    # 写入缓存条目, data: {键: 值}
+    def put(self, key, data):
+        DirPath = self._genPath(key)
+        if os.path.isdir(DirPath): return 0
+        TmpPath = DirPath + "." + uuid.uuid4().hex + _TMP_SUFFIX
+        os.makedirs(TmpPath)
+        try:
+            with openCacheFile(os.path.join(TmpPath, _DATA_FILE), "c", self._CacheFormat) as File:
+                for iKey, iVal in data.items(): File[iKey] = iVal
+            os.rename(TmpPath, DirPath)
+        except OSError:  # 其他进程已经写入了该条目
+            shutil.rmtree(TmpPath, ignore_errors=True)
+        if self._MaxSize > 0: self.evict()
+        return 0
+
+    def pop(self, key):
+        shutil.rmtree(self._genPath(key), ignore_errors=True)
+        return 0
+
+    def clear(self):
+        for iKey in os.listdir(self._CacheDir): shutil.rmtree(os.path.join(self._CacheDir, iKey), ignore_errors=True)
+        return 0
+
+    # 所有条目的信息, 返回: [(最近访问时间, 大小, 缓存键)]
+    def _listEntries(self):
+        Entries = []
+        for iEntry in os.scandir(self._CacheDir):
+            if (not iEntry.is_dir()) or iEntry.name.endswith(_TMP_SUFFIX): continue
+            try:
+                iSize = 0
+                for iRoot, iDirs, iFiles in os.walk(iEntry.path):
+                    iSize += sum(os.path.getsize(os.path.join(iRoot, jFile)) for jFile in iFiles)
+                Entries.append((iEntry.stat().st_mtime, iSize, iEntry.name))
+            except OSError:
+                continue
+        return Entries
+
+    @property
+    def Size(self):
+        return sum(iSize for _, iSize, _ in self._listEntries())
+
+    # 按照最近最少使用的顺序淘汰条目, 直到总大小不超过 max_size
+    def evict(self, max_size=None):
+        if max_size is None: max_size = self._MaxSize
+        Entries = sorted(self._listEntries())
+        TotalSize = sum(iSize for _, iSize, _ in Entries)
+        for iMTime, iSize, iKey in Entries:
+            if TotalSize <= max_size: break
+            self.pop(iKey)
+            TotalSize -= iSize
+        return 0
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""时间序列运算的批量计算"""
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+WINDOW_REDUCERS = ("sum", "mean", "std", "var", "min", "max", "argmax", "argmin", "count")
+
+
+# 生成所有的滑动窗口, data: array(shape=(回溯期数+nDT, ...)), 返回: array(shape=(nDT, window, ...)), 为 data 的视图, 不发生拷贝
+def genWindows(data, window):
+    return np.moveaxis(sliding_window_view(data, window, axis=0), -1, 1)
+
+
+# 由 genWindows 生成的滑动窗口视图恢复原始数据, 返回: array(shape=(nDT+window-1, ...)), 不是滑动窗口视图时返回 None
+# 滑动窗口视图的前两维步长相同, 即第 i 个窗口的第 j 个元素为原始数据的第 i+j 个元素
+def _baseData(windows):
+    if (windows.ndim < 2) or (windows.shape[0] == 0) or (windows.shape[1] == 0) or (windows.strides[0] != windows.strides[1]):
+        return None
+    return np.concatenate([windows[:, 0], windows[-1, 1:]], axis=0)
+
+
+# 滑动窗口的统计量, windows: array(shape=(nDT, window, ...)), 忽略 nan, 有效数据个数少于 min_periods 的结果为 nan
+# windows 为滑动窗口视图时, sum, mean, std, var, min, max, count 由原始数据以 O(n) 的滚动算法计算, 不需要展开窗口
+def reduceWindows(windows, how="mean", min_periods=1, ddof=1):
+    windows = np.asarray(windows, dtype=np.float64)
+    Data = _baseData(windows)
+    if Data is not None:
+        Window, MinPeriods = windows.shape[1], max(min_periods, 1)
+        if how == "count": return rollingCount(Data, Window)
+        elif how == "sum": return rollingSum(Data, Window, min_periods=MinPeriods)
+        elif how == "mean": return rollingMean(Data, Window, min_periods=MinPeriods)
+        elif how == "std": return rollingStd(Data, Window, min_periods=MinPeriods, ddof=ddof)
+        elif how == "var": return rollingVar(Data, Window, min_periods=MinPeriods, ddof=ddof)
+        elif how == "min": return rollingMin(Data, Window, min_periods=MinPeriods)
+        elif how == "max": return rollingMax(Data, Window, min_periods=MinPeriods)
+    Mask = np.isnan(windows)
+    Count = windows.shape[1] - Mask.sum(axis=1)
+    if how == "count": return Count.astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if how == "sum":
+            Rslt = np.nansum(windows, axis=1)
+        elif how == "mean":
+            Rslt = np.nanmean(windows, axis=1)
+        elif how == "std":
+            Rslt = np.nanstd(windows, axis=1, ddof=ddof)
+        elif how == "var":
+            Rslt = np.nanvar(windows, axis=1, ddof=ddof)
+        elif how == "min":
+            Rslt = np.nanmin(windows, axis=1)
+        elif how == "max":
+            Rslt = np.nanmax(windows, axis=1)
+        elif how == "argmax":
+            Rslt = np.where(Mask, -np.inf, windows).argmax(axis=1).astype(np.float64)
+        elif how == "argmin":
+            Rslt = np.where(Mask, np.inf, windows).argmin(axis=1).astype(np.float64)
+        else:
+            from QuantStudio import __QS_Error__
+            raise __QS_Error__("尚不支持的窗口统计量: %s" % how)
+    Rslt[Count < max(min_periods, 1)] = np.nan
+    return Rslt
+
+
+# 滑动窗口模式下的统计算子, x[0] 为第一个描述子的滑动窗口, args: {"how": 统计量, "min_periods": 最小有效数据个数, "ddof": 自由度}
+def reduceOperator(f, idt, iid, x, args):
+    return reduceWindows(x[0], **args)
+
+
+# ----------------------滚动窗口的 O(n) 算法--------------------------------
+# 以下函数的 data 为 array(shape=(n, ...)), 沿第 0 维滚动, 返回以第 window-1 至 n-1 个位置结尾的窗口的结果, 即 array(shape=(n-window+1, ...))
+# nan 不参与计算, 有效数据个数少于 min_periods 的结果为 nan; inf 作为数据参与计算, 只影响包含它的窗口, 与逐窗口的 np.nansum 等一致
+def _as2D(data):
+    Data = np.asarray(data, dtype=np.float64)
+    return Data.reshape((Data.shape[0], -1)), Data.shape
+
+
+def _restore(rslt, shape):
+    return rslt.reshape((rslt.shape[0],) + shape[1:])
+
+
+# 滚动窗口内的和, data 中不能有 nan; 与 _rollingExtreme 相同按窗口长度分块, 窗口的和为起点所在块的后缀和与终点所在块的前缀和之和
+# 只累加窗口内的数据而不做累积和的差, inf 不会影响之后的窗口, 数据水平大幅变化后也不会残留舍入误差
+def _windowSum(data, window):
+    nData, Shape = data.shape[0], data.shape[1:]
+    if nData < window: return np.zeros((0,) + Shape)
+    nBlock = int(np.ceil(nData / window))
+    Blocks = np.zeros((nBlock * window,) + Shape)
+    Blocks[:nData] = data
+    Blocks = Blocks.reshape((nBlock, window) + Shape)
+    Prefix = np.cumsum(Blocks, axis=1).reshape((-1,) + Shape)
+    Suffix = np.cumsum(Blocks[:, ::-1], axis=1)[:, ::-1].reshape((-1,) + Shape)
+    nRslt = nData - window + 1
+    # 起点为块首时窗口恰为一个块, 只取后缀和
+    isBlockStart = (np.arange(nRslt) % window == 0).reshape((nRslt,) + (1,) * len(Shape))
+    return Suffix[:nRslt] + np.where(isBlockStart, 0, Prefix[window - 1:nData])
+
+
+def _windowCount(mask, window):
+    return _windowSum(mask.astype(np.float64), window)
+
+
+def rollingCount(data, window):
+    Data, Shape = _as2D(data)
+    return _restore(_windowCount(~np.isnan(Data), window), Shape)
+
+
+def rollingSum(data, window, min_periods=1):
+    Data, Shape = _as2D(data)
+    Mask = ~np.isnan(Data)
+    Count = _windowCount(Mask, window)
+    Rslt = _windowSum(np.where(Mask, Data, 0), window)
+    Rslt[Count < min_periods] = np.nan
+    return _restore(Rslt, Shape)
+
+
+def rollingMean(data, window, min_periods=1):
+    Data, Shape = _as2D(data)
+    Mask = ~np.isnan(Data)
+    Count = _windowCount(Mask, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt = _windowSum(np.where(Mask, Data, 0), window) / Count
+    Rslt[(Count < min_periods) | (Count == 0)] = np.nan
+    return _restore(Rslt, Shape)
+
+
+# 加权滚动平均, weights[0] 为窗口中最早数据的权重, 结果为 sum(x * weights) / sum(notnull(x) * weights)
+def rollingWeightedMean(data, weights, min_periods=1):
+    Data, Shape = _as2D(data)
+    weights = np.asarray(weights, dtype=np.float64)
+    Window, nRslt = weights.shape[0], max(Data.shape[0] - weights.shape[0] + 1, 0)
+    Mask = ~np.isnan(Data)
+    Filled = np.where(Mask, Data, 0)
+    Numerator, Denominator = np.zeros((nRslt, Data.shape[1])), np.zeros((nRslt, Data.shape[1]))
+    for k in range(Window):
+        if np.isnan(weights[k]): continue
+        Numerator += weights[k] * Filled[k:k + nRslt]
+        Denominator += weights[k] * Mask[k:k + nRslt]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt = Numerator / Denominator
+    Rslt[_windowCount(Mask, Window) < max(min_periods, 1)] = np.nan
+    return _restore(Rslt, Shape)
+
+
+# 按块累积的 Welford 统计量, blocks: array(shape=(nBlock, window, nCol)), 沿第 1 维逐个加入数据, 只有加入而没有移除, 数值稳定
+# 返回: (Count, Mean, M2), 均为 array(shape=(nBlock, window, nCol)), 第 k 个位置为块内前 k+1 个数据的统计量
+def _blockMoments(blocks):
+    Count, Mean, M2 = np.zeros(blocks.shape), np.zeros(blocks.shape), np.zeros(blocks.shape)
+    iCount, iMean, iM2 = np.zeros(blocks[:, 0].shape), np.zeros(blocks[:, 0].shape), np.zeros(blocks[:, 0].shape)
+    for k in range(blocks.shape[1]):
+        x = blocks[:, k]
+        Mask = ~np.isnan(x)
+        iCount += Mask
+        Delta = np.where(Mask, x - iMean, 0)
+        iMean += Delta / np.maximum(iCount, 1)
+        iM2 += np.where(Mask, Delta * (x - iMean), 0)
+        Count[:, k], Mean[:, k], M2[:, k] = iCount, iMean, iM2
+    return Count, Mean, M2
+
+
+# 滚动方差, 与 _rollingExtreme 相同按窗口长度分块, 窗口由起点所在块的后缀和终点所在块的前缀组成
+# 前缀和后缀的统计量由 Welford 算法逐个加入数据得到, 再以 Chan 的合并公式合并, 不需要从窗口中移除数据, 大的异常值离开窗口后不会残留误差
+def rollingVar(data, window, min_periods=1, ddof=1):
+    Data, Shape = _as2D(data)
+    nData, nCol = Data.shape
+    if nData < window: return _restore(np.full((0, nCol), np.nan), Shape)
+    nBlock = int(np.ceil(nData / window))
+    Blocks = np.full((nBlock * window, nCol), np.nan)
+    Blocks[:nData] = Data
+    Blocks = Blocks.reshape((nBlock, window, nCol))
+    PCount, PMean, PM2 = (i.reshape((-1, nCol)) for i in _blockMoments(Blocks))
+    SCount, SMean, SM2 = (i[:, ::-1].reshape((-1, nCol)) for i in _blockMoments(Blocks[:, ::-1]))
+    nRslt = nData - window + 1
+    # 第 t 个窗口由后缀 [t, 块尾] 与前缀 [块首, t+window-1] 组成; t 为块首时窗口恰为一个块, 只取后缀
+    ACount, AMean, AM2 = SCount[:nRslt], SMean[:nRslt], SM2[:nRslt]
+    BCount, BMean, BM2 = PCount[window - 1:nData].copy(), PMean[window - 1:nData], PM2[window - 1:nData].copy()
+    isBlockStart = (np.arange(nRslt) % window == 0)
+    BCount[isBlockStart], BM2[isBlockStart] = 0, 0
+    Count = ACount + BCount
+    with np.errstate(divide="ignore", invalid="ignore"):
+        M2 = AM2 + BM2 + np.where((ACount > 0) & (BCount > 0), (BMean - AMean) ** 2 * ACount * BCount / Count, 0)
+        Rslt = M2 / (Count - ddof)
+    Rslt[(Count <= ddof) | (Count < min_periods)] = np.nan
+    return _restore(Rslt, Shape)
+
+
+def rollingStd(data, window, min_periods=1, ddof=1):
+    return np.sqrt(rollingVar(data, window, min_periods=min_periods, ddof=ddof))
+
+
+# 滚动最值, 使用 van Herk/Gil-Werman 算法: 按窗口长度分块, 窗口的最值为起点所在块的后缀最值与终点所在块的前缀最值的最值
+# 与单调队列同为 O(n), 且可以对所有列同时计算
+def _rollingExtreme(data, window, min_periods, ufunc, fill):
+    Data, Shape = _as2D(data)
+    nData, nCol = Data.shape
+    if nData < window: return _restore(np.full((0, nCol), np.nan), Shape)
+    Mask = ~np.isnan(Data)
+    nBlock = int(np.ceil(nData / window))
+    Blocks = np.full((nBlock * window, nCol), fill)
+    Blocks[:nData] = np.where(Mask, Data, fill)
+    Blocks = Blocks.reshape((nBlock, window, nCol))
+    Prefix = ufunc.accumulate(Blocks, axis=1).reshape((-1, nCol))
+    Suffix = ufunc.accumulate(Blocks[:, ::-1], axis=1)[:, ::-1].reshape((-1, nCol))
+    Rslt = ufunc(Suffix[:nData - window + 1], Prefix[window - 1:nData])
+    Rslt[_windowCount(Mask, window) < max(min_periods, 1)] = np.nan
+    return _restore(Rslt, Shape)
+
+
+def rollingMax(data, window, min_periods=1):
+    return _rollingExtreme(data, window, min_periods, np.maximum, -np.inf)
+
+
+def rollingMin(data, window, min_periods=1):
+    return _rollingExtreme(data, window, min_periods, np.minimum, np.inf)
+
+
+# 滚动连乘, 以对数的累积和计算绝对值, 另外累计 0 和负数的个数确定结果为 0 以及结果的符号, 结果与 np.nanprod 一致
+def rollingProd(data, window, min_periods=1):
+    Data, Shape = _as2D(data)
+    Mask = ~np.isnan(Data)
+    Count = _windowCount(Mask, window)
+    nZero = _windowCount(Mask & (Data == 0), window)
+    nNeg = _windowCount(Mask & (Data < 0), window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        LogSum = _windowSum(np.where(Mask & (Data != 0), np.log(np.abs(Data)), 0), window)
+    Rslt = np.where(np.round(nNeg) % 2 == 1, -1.0, 1.0) * np.exp(LogSum)
+    Rslt[nZero > 0.5] = 0.0
+    Rslt[Count < min_periods] = np.nan
+    return _restore(Rslt, Shape)
+
+
+# ----------------------滚动顺序统计量--------------------------------
+# 使用 pandas 编译实现的可索引跳表(indexable skiplist)维护窗口内的有序数据, 每一步插入和删除的复杂度为 O(log window)
+def _rollingSkiplist(data, window, min_periods, fun):
+    Data, Shape = _as2D(data)
+    if Data.shape[0] < window: return _restore(np.full((0, Data.shape[1]), np.nan), Shape)
+    Rolling = pd.DataFrame(Data).rolling(window, min_periods=max(min_periods, 1))
+    return _restore(np.asarray(fun(Rolling).values, dtype=np.float64)[window - 1:], Shape)
+
+
+# 滚动分位数, 线性插值, 与 np.nanquantile 一致
+def rollingQuantile(data, window, quantile=0.5, min_periods=1):
+    return _rollingSkiplist(data, window, min_periods, lambda r: r.quantile(quantile))
+
+
+def rollingMedian(data, window, min_periods=1):
+    return _rollingSkiplist(data, window, min_periods, lambda r: r.median())
+
+
+# 滚动排名, 窗口内小于当前值的有效数据个数, 当前值为 nan 时为窗口内的有效数据个数
+def rollingRank(data, window, min_periods=1):
+    Data, Shape = _as2D(data)
+    Rslt = _rollingSkiplist(Data, window, min_periods, lambda r: r.rank(method="min")) - 1
+    Count = _windowCount(~np.isnan(Data), window)
+    Rslt = np.where(np.isnan(Data[window - 1:]), Count, Rslt)
+    Rslt[Count < max(min_periods, 1)] = np.nan
+    return _restore(Rslt, Shape)
+
+
+# 截面 Spearman 秩相关系数, data: array(shape=(n, nCol)), 按列计算, 只使用两者均有效的数据, 秩的并列取平均值
+def spearmanCorr(data1, data2, min_periods=1):
+    Data1, Data2 = np.asarray(data1, dtype=np.float64), np.asarray(data2, dtype=np.float64)
+    Mask = np.isnan(Data1) | np.isnan(Data2)
+    Rank1 = pd.DataFrame(np.where(Mask, np.nan, Data1)).rank(axis=0).values
+    Rank2 = pd.DataFrame(np.where(Mask, np.nan, Data2)).rank(axis=0).values
+    Count = np.sum(~Mask, axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        Rank1, Rank2 = Rank1 - np.nanmean(Rank1, axis=0), Rank2 - np.nanmean(Rank2, axis=0)
+        Rslt = np.nansum(Rank1 * Rank2, axis=0) / np.sqrt(np.nansum(Rank1 ** 2, axis=0) * np.nansum(Rank2 ** 2, axis=0))
+    Rslt[Count < max(min_periods, 2)] = np.nan
+    return Rslt
+
+
+# ----------------------滚动加权回归--------------------------------
+# 滚动回归结果的数据类型, 字段依次为系数, 系数的 t 统计量, F 统计量, R 方以及调整后的 R 方
+def genRegressDType(nx, constant=True):
+    Names = (["alpha"] if constant else []) + ["beta" + str(i) for i in range(nx)]
+    return np.dtype([(iName, np.float64) for iName in Names] + [("t_" + iName, np.float64) for iName in Names] +
+                    [("fvalue", np.float64), ("rsquared", np.float64), ("rsquared_adj", np.float64)])
+
+
+# 滚动窗口内的半衰期加权和, 以 A[t] = λ * A[t-1] + z[t] - λ^window * z[t-window] 递推, 误差随时间衰减
+def _windowDecaySum(data, window, decay):
+    Rslt = np.empty((max(data.shape[0] - window + 1, 0),) + data.shape[1:])
+    Acc, DecayW = np.zeros(data.shape[1:]), decay ** window
+    for t in range(data.shape[0]):
+        Acc *= decay
+        Acc += data[t]
+        if t >= window: Acc -= DecayW * data[t - window]
+        if t >= window - 1: Rslt[t - window + 1] = Acc
+    return Rslt
+
+
+# 滚动加权最小二乘, y: array(shape=(n, nID)), xs: [array(shape=(n, nID))], 窗口内最新数据的权重为 1, 往前每期乘以 0.5 ** (1 / half_life)
+# 任一变量为 nan 的样本不参与回归, 各窗口的 X'WX, X'WY 由累积和得到, 再批量求解正规方程
+# 返回: (结果, 退化窗口), 结果为 array(shape=(n-window+1, nID), dtype=genRegressDType(len(xs), constant))
+# 退化窗口为 bool 数组, 标记样本数不超过变量数或者 X'WX 病态的窗口, 这些窗口的结果为 nan, 由调用方另行处理
+# X'WX 先按对角线缩放成相关系数的形式再判断条件数和求解, 使判断与变量的量纲无关
+def rollingRegress(y, xs, window, constant=True, half_life=np.inf):
+    Y = np.asarray(y, dtype=np.float64)
+    Xs = [np.asarray(iX, dtype=np.float64) for iX in xs]
+    if constant: Xs.insert(0, np.ones_like(Y))
+    p = len(Xs)
+    Data = np.stack(Xs + [Y], axis=-1)  # (n, nID, p+1)
+    Mask = ~np.isnan(Data).any(axis=-1)
+    Data[~Mask] = 0
+    Cross = Data[..., :, None] * Data[..., None, :]  # (n, nID, p+1, p+1)
+    Decay = 0.5 ** (1 / half_life)
+    if Decay == 1:
+        Cross = _windowSum(Cross, window)
+        SumW = _windowCount(Mask, window)
+    else:
+        Cross = _windowDecaySum(Cross, window, Decay)
+        SumW = _windowDecaySum(Mask.astype(np.float64), window, Decay)
+    nObs = np.round(_windowCount(Mask, window))
+    XWX, XWY, YWY = Cross[..., :p, :p], Cross[..., :p, p], Cross[..., p, p]
+    DType = genRegressDType(len(xs), constant)
+    Rslt = np.full(nObs.shape, np.nan, dtype=DType)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        Scale = 1 / np.sqrt(np.diagonal(XWX, axis1=-2, axis2=-1))
+        XWX = XWX * Scale[..., :, None] * Scale[..., None, :]
+        Valid = (nObs > p) & np.isfinite(Scale).all(axis=-1)
+        Valid[Valid] = (np.linalg.cond(XWX[Valid]) < 1e10)
+    Degenerate = (~Valid) & (nObs > 0)
+    if not Valid.any(): return Rslt, Degenerate
+    XWX, XWY, YWY, SumW, nObs, Scale = XWX[Valid], XWY[Valid], YWY[Valid], SumW[Valid], nObs[Valid], Scale[Valid]
+    Beta = Scale * np.linalg.solve(XWX, (Scale * XWY)[..., None])[..., 0]
+    Cov = Scale[:, :, None] * np.linalg.inv(XWX) * Scale[:, None, :]
+    DfResid = nObs - p
+    SSR = np.maximum(YWY - np.sum(Beta * XWY, axis=-1), 0)
+    if constant:
+        TSS = np.maximum(YWY - XWY[:, 0] ** 2 / SumW, 0)
+        DfModel = p - 1
+    else:
+        TSS = YWY
+        DfModel = p
+    with np.errstate(divide="ignore", invalid="ignore"):
+        TValue = Beta / np.sqrt(np.diagonal(Cov, axis1=-2, axis2=-1) * (SSR / DfResid)[:, None])
+        RSquared = 1 - SSR / TSS
+        RSquaredAdj = 1 - (nObs - int(constant)) / DfResid * (1 - RSquared)
+        FValue = ((TSS - SSR) / DfModel) / (SSR / DfResid)
+    iRslt = np.empty(Beta.shape[0], dtype=DType)
+    for i, iName in enumerate(DType.names[:p]):
+        iRslt[iName] = Beta[:, i]
+        iRslt["t_" + iName] = TValue[:, i]
+    iRslt["fvalue"], iRslt["rsquared"], iRslt["rsquared_adj"] = FValue, RSquared, RSquaredAdj
+    Rslt[Valid] = iRslt
+    return Rslt, Degenerate
+
+
+# ----------------------按位置索引的时间序列变换--------------------------------
+# 前向填充的位置索引, mask: array(shape=(n, ...), dtype=bool), 有效数据为 True
+# 返回: array(shape=mask.shape, dtype=int), 每个位置最近一个有效数据的行号, 不存在或者间隔超过 limit 的为 -1
+def genFillIndex(mask, limit=None):
+    Pos = np.arange(mask.shape[0]).reshape((-1,) + (1,) * (mask.ndim - 1))
+    Index = np.maximum.accumulate(np.where(mask, Pos, -1), axis=0)
+    if limit is not None: Index[Pos - Index > limit] = -1
+    return Index
+
+
+# 按行号聚集数据, index: 与 data 同形状的行号, 行号为 -1 的位置为缺失值(数值为 nan, 其他为 None)
+def takeRows(data, index):
+    if data.dtype.kind in "biu": data = data.astype(np.float64)
+    Rslt = np.take_along_axis(data, np.maximum(index, 0), axis=0)
+    Rslt[index < 0] = (np.nan if data.dtype.kind in "fc" else None)
+    return Rslt
+
+
+# 前向填充缺失值, 最多向后填充 limit 行
+def forwardFill(data, limit=None):
+    Data = np.asarray(data)
+    return takeRows(Data, genFillIndex(~pd.isnull(Data), limit))
+
+
+# 在目标行之间滞后, target_pos: 升序排列的目标行号
+# 第 k 个目标行取第 k-lag_period 个目标行的数据(前 lag_period 个目标行保持不变), 缺失值用之前目标行的数据填充, 非目标行沿用最近一个目标行的数据
+def lagTargets(data, target_pos, lag_period=1):
+    Data = np.asarray(data)
+    Pos = np.asarray(target_pos, dtype=np.int64)
+    if Pos.shape[0] == 0: return takeRows(Data, np.full(Data.shape, -1, dtype=np.int64))
+    Src = Pos.copy()
+    if lag_period > 0: Src[lag_period:] = Pos[:-lag_period]
+    TargetData = Data[Src]
+    Last = np.searchsorted(Pos, np.arange(Data.shape[0]), side="right") - 1
+    Index = genFillIndex(~pd.isnull(TargetData))[np.maximum(Last, 0)]
+    Index[Last < 0] = -1
+    return takeRows(TargetData, Index)
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""截面运算的批量计算"""
+import numpy as np
+import pandas as pd
+
+# 以下函数的数据均为 array(shape=(nDT, nID)), 每一行是一个截面, 各截面独立计算
+# mask: 参与计算的位置, bool array(shape=(nDT, nID)), None 表示全部
+# cat_data: 分类数据, array(shape=(nDT, nID)) 或者 [array(shape=(nDT, nID))], 同一截面内分类相同的数据为一组, nan 也作为一个类别
+# other_handle: mask 以外的数据的处理方式, 可选: 保持不变, 填充None
+AVG_STATISTICS = ("平均值", "中位数")
+DISPERSION_STATISTICS = ("标准差", "MAD")
+WINSORIZE_METHODS = ("截断", "丢弃")
+FILL_FUNS = ("平均值", "中位数", "最大值", "最小值", "高斯随机数", "均匀随机数")
+
+
+def _genMask(mask, shape):
+    if mask is None: return np.ones(shape, dtype=bool)
+    return np.asarray(mask, dtype=bool)
+
+
+def _factorize(data, dropna=False):
+    Codes, Uniques = pd.factorize(np.asarray(data).ravel(), use_na_sentinel=dropna)
+    return Codes.reshape(np.shape(data)), len(Uniques)
+
+
+# 分组编号, 返回: (array(shape=(nDT, nID), dtype=int), 组数), 同一截面内分类相同的位置编号相同, mask 以外的位置为 -1
+def genGroupIndex(mask, cat_data=None):
+    nDT, nID = mask.shape
+    Key = np.repeat(np.arange(nDT, dtype=np.int64), nID).reshape((nDT, nID))
+    if cat_data is not None:
+        for iCatData in (cat_data if isinstance(cat_data, (list, tuple)) else [cat_data]):
+            iCodes, nCodes = _factorize(iCatData)
+            Key = Key * nCodes + iCodes
+    Group = np.full((nDT, nID), -1, dtype=np.int64)
+    Uniques, Group[mask] = np.unique(Key[mask], return_inverse=True)
+    return Group, Uniques.shape[0]
+
+
+# 分组排序, 返回: (排序后的位置, 每组的起始位置, 每组的有效数据个数), 组内按照数据升序排列, nan 排在最后
+def _sortGroups(group, data, n_group, tie_breaker=None):
+    Flat = np.flatnonzero(group.ravel() >= 0)
+    Group, Data = group.ravel()[Flat], data.ravel()[Flat]
+    Keys = (Data, Group) if tie_breaker is None else (tie_breaker.ravel()[Flat], Data, Group)
+    Order = np.lexsort(Keys)
+    Start = np.searchsorted(Group[Order], np.arange(n_group))
+    Count = np.bincount(Group, weights=~np.isnan(Data), minlength=n_group).astype(np.int64)
+    return Flat[Order], Start, Count
+
+
+def _groupSum(group, data, n_group):
+    Mask = (group >= 0)
+    return np.bincount(group[Mask], weights=data[Mask], minlength=n_group)
+
+
+# 组内的加权均值, 忽略数据或者权重为 nan 的位置
+def groupMean(group, data, n_group, weight=None):
+    Valid = ~np.isnan(data)
+    if weight is not None: Valid &= ~np.isnan(weight)
+    Weight = (np.where(Valid, weight, 0) if weight is not None else Valid.astype(np.float64))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _groupSum(group, np.where(Valid, data, 0) * Weight, n_group) / _groupSum(group, Weight, n_group)
+
+
+def groupStd(group, data, n_group, avg, weight=None):
+    with np.errstate(invalid="ignore"):
+        return np.sqrt(groupMean(group, (data - avg[group]) ** 2, n_group, weight=weight))
+
+
+# 组内的分位数, 线性插值, 与 np.nanpercentile 一致
+def groupQuantile(group, data, n_group, quantile=0.5):
+    Pos, Start, Count = _sortGroups(group, data, n_group)
+    Sorted = data.ravel()[Pos]
+    Rslt = np.full(n_group, np.nan)
+    Valid = (Count > 0)
+    Loc = (Count[Valid] - 1) * quantile
+    Low = np.floor(Loc).astype(np.int64)
+    High = np.minimum(Low + 1, Count[Valid] - 1)
+    Low, High, Frac = Start[Valid] + Low, Start[Valid] + High, Loc - Low
+    Rslt[Valid] = Sorted[Low] + (Sorted[High] - Sorted[Low]) * Frac
+    return Rslt
+
+
+def groupMedian(group, data, n_group):
+    return groupQuantile(group, data, n_group, quantile=0.5)
+
+
+def groupExtreme(group, data, n_group, how="max"):
+    Pos, Start, Count = _sortGroups(group, data, n_group)
+    Sorted = data.ravel()[Pos]
+    Rslt = np.full(n_group, np.nan)
+    Valid = (Count > 0)
+    Rslt[Valid] = Sorted[(Start + Count - 1)[Valid] if how == "max" else Start[Valid]]
+    return Rslt
+
+
+def groupCount(group, data, n_group):
+    return _groupSum(group, (~np.isnan(data)).astype(np.float64), n_group)
+
+
+# 组内连乘, 忽略 nan, 空组的结果为 1, 与 np.nanprod 一致
+def groupProd(group, data, n_group):
+    Flat = np.flatnonzero(group.ravel() >= 0)
+    Group = group.ravel()[Flat]
+    Order = np.argsort(Group, kind="stable")
+    Sorted = data.ravel()[Flat[Order]]
+    Start = np.searchsorted(Group[Order], np.arange(n_group))
+    Size = np.bincount(Group, minlength=n_group)
+    Rslt = np.ones(n_group)
+    NonEmpty = (Size > 0)
+    if NonEmpty.any(): Rslt[NonEmpty] = np.multiply.reduceat(np.where(np.isnan(Sorted), 1, Sorted), Start[NonEmpty])
+    return Rslt
+
+
+# 组内方差, 有效数据个数不超过 ddof 的组为 nan
+def groupVar(group, data, n_group, ddof=1):
+    Count = groupCount(group, data, n_group)
+    Avg = groupMean(group, data, n_group)
+    Valid = (~np.isnan(data)) & (group >= 0)
+    Sum2 = np.bincount(group[Valid], weights=(data[Valid] - Avg[group[Valid]]) ** 2, minlength=n_group)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt = Sum2 / (Count - ddof)
+    Rslt[Count <= ddof] = np.nan
+    return Rslt
+
+
+# 逐组调用 fun, fun 的输入为该组的数据(含 nan)
+def applyGroups(group, data, n_group, fun):
+    Flat = np.flatnonzero(group.ravel() >= 0)
+    Group = group.ravel()[Flat]
+    Order = np.argsort(Group, kind="stable")
+    Bounds = np.searchsorted(Group[Order], np.arange(n_group + 1))
+    Sorted = data.ravel()[Flat[Order]]
+    return np.array([fun(Sorted[Bounds[i]:Bounds[i + 1]]) for i in range(n_group)], dtype=np.float64)
+
+
+# 分组统计量, how: sum, prod, mean, std, var, max, min, median, quantile, count 或者作用于一组数据的函数
+def reduceGroups(group, data, n_group, how="sum", weight=None, ddof=1, quantile=0.5):
+    if callable(how): return applyGroups(group, data, n_group, how)
+    elif how == "sum": return _groupSum(group, np.nan_to_num(data, nan=0.0), n_group)
+    elif how == "count": return groupCount(group, data, n_group)
+    elif how == "prod": return groupProd(group, data, n_group)
+    elif how == "mean": return groupMean(group, data, n_group, weight=weight)
+    elif how == "var": return groupVar(group, data, n_group, ddof=ddof)
+    elif how == "std": return np.sqrt(groupVar(group, data, n_group, ddof=ddof))
+    elif how in ("max", "min"): return groupExtreme(group, data, n_group, how=how)
+    elif how == "median": return groupMedian(group, data, n_group)
+    elif how == "quantile": return groupQuantile(group, data, n_group, quantile=quantile)
+    from QuantStudio import __QS_Error__
+    raise __QS_Error__("尚不支持的分组统计量: %s" % how)
+
+
+# 常用聚合函数对应的分组统计量
+REDUCE_FUNS = {np.nansum: "sum", np.nanprod: "prod", np.nanmean: "mean", np.nanmax: "max", np.nanmin: "min",
+               np.nanmedian: "median"}
+
+
+# 按照类别聚合, data: array(shape=(nDT, nID)), cat_data: array(shape=(nDT, nID)), 为 None 时整个截面为一组
+# target_ids: 聚合后的 ID 序列, 给定时返回 array(shape=(nDT, len(target_ids))), 第 j 列是类别为 target_ids[j] 的数据的统计量
+# 否则返回 array(shape=(nDT, nID)), 每个位置填充所属类别的统计量, 有类别数据时 mask 以外的位置为 nan
+def aggregate(data, mask=None, cat_data=None, how="sum", target_ids=None, **kwargs):
+    data = np.asarray(data, dtype=np.float64)
+    nDT, nID = data.shape
+    Mask = _genMask(mask, data.shape)
+    Rows = np.repeat(np.arange(nDT, dtype=np.int64), nID).reshape((nDT, nID))
+    if cat_data is None:
+        Group = np.where(Mask, Rows, -1)
+        Rslt = reduceGroups(Group, data, nDT, how=how, **kwargs)
+        return np.repeat(Rslt, nID if target_ids is None else len(target_ids)).reshape((nDT, -1))
+    if target_ids is not None:
+        nTarget = len(target_ids)
+        Codes = pd.Index(target_ids).get_indexer(np.asarray(cat_data, dtype="O").ravel()).reshape((nDT, nID))
+        Group = np.where(Mask & (Codes >= 0), Rows * nTarget + Codes, -1)
+        return reduceGroups(Group, data, nDT * nTarget, how=how, **kwargs).reshape((nDT, nTarget))
+    Codes, nCodes = _factorize(cat_data)
+    Group = np.where(Mask, Rows * nCodes + Codes, -1)
+    Rslt = np.full(data.shape, np.nan)
+    Rslt[Mask] = reduceGroups(Group, data, nDT * nCodes, how=how, **kwargs)[Group[Mask]]
+    return Rslt
+
+
+# 解聚合, data: array(shape=(nDT, len(aggr_ids))), 返回: array(shape=(nDT, nID)), 每个位置填充其类别对应的聚合数据, 类别不在 aggr_ids 中的位置为 nan
+def disaggregate(data, cat_data, aggr_ids):
+    data = np.asarray(data)
+    Codes = pd.Index(aggr_ids).get_indexer(np.asarray(cat_data, dtype="O").ravel()).reshape(np.shape(cat_data))
+    Rslt = np.take_along_axis(data, np.maximum(Codes, 0), axis=1).astype(np.float64)
+    Rslt[Codes < 0] = np.nan
+    return Rslt
+
+
+def _handleOther(rslt, data, mask, other_handle):
+    if other_handle == "保持不变": rslt[~mask] = data[~mask]
+    return rslt
+
+
+def _genAvg(group, data, n_group, avg_statistics, avg_weight):
+    if avg_statistics == "中位数": return groupMedian(group, data, n_group)
+    return groupMean(group, data, n_group, weight=avg_weight)
+
+
+# 离散统计量, 与 DataPreprocessingFun 一致: 标准差以平均值为中心(有权重时以平均统计量为中心); MAD 为以中位数为中心的绝对中位差的 1.483 倍
+def _genDispersion(group, data, n_group, avg, dispersion_statistics, dispersion_weight):
+    with np.errstate(invalid="ignore"):
+        if dispersion_statistics == "MAD":
+            return 1.483 * groupMedian(group, np.abs(data - groupMedian(group, data, n_group)[group]), n_group)
+        if dispersion_weight is None: avg = groupMean(group, data, n_group)
+        return groupStd(group, data, n_group, avg, weight=dispersion_weight)
+
+
+# Z-Score 标准化, avg_statistics: 平均统计量, 可选: 平均值, 中位数; dispersion_statistics: 离散统计量, 可选: 标准差, MAD
+# 离散统计量为 0 的组结果为 0
+def standardizeZScore(data, mask=None, cat_data=None, avg_statistics="平均值", dispersion_statistics="标准差", avg_weight=None,
+                      dispersion_weight=None, other_handle="填充None"):
+    data = np.asarray(data, dtype=np.float64)
+    Mask = _genMask(mask, data.shape)
+    Group, nGroup = genGroupIndex(Mask, cat_data)
+    Avg = _genAvg(Group, data, nGroup, avg_statistics, avg_weight)
+    Dispersion = _genDispersion(Group, data, nGroup, Avg, dispersion_statistics, dispersion_weight)[Group[Mask]]
+    Rslt = np.full(data.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rslt[Mask] = np.where(Dispersion == 0, 0.0, (data[Mask] - Avg[Group[Mask]]) / Dispersion)
+    return _handleOther(Rslt, data, Mask, other_handle)
+
+
+# 组内排序, 排名从 0 开始, 相同的数据按照位置先后排名, perturbation 为 True 时随机打破平局
+# uniformization 为 True 时排名转换为 (排名 + offset) / 有效数据个数
+def standardizeRank(data, mask=None, cat_data=None, ascending=True, uniformization=True, perturbation=False, offset=0.5,
+                    other_handle="填充None"):
+    data = np.asarray(data, dtype=np.float64)
+    Mask = _genMask(mask, data.shape)
+    Group, nGroup = genGroupIndex(Mask, cat_data)
+    TieBreaker = (np.random.rand(*data.shape) if perturbation else None)
+    Pos, Start, Count = _sortGroups(Group, (data if ascending else -data), nGroup, tie_breaker=TieBreaker)
+    SortedGroup = Group.ravel()[Pos]
+    Rank = np.arange(Pos.shape[0]) - Start[SortedGroup].astype(np.float64)
+    if uniformization:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Rank = (Rank + offset) / Count[SortedGroup]
+    Rank[np.isnan(data.ravel()[Pos])] = np.nan
+    Rslt = np.full(data.shape, np.nan)
+    Rslt.ravel()[Pos] = Rank
+    return _handleOther(Rslt, data, Mask, other_handle)
+
+
+# 去极值, method: 截断, 将超出 平均统计量 ± std_multiplier * 离散统计量 的数据截断到边界; 丢弃, 将超出范围的数据置为 nan
+def winsorize(data, mask=None, cat_data=None, method="截断", avg_statistics="平均值", dispersion_statistics="标准差",
+              std_multiplier=3, other_handle="填充None"):
+    data = np.asarray(data, dtype=np.float64)
+    Mask = _genMask(mask, data.shape)
+    Group, nGroup = genGroupIndex(Mask, cat_data)
+    Avg = _genAvg(Group, data, nGroup, avg_statistics, None)
+    Dispersion = _genDispersion(Group, data, nGroup, Avg, dispersion_statistics, None)
+    with np.errstate(invalid="ignore"):
+        Avg, Dispersion = Avg[Group[Mask]], Dispersion[Group[Mask]]
+        Lower, Upper = Avg - std_multiplier * Dispersion, Avg + std_multiplier * Dispersion
+        Rslt = np.full(data.shape, np.nan)
+        iData = data[Mask]
+        if method == "丢弃":
+            Rslt[Mask] = np.where((iData < Lower) | (iData > Upper), np.nan, iData)
+        else:
+            Rslt[Mask] = np.where(np.isnan(iData), np.nan, np.clip(iData, Lower, Upper))
+    return _handleOther(Rslt, data, Mask, other_handle)
+
+
+# 以组内统计量填充 mask 内的缺失值, val_fun: 平均值, 中位数, 最大值, 最小值, 高斯随机数, 均匀随机数
+def fillNaNByFun(data, mask=None, cat_data=None, val_fun="平均值"):
+    data = np.asarray(data, dtype=np.float64)
+    Mask = _genMask(mask, data.shape)
+    Group, nGroup = genGroupIndex(Mask, cat_data)
+    Fill = Mask & np.isnan(data)
+    FillGroup = Group[Fill]
+    if val_fun == "中位数":
+        Val = groupMedian(Group, data, nGroup)[FillGroup]
+    elif val_fun in ("最大值", "最小值"):
+        Val = groupExtreme(Group, data, nGroup, how=("max" if val_fun == "最大值" else "min"))[FillGroup]
+    elif val_fun == "均匀随机数":
+        Min = groupExtreme(Group, data, nGroup, how="min")[FillGroup]
+        Val = np.random.rand(FillGroup.shape[0]) * (groupExtreme(Group, data, nGroup, how="max")[FillGroup] - Min) + Min
+    else:
+        Avg = groupMean(Group, data, nGroup)
+        Val = Avg[FillGroup]
+        if val_fun == "高斯随机数": Val = np.random.randn(FillGroup.shape[0]) * groupStd(Group, data, nGroup, Avg)[FillGroup] + Val
+    Rslt = data.copy()
+    Rslt[Fill] = Val
+    return Rslt
+
+
+# 分组批量最小二乘, 返回拟合值, 每组以 constant, X, dummy_data 为自变量单独回归
+# X: [array(shape=(nDT, nID))]; dummy_data: [array(shape=(nDT, nID))], 每个哑变量按照类别展开成 0-1 变量
+# drop_dummy_na: 为 True 时哑变量为 nan 的数据不参与回归, 否则 nan 作为一个类别
+# 各组的正规方程以 bincount 累加, 不展开哑变量矩阵, 以伪逆求解, 哑变量与常数项共线时拟合值不受影响
+# 自变量缺失或者 mask 以外的位置的拟合值为 nan
+def regress(Y, X=None, mask=None, cat_data=None, constant=False, dummy_data=None, drop_dummy_na=False):
+    Y = np.asarray(Y, dtype=np.float64)
+    Mask = _genMask(mask, Y.shape)
+    Features, nCol = [], 0  # [(列号, 取值)]
+    if constant:
+        Features.append((0, np.ones(Y.shape)))
+        nCol += 1
+    for iX in (X or []):
+        iX = np.asarray(iX, dtype=np.float64)
+        Mask = Mask & ~np.isnan(iX)
+        Features.append((nCol, iX))
+        nCol += 1
+    for iDummy in (dummy_data or []):
+        iCodes, nCodes = _factorize(iDummy, dropna=drop_dummy_na)
+        Mask = Mask & (iCodes >= 0)
+        Features.append((nCol + iCodes, np.ones(Y.shape)))
+        nCol += nCodes
+    Group, nGroup = genGroupIndex(Mask, cat_data)
+    Fitted = np.full(Y.shape, np.nan)
+    if (nCol == 0) or (nGroup == 0): return Fitted
+    Features = [((iCol[Mask] if isinstance(iCol, np.ndarray) else iCol), iVal[Mask]) for iCol, iVal in Features]
+    Group, y = Group[Mask], Y[Mask]
+    Fit = ~np.isnan(y)
+    FitGroup, y = Group[Fit], y[Fit]
+    XTX, XTY = np.zeros(nGroup * nCol * nCol), np.zeros(nGroup * nCol)
+    for iCol, iVal in Features:
+        iColFit = (iCol[Fit] if isinstance(iCol, np.ndarray) else iCol)
+        XTY += np.bincount(FitGroup * nCol + iColFit, weights=iVal[Fit] * y, minlength=nGroup * nCol)
+        for jCol, jVal in Features:
+            jColFit = (jCol[Fit] if isinstance(jCol, np.ndarray) else jCol)
+            XTX += np.bincount((FitGroup * nCol + iColFit) * nCol + jColFit, weights=iVal[Fit] * jVal[Fit],
+                               minlength=nGroup * nCol * nCol)
+    Beta = np.matmul(np.linalg.pinv(XTX.reshape((nGroup, nCol, nCol))), XTY.reshape((nGroup, nCol, 1)))[..., 0]
+    Beta[np.bincount(FitGroup, minlength=nGroup) == 0] = np.nan
+    Rslt = np.zeros(Group.shape[0])
+    for iCol, iVal in Features: Rslt += Beta[Group, iCol] * iVal
+    Fitted[Mask] = Rslt
+    return Fitted
+
+
+# 正交化, 返回 Y 对自变量回归的残差
+def orthogonalize(Y, X=None, mask=None, constant=False, dummy_data=None, drop_dummy_na=False, other_handle="填充None"):
+    Y = np.asarray(Y, dtype=np.float64)
+    Rslt = Y - regress(Y, X=X, mask=mask, constant=constant, dummy_data=dummy_data, drop_dummy_na=drop_dummy_na)
+    return _handleOther(Rslt, Y, _genMask(mask, Y.shape), other_handle)
+
+
+# 以回归的拟合值填充 mask 内的缺失值
+def fillNaNByRegress(Y, X=None, mask=None, cat_data=None, constant=False, dummy_data=None, drop_dummy_na=False):
+    Y = np.asarray(Y, dtype=np.float64)
+    Fitted = regress(Y, X=X, mask=mask, cat_data=cat_data, constant=constant, dummy_data=dummy_data, drop_dummy_na=drop_dummy_na)
+    return np.where(np.isnan(Y), Fitted, Y)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""遍历模式下基于共享内存的缓冲区"""
+from bisect import bisect_left
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+# 数据能否存入 float64 的共享内存块
+def _isNumericFrame(data):
+    if data.shape[0] == 0: return True
+    return all(isinstance(iDType, np.dtype) and (iDType.kind in "fiu") for iDType in data.dtypes)
+
+
+# 共享内存上的数组, 使用 np.frombuffer 以持有缓冲区的引用, 保证数组存活期间共享内存不会被关闭
+def _genArray(shm, shape):
+    return np.frombuffer(shm.buf, dtype=np.float64, count=int(np.prod(shape))).reshape(shape)
+
+
+def _closeSharedMemory(shm, unlink=False):
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        shm.close()
+    except BufferError:  # 仍有数组引用该内存
+        return False
+    return True
+
+
+# 双缓冲共享内存块, 每个缓冲区 shape=(最大行数, 列数), dtype=float64
+# 主进程只读取(拷贝)已发布的缓冲区, 子进程只写入另一个缓冲区, 因而二者无需加锁
+class _SharedBlock(object):
+    def __init__(self, max_rows, columns):
+        self.Columns = list(columns)
+        self.nRows = 0  # 当前有效行数
+        self._MaxRows = max_rows
+        self._Segments = [None, None]
+        self._Current = 0  # 保存最新数据的缓冲区
+        self._Published = None  # 已发布给主进程的缓冲区
+
+    @property
+    def CurrentName(self):
+        return self._Segments[self._Current].name
+
+    @property
+    def SegmentNames(self):
+        return [iSegment.name for iSegment in self._Segments if iSegment is not None]
+
+    def _getArray(self, i):
+        if self._Segments[i] is None:
+            self._Segments[i] = shared_memory.SharedMemory(create=True,
+                                                           size=max(1, self._MaxRows * len(self.Columns) * 8))
+        return _genArray(self._Segments[i], (self._MaxRows, len(self.Columns)))
+
+    # 可写入的缓冲区: 主进程未在使用的缓冲区
+    def _getTarget(self):
+        return (self._Current if self._Current != self._Published else 1 - self._Current)
+
+    def toFrame(self, dts):
+        Data = self._getArray(self._Current)[:self.nRows]
+        return pd.DataFrame(Data.copy(), index=dts, columns=self.Columns)
+
+    # 整体写入
+    def write(self, data):
+        Target = self._getTarget()
+        self._getArray(Target)[:data.shape[0]] = data
+        self._Current, self.nRows = Target, data.shape[0]
+
+    # 丢弃前 n_drop 行, 追加 new_data, 只有追加的行和保留的行需要拷贝
+    def shift(self, n_drop, new_data):
+        Target = self._getTarget()
+        Src, Dst = self._getArray(self._Current), self._getArray(Target)
+        nKeep = max(0, self.nRows - n_drop)
+        if nKeep > 0: Dst[:nKeep] = Src[n_drop:self.nRows]
+        Dst[nKeep:nKeep + new_data.shape[0]] = new_data
+        self._Current, self.nRows = Target, nKeep + new_data.shape[0]
+
+    def publish(self):
+        self._Published = self._Current
+        if self._Segments[self._Current] is None: self._getArray(self._Current)
+
+    def close(self):
+        for iSegment in self._Segments:
+            if iSegment is not None: _closeSharedMemory(iSegment, unlink=True)
+        self._Segments = [None, None]
+
+
+# 子进程端的缓冲区, {键: DataFrame(index=[时点], columns=[ID 或者因子])}
+# 数值数据直接写入共享内存, 非数值数据通过队列传递
+class SharedCacheWriter(object):
+    def __init__(self, max_rows):
+        self._MaxRows = max(1, max_rows)
+        self._DTs = []  # 缓冲区的时点序列
+        self._Blocks = {}  # {键: _SharedBlock}
+        self._Objects = {}  # {键: DataFrame}, 非数值数据
+        self._Retired = []  # 待释放的共享内存块
+        self._SentSegments = set()  # 已经发送过列信息的共享内存名称
+
+    def keys(self):
+        return list(self._Blocks) + list(self._Objects)
+
+    def __len__(self):
+        return len(self._Blocks) + len(self._Objects)
+
+    def __contains__(self, key):
+        return (key in self._Blocks) or (key in self._Objects)
+
+    def get(self, key):
+        if key in self._Blocks: return self._Blocks[key].toFrame(self._DTs)
+        return self._Objects.get(key)
+
+    def pop(self, key):
+        Block = self._Blocks.pop(key, None)
+        if Block is not None: self._Retired.append(Block)
+        self._Objects.pop(key, None)
+
+    # 写入某个键在当前缓冲时点上的全部数据
+    def write(self, key, data, dts=None):
+        if dts is not None: self._DTs = list(dts)
+        if _isNumericFrame(data):
+            self._Objects.pop(key, None)
+            Block = self._Blocks.get(key)
+            if (Block is None) or (Block.Columns != data.columns.tolist()):
+                if Block is not None: self._Retired.append(Block)
+                Block = self._Blocks[key] = _SharedBlock(self._MaxRows, data.columns)
+            Block.write(data.values.astype(np.float64, copy=False))
+        else:
+            self.pop(key)
+            self._Objects[key] = data
+
+    # 缓冲时点序列前移, new_data: {键: DataFrame(index=[新增时点])}
+    def shift(self, dts, new_data):
+        dts = list(dts)
+        nDrop = (bisect_left(self._DTs, dts[0]) if dts else len(self._DTs))
+        for iKey, iNewData in new_data.items():
+            Block = self._Blocks.get(iKey)
+            if (Block is not None) and _isNumericFrame(iNewData) and (nDrop < len(self._DTs)):
+                Block.shift(nDrop, iNewData.loc[:, Block.Columns].values.astype(np.float64, copy=False))
+            elif nDrop >= len(self._DTs):  # 新旧时点不相交
+                self.write(iKey, iNewData)
+            else:
+                iData = self.get(iKey).loc[self._DTs[nDrop:]]
+                self.write(iKey, pd.concat([iData.astype("O"), iNewData.astype("O")]).loc[dts])
+        self._DTs = dts
+
+    # 发布缓冲区, 返回发送给主进程的消息: (时点序列, {键: (共享内存名, 行数, 列 or None)}, {键: DataFrame}, [释放的共享内存名])
+    def publish(self):
+        Blocks = {}
+        for iKey, iBlock in self._Blocks.items():
+            iBlock.publish()
+            iName = iBlock.CurrentName
+            if iName in self._SentSegments:
+                Blocks[iKey] = (iName, iBlock.nRows, None)
+            else:
+                Blocks[iKey] = (iName, iBlock.nRows, iBlock.Columns)
+                self._SentSegments.add(iName)
+        Retired = []
+        for iBlock in self._Retired:
+            Retired.extend(iBlock.SegmentNames)
+            self._SentSegments.difference_update(iBlock.SegmentNames)
+            iBlock.close()
+        self._Retired = []
+        return (list(self._DTs), Blocks, dict(self._Objects), Retired)
+
+    def close(self):
+        for iBlock in list(self._Blocks.values()) + self._Retired: iBlock.close()
+        self._Blocks, self._Objects, self._Retired = {}, {}, []
+
+
+# 主进程端的缓冲区, 将子进程发布的共享内存拷贝成 DataFrame, 只有一次内存拷贝, 不需要序列化和反序列化
+# 不直接包装共享内存: 子进程在下一次发布后会重写该缓冲区, 而主进程可能仍然持有之前读取的数据
+class SharedCacheReader(object):
+    def __init__(self):
+        self._Segments = {}  # {共享内存名: (SharedMemory, 列)}
+        self._Closing = []  # 仍被引用而未能关闭的共享内存
+
+    def load(self, message):
+        DTs, Blocks, Objects, Retired = message
+        for iName in Retired:
+            iSegment = self._Segments.pop(iName, None)
+            if iSegment is not None: self._Closing.append(iSegment[0])
+        self._Closing = [iSegment for iSegment in self._Closing if not _closeSharedMemory(iSegment)]
+        CacheData = {}
+        for iKey, (iName, inRows, iColumns) in Blocks.items():
+            if iName not in self._Segments:
+                self._Segments[iName] = (shared_memory.SharedMemory(name=iName), iColumns)
+            iSegment, iColumns = self._Segments[iName]
+            CacheData[iKey] = pd.DataFrame(_genArray(iSegment, (inRows, len(iColumns))).copy(), index=DTs, columns=iColumns)
+        CacheData.update(Objects)
+        return CacheData
+
+    def close(self):
+        for iSegment, iColumns in self._Segments.values(): self._Closing.append(iSegment)
+        self._Segments = {}
+        self._Closing = [iSegment for iSegment in self._Closing if not _closeSharedMemory(iSegment)]
@@ -7,6 +7,9 @@ import pandas as pd
 
 from ClickSQL.nodes.base import BaseSingleQueryBaseNode
 
+from QuantNodes.factor_table.merge import CIK_KEYS, plan_join, sorted_merge
+from QuantNodes.factor_table.parallel import map_query, ThreadLocalQuery
+
 CIK = namedtuple('CoreIndexKeys', ('dts', 'iid'))
 CIKDATA = namedtuple('CoreIndexKeys', ('dts', 'iid'))
 FactorInfo = namedtuple('FactorInfo',
@@ -264,7 +267,7 @@ class _Factors(deque):
             yield sql2
 
     def _fetch_sql_part(self, query, factors, filter_cond_dts, filter_cond__ids, reduced=True, add_limit=False,
-                        to_sql=False):
+                        to_sql=False, batch_rows=None, concurrency=1):
         if not isinstance(query, Callable):
             raise ValueError('query must database connector with __call__')
         sql_list_iter = self._generate_fetch_sql_iter(factors, filter_cond_dts, filter_cond__ids, reduced=reduced,
@@ -272,6 +275,16 @@ class _Factors(deque):
         if to_sql:
             for sql2 in sql_list_iter:
                 yield sql2
+        elif (batch_rows is not None) and hasattr(query, 'get_iter'):
+            # stream each sub-query in batches of batch_rows rows
+            for sql2 in sql_list_iter:
+                for df in query.get_iter(sql2, batch_rows=batch_rows):
+                    yield pd.DataFrame(df).set_index(['cik_dt', 'cik_iid'])
+        elif concurrency > 1:
+            # issue all sub-queries at once, at most concurrency of them running at the same time
+            # results are yielded in the order of the sub-queries, so the columns of fetch keep their order
+            for df in map_query(query, list(sql_list_iter), concurrency):
+                yield pd.DataFrame(df).set_index(['cik_dt', 'cik_iid'])
         else:
             for sql2 in sql_list_iter:
                 df = query(sql2)
@@ -294,13 +307,22 @@ class _Factors(deque):
                 db_table = db_table.rename(columns=c)
             yield db_table.set_index(['cik_dt', 'cik_iid'])
 
-    def fetch_iter(self, query, filter_cond_dts, filter_cond__ids, reduced=True, add_limit=False, to_sql=False):
+    def fetch_iter(self, query, filter_cond_dts, filter_cond__ids, reduced=True, add_limit=False, to_sql=False,
+                   batch_rows=None, concurrency=1):
+        """
+
+        :param batch_rows: if query supports get_iter (e.g. CHBase), yield every sub-query in batches of batch_rows rows
+            as the rows arrive, otherwise yield one DataFrame per sub-query
+        :param concurrency: max number of sub-queries running in parallel threads, query must be thread-safe
+            (e.g. CHBase or a ThreadLocalQuery), not used together with batch_rows
+        """
         if not isinstance(query, Callable):
             raise ValueError('query must database connector with __call__')
         factors = self.show_factors(reduced=reduced, to_df=False)
         sql_factors = list(filter(lambda x: x.via != 'pd.DataFrame', factors))
         res_iter = self._fetch_sql_part(query, sql_factors, filter_cond_dts, filter_cond__ids, reduced=reduced,
-                                        add_limit=add_limit, to_sql=to_sql)
+                                        add_limit=add_limit, to_sql=to_sql, batch_rows=batch_rows,
+                                        concurrency=concurrency)
 
         # mask = factors['via'] == 'pd.DataFrame'
         # df_factors = factors[mask]
@@ -319,21 +341,46 @@ class _Factors(deque):
                 for df_f in df_factor_res:
                     yield df_f
 
-    def fetch_all(self, query, filter_cond_dts, filter_cond__ids, reduced=True, add_limit=False, to_sql=False):
+    def fetch_all(self, query, filter_cond_dts, filter_cond__ids, reduced=True, add_limit=False, to_sql=False,
+                  join='server', max_server_join_rows=1000000, concurrency=1):
+        """
+
+        :param join: server: nested full joins executed by ClickHouse; client: fetch every sub-query and join them by
+            a sorted merge on integer-encoded (cik_dt, cik_iid), with the same rows as the server join; auto: probe the
+            rows of every sub-query with count() and join on the server only if there are at most max_server_join_rows
+            rows in total, the probes run every sub-query once more
+        :param concurrency: max number of sub-queries (and count() probes) running in parallel for the client join
+        """
         if not isinstance(query, Callable):
             raise ValueError('query must database connector with __call__')
+        if join not in ('auto', 'server', 'client'):
+            raise ValueError('join only accept auto, server, client!')
         factors = self.show_factors(reduced=reduced, to_df=False)
-        sql_list_iter = self._generate_fetch_sql_iter(factors, filter_cond_dts, filter_cond__ids, reduced=reduced,
-                                                      add_limit=add_limit)
+        sql_list = list(self._generate_fetch_sql_iter(factors, filter_cond_dts, filter_cond__ids, reduced=reduced,
+                                                      add_limit=add_limit))
+
+        if to_sql or (join == 'server'):
+            method = 'server'
+        elif join == 'client':
+            method = 'client'
+        else:
+            count_sql_list = [f"select count() as cnt from ({sql})" for sql in sql_list]
+            row_counts = [int(pd.DataFrame(df).iloc[0, 0]) for df in map_query(query, count_sql_list, concurrency)]
+            method = plan_join(row_counts, max_server_join_rows=max_server_join_rows)
+
+        if method == 'client':
+            frames = [pd.DataFrame(df) for df in map_query(query, sql_list, concurrency)]
+            yield sorted_merge(frames, keys=CIK_KEYS)
+            return
 
         from functools import reduce
 
-        def join(sql1, sql2):
+        def join_sql(sql1, sql2):
             settings = ' settings joined_subquery_requires_alias=0 '
             sql = f"select * from ({sql1}) all full join ({sql2}) using (cik_dt,cik_iid)  {settings}"
             return sql
 
-        s = reduce(lambda x, y: join(x, y), sql_list_iter)
+        s = reduce(lambda x, y: join_sql(x, y), sql_list)
         if to_sql:
             yield s
         else:
@@ -349,8 +396,12 @@ class __FactorTable__(__MetaFactorTable__):
 
     def __init__(self, *args, **kwargs):
         # super(FatctorTable, self).__init__(*args, **kwargs)
+        # max number of sub-queries fetched in parallel
+        self.concurrency = kwargs.pop('concurrency', 1)
         ## TODO _node 改成适配器模式，而不是写死的
         self._node = BaseSingleQueryBaseNode(*args, **kwargs)
+        # the connector is not known to be thread-safe, concurrent fetches give every thread its own connector
+        self._thread_node = ThreadLocalQuery(lambda: BaseSingleQueryBaseNode(*args, **kwargs))
 
         cik_dt = 'cik_dt' if 'cik_dt' not in kwargs.keys() else kwargs['cik_dt']  # default use cik_dt as cik_dt
         cik_iid = 'cik_iid' if 'cik_iid' not in kwargs.keys() else kwargs['cik_iid']  # default use cik_iid as cik_iid
@@ -420,13 +471,14 @@ class __FactorTable__(__MetaFactorTable__):
 
         return self.fetch(reduced=reduced, add_limit=True)
 
-    def fetch(self, _cik_dts=None, _cik_iids=None, reduced=True, add_limit=False, ):
+    def fetch(self, _cik_dts=None, _cik_iids=None, reduced=True, add_limit=False, concurrency=None):
         """
 
         :param reduced: whether use reduce form
         :param _cik_dts: set up dts
         :param _cik_iids:  set up iids
         :param add_limit: use force limit columns
+        :param concurrency: max number of sub-queries fetched in parallel, default self.concurrency
         :return:
         """
         if not add_limit:
@@ -441,9 +493,10 @@ class __FactorTable__(__MetaFactorTable__):
             else:
                 if self._cik_iids is None:
                     raise KeyError('cik_iids(either default approach or fetch) both are not setup!')
-        query_func = self._node
+        concurrency = self.concurrency if concurrency is None else concurrency
+        query_func = self._node if concurrency <= 1 else self._thread_node
         fetched = self._factors.fetch_iter(query_func, self.cik_dt, self.cik_iid, reduced=reduced,
-                                           add_limit=add_limit)
+                                           add_limit=add_limit, concurrency=concurrency)
 
         result = pd.concat(fetched, axis=1)
         # columns = result.columns.tolist()
@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+client-side join of fetched factor groups: sorted merge on integer-encoded (cik_dt, cik_iid) keys
+"""
+import numpy as np
+import pandas as pd
+
+CIK_KEYS = ('cik_dt', 'cik_iid')
+
+
+def plan_join(row_counts, max_server_join_rows=1000000):
+    """
+    choose where to join the sub-queries of fetch_all
+    :param row_counts: estimated rows of every sub-query (count() probes)
+    :param max_server_join_rows: above this many rows in total the nested hash joins of the server are avoided
+    :return: 'server' or 'client'
+    """
+    if len(row_counts) <= 1:
+        return 'server'
+    return 'server' if sum(row_counts) <= max_server_join_rows else 'client'
+
+
+def encode_keys(frames, keys=CIK_KEYS):
+    """
+    encode the key columns of all frames into int64 codes shared by the frames, the order of the codes is the sorted
+    order of the keys, rows with a missing key are encoded as -1
+    :return: (list of codes of each frame, list of sorted unique values of each key)
+    """
+    lengths = [len(f) for f in frames]
+    codes = [np.zeros(n, dtype=np.int64) for n in lengths]
+    valid = [np.ones(n, dtype=bool) for n in lengths]
+    levels = []
+    for key in keys:
+        values = np.concatenate([np.asarray(f[key]) for f in frames]) if frames else np.array([])
+        key_codes, uniques = pd.factorize(values, sort=True)
+        levels.append(uniques)
+        for i, key_code in enumerate(np.split(key_codes, np.cumsum(lengths)[:-1])):
+            codes[i] = codes[i] * max(len(uniques), 1) + key_code
+            valid[i] &= (key_code >= 0)
+    for i in range(len(frames)):
+        codes[i][~valid[i]] = -1
+    return codes, levels
+
+
+def _aligned(values, pos, n):
+    """place values at positions pos of an array of length n, the other positions are missing"""
+    if (len(pos) == n) and (n > 0) and (pos[0] == 0) and (pos[-1] == n - 1) and (np.diff(pos) == 1).all():
+        return values
+    kind = values.dtype.kind
+    if kind in 'fc':
+        out = np.full(n, np.nan, dtype=values.dtype)
+    elif kind in 'biu':
+        out = np.full(n, np.nan)
+    elif kind in 'mM':
+        out = np.full(n, np.datetime64('NaT') if kind == 'M' else np.timedelta64('NaT'), dtype=values.dtype)
+    else:
+        out = np.full(n, None, dtype='O')
+    out[pos] = values
+    return out
+
+
+def _union_positions(codes, space):
+    """
+    sorted union of the codes and the position of every code in it
+    dense key space (e.g. a panel of dates x ids): a presence bitmap and its running count give the positions directly,
+    otherwise: every frame is sorted by its codes and merged, the positions are found by binary search of sorted codes
+    """
+    valid = [c[c >= 0] for c in codes]
+    total = sum(len(c) for c in valid)
+    if space <= 2 * total + 1024:
+        present = np.zeros(space, dtype=bool)
+        for c in valid:
+            present[c] = True
+        rank = np.cumsum(present, dtype=(np.int32 if space < 2 ** 31 else np.int64)) - 1
+        return np.flatnonzero(present), [rank[c] for c in valid]
+    sorted_codes = [np.sort(c) for c in valid]
+    merged = np.concatenate(sorted_codes) if sorted_codes else np.array([], dtype=np.int64)
+    merged.sort(kind='mergesort')  # concatenation of sorted runs
+    union = merged[np.r_[True, merged[1:] != merged[:-1]]] if len(merged) else merged
+    positions = []
+    for c in valid:
+        order = np.argsort(c, kind='stable')
+        pos = np.empty(len(c), dtype=np.int64)
+        pos[order] = np.searchsorted(union, c[order])
+        positions.append(pos)
+    return union, positions
+
+
+def _expand_duplicates(positions, n):
+    """
+    rows of the join when keys are duplicated: like the all full join of the server every key gets every combination
+    of the rows of the frames, a frame without the key takes part with one missing row
+    :param positions: position of every row of each frame in the sorted union of n keys
+    :return: (position of the key of every joined row, [row of each frame for every joined row, -1 if missing])
+    """
+    counts = [np.bincount(pos, minlength=n) for pos in positions]
+    radix = [np.maximum(c, 1) for c in counts]
+    sizes = np.prod(radix, axis=0) if radix else np.zeros(n, dtype=np.int64)
+    key_pos = np.repeat(np.arange(n), sizes)
+    local = np.arange(len(key_pos)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    rows, stride = [None] * len(positions), np.ones(len(key_pos), dtype=np.int64)
+    for i in range(len(positions) - 1, -1, -1):  # the rows of the first frame vary slowest
+        count = counts[i][key_pos]
+        if len(positions[i]) == 0:
+            rows[i] = np.full(len(key_pos), -1, dtype=np.int64)
+            continue
+        order = np.argsort(positions[i], kind='stable')  # rows grouped by key, in their original order
+        start = (np.cumsum(counts[i]) - counts[i])[key_pos]
+        digit = (local // stride) % np.maximum(count, 1)
+        rows[i] = np.where(count > 0, order[np.minimum(start + digit, len(order) - 1)], -1)
+        stride = stride * np.maximum(count, 1)
+    return key_pos, rows
+
+
+def sorted_merge(frames, keys=CIK_KEYS):
+    """
+    full outer join of frames on the key columns, the same result as pd.concat of the frames indexed by keys along
+    axis=1, but without hashing MultiIndex tuples: the keys are encoded into sorted integer codes and every frame is
+    aligned to the sorted union of the codes
+    rows with a missing key are dropped, duplicated keys get every combination of the rows of the frames, the same
+    rows as the nested all full joins of the server
+    :param frames: DataFrames with the key columns and factor columns
+    :return: DataFrame(index=MultiIndex(keys), columns=[factor columns of all frames]), sorted by keys
+    """
+    codes, levels = encode_keys(frames, keys)
+    union, positions = _union_positions(codes, int(np.prod([max(len(i), 1) for i in levels], dtype=np.float64)))
+    duplicated = any((len(pos) > 0) and (np.bincount(pos, minlength=len(union)).max() > 1) for pos in positions)
+    if duplicated:
+        key_pos, rows = _expand_duplicates(positions, len(union))
+        union = union[key_pos]
+    data, columns = {}, []
+    for i, (frame, code, pos) in enumerate(zip(frames, codes, positions)):
+        valid = code >= 0
+        if duplicated:
+            found = rows[i] >= 0
+            take, pos = rows[i][found], np.flatnonzero(found)
+        for col in frame.columns:
+            if col in keys:
+                continue
+            values = np.asarray(frame[col])
+            values = values if valid.all() else values[valid]
+            data[len(data)] = _aligned(values[take] if duplicated else values, pos, len(union))
+            columns.append(col)
+    sizes = [max(len(i), 1) for i in levels]
+    index_codes, rest = [], union
+    for size in sizes[::-1]:
+        index_codes.insert(0, rest % size)
+        rest = rest // size
+    index = pd.MultiIndex(levels=[pd.Index(i) for i in levels], codes=index_codes, names=list(keys))
+    result = pd.DataFrame(data, index=index)
+    result.columns = columns
+    return result
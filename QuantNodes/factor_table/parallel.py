@@ -0,0 +1,53 @@
+# coding=utf-8
+"""
+concurrent fetching of the sub-queries of a factor table
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_query(query, sql_list, concurrency=1):
+    """
+    run the queries with at most concurrency of them at the same time, results are yielded in order
+    closing the generator early cancels the queries that have not started
+    """
+    if concurrency <= 1:
+        for sql in sql_list:
+            yield query(sql)
+        return
+    executor = ThreadPoolExecutor(max_workers=max(min(concurrency, len(sql_list)), 1))
+    futures = [executor.submit(query, sql) for sql in sql_list]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        # cancel by hand, shutdown(cancel_futures=True) needs python 3.9
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class ThreadLocalQuery(object):
+    """
+    callable connector which gives every thread its own connector, so a connector that is not thread-safe can be used
+    by map_query
+    :param create_node: function returning a new connector, called once in every thread that queries
+    """
+
+    def __init__(self, create_node):
+        self._create_node = create_node
+        self._local = threading.local()
+
+    def _get_node(self):
+        node = getattr(self._local, 'node', None)
+        if node is None:
+            node = self._local.node = self._create_node()
+        return node
+
+    def __call__(self, sql):
+        return self._get_node()(sql)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._get_node(), name)
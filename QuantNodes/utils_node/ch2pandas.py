@@ -8,6 +8,8 @@ import urllib
 import numpy as np
 import pandas as pd
 
+from QuantNodes.utils_node.ch_binary import BINARY_FORMATS, BINARY_SETTINGS, UnsupportedTypeError, decode_frame
+
 
 def _get_ch_data_range(col_def):
     col_def['is_nullable'] = col_def['type'].str.startswith('Nullable(')
@@ -41,7 +43,7 @@ def _merge_settings(settings):
         'enable_http_compression': 1, 'send_progress_in_http_headers': 0,
         'log_queries': 1, 'connect_timeout': 10, 'receive_timeout': 300,
         'send_timeout': 300, 'output_format_json_quote_64bit_integers': 0,
-        'wait_end_of_query': 0}
+        'wait_end_of_query': 0, **BINARY_SETTINGS}
 
     if settings is not None:
         invalid_setting_keys = list(set(settings.keys()) - set(updated_settings.keys()))
@@ -125,7 +127,7 @@ def insert(connection_url, db_table, df, settings):
     print('Done.')
 
 
-def select(connection_url, query=None, convert_to='DataFrame', settings=None):
+def select(connection_url, query=None, convert_to='DataFrame', settings=None, transport='Native'):
     updated_settings = _merge_settings(settings)
 
     components = urllib.parse.urlparse(connection_url)
@@ -143,13 +145,14 @@ def select(connection_url, query=None, convert_to='DataFrame', settings=None):
                         'TabSeparatedWithNamesAndTypes', 'CSV', 'CSVWithNames', 'Values', 'Vertical', 'JSON',
                         'JSONCompact', 'JSONEachRow',
                         'TSKV', 'Pretty', 'PrettyCompact', 'PrettyCompactMonoBlock', 'PrettyNoEscapes', 'PrettySpace',
-                        'XML']
+                        'XML'] + BINARY_FORMATS
 
     if convert_to.lower() not in [i.lower() for i in accepted_formats]:
         raise ValueError('"convert_to" has an invalid value "{0}", it should be one of the following: {1}'.format(
             convert_to, ', '.join(accepted_formats)))
 
-    clickhouse_format = 'JSON' if convert_to is None else 'JSONCompact' if convert_to.lower() == 'dataframe' else convert_to
+    binary = (convert_to.lower() == 'dataframe') and (transport in BINARY_FORMATS)
+    clickhouse_format = 'JSON' if convert_to is None else transport if convert_to.lower() == 'dataframe' else convert_to
     query_with_format = (query.rstrip('; \n\t') + ' format ' + clickhouse_format).replace('\n', ' ').strip(' ')
 
     http_get_params = {'user': components.username, 'password': components.password}
@@ -181,20 +184,29 @@ def select(connection_url, query=None, convert_to='DataFrame', settings=None):
             raise NotImplementedError('Unknown Error: status: {0}, reason: {1}, message: {2}'.format(
                 resp.status, resp.reason, error_message))
 
-    total = bytes()
+    server_tz = resp.getheader('X-ClickHouse-Timezone')
+    chunks = []
     bytes_downloaded = 0
     last_time = time.time()
 
     while not resp.isclosed():
         bytes_downloaded += 300 * 1024
-        total += resp.read(300 * 1024)
+        chunks.append(resp.read(300 * 1024))
         if time.time() - last_time > 1:
             last_time = time.time()
             print('\rDownloaded: %.1f MB.' % (bytes_downloaded / 1024 / 1024), end='\r')
     print()
     conn.close()
 
-    ret_value = gzip.decompress(total).decode() if updated_settings['enable_http_compression'] == 1 else total.decode()
+    total = b''.join(chunks)
+    ret_value = gzip.decompress(total) if updated_settings['enable_http_compression'] == 1 else total
+
+    if binary:
+        try:
+            return decode_frame(ret_value, transport, server_tz)
+        except UnsupportedTypeError:  # e.g. Array, Tuple or Map columns
+            return select(connection_url, query, convert_to=convert_to, settings=settings, transport='JSONCompact')
+    ret_value = ret_value.decode()
 
     if convert_to.lower() == 'dataframe':
         result_dict = json.loads(ret_value, strict=False)
@@ -8,32 +8,93 @@ Created on Sun Aug 18 12:17:40 2019
 """
 
 import gzip
-import http
+import http.client
 import json
+import queue
 import time
 import urllib
+import zlib
 from collections import namedtuple
 
 import numpy as np
 import pandas as pd
 
+from QuantNodes.utils_node.ch_binary import BINARY_FORMATS, BINARY_SETTINGS, NativeStreamDecoder, UnsupportedTypeError, \
+    decode_frame
+
 ch_conn_tuple = namedtuple('clickhouse_params', ['host', 'port', 'user', 'passwd', 'db'])
 
 
+class HTTPConnectionPool(object):
+    """
+    thread-safe pool of keep-alive HTTP connections, a connection is used by one request at a time
+    :param create_conn: function returning a new http.client.HTTPConnection
+    :param pool_size: max number of idle connections kept alive, extra connections are closed when released
+    """
+
+    def __init__(self, create_conn, pool_size=4):
+        self._create_conn = create_conn
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue(maxsize=max(pool_size, 0))
+
+    def acquire(self, reuse=True):
+        """
+        returns (connection, whether it is a reused idle connection)
+        :param reuse: False to always open a new connection
+        """
+        if reuse:
+            try:
+                return self._idle.get_nowait(), True
+            except queue.Empty:
+                pass
+        return self._create_conn(), False
+
+    def release(self, conn):
+        """return a connection whose response has been read completely"""
+        if self.pool_size <= 0:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class CHBase(object):
-    def __init__(self, name: str, user='default', passwd='123456', host='0.0.0.0', port=8123, db='default'):
+    def __init__(self, name: str, user='default', passwd='123456', host='0.0.0.0', port=8123, db='default',
+                 transport='Native', pool_size=4):
         self.name = name
         self._para = ch_conn_tuple(host, port, user, passwd, db)
+        # keep-alive connections shared by get, get_iter and insert_query
+        self._pool = HTTPConnectionPool(self._create_conn, pool_size=pool_size)
+        # format requested when convert_to is DataFrame: one of BINARY_FORMATS or JSONCompact
+        self.transport = transport
+        self.server_timezone = None
         self.accepted_formats = ['DataFrame', 'TabSeparated', 'TabSeparatedRaw', 'TabSeparatedWithNames',
                                  'TabSeparatedWithNamesAndTypes', 'CSV', 'CSVWithNames', 'Values', 'Vertical', 'JSON',
                                  'JSONCompact', 'JSONEachRow', 'TSKV', 'Pretty', 'PrettyCompact',
-                                 'PrettyCompactMonoBlock', 'PrettyNoEscapes', 'PrettySpace', 'XML']
+                                 'PrettyCompactMonoBlock', 'PrettyNoEscapes', 'PrettySpace', 'XML'] + BINARY_FORMATS
         self.settings = self._merge_settings(None)
         http_get_params = {'user': self._para.user, 'password': self._para.passwd}
 
         http_get_params.update(self.settings)
         self.http_get_params = http_get_params
 
+    def __call__(self, sql, **kwargs):
+        """run a select query, the same as get, so CHBase can be used as the query of the factor table fetches"""
+        return self.get(sql, **kwargs)
+
+    def close(self):
+        """close the idle connections of the pool"""
+        self._pool.close()
+
     def SHOWTABLES(self):
         res = self.get('SHOW TABLES FROM {db}'.format(db=self._para.db)).values
         return res
@@ -51,8 +112,8 @@ class CHBase(object):
                              'while the provided "query" starts with "{0}"'.format(sql.strip(' \n\t').split(' ')[0]))
 
     @staticmethod
-    def _transfer_sql_format(sql, convert_to):
-        clickhouse_format = 'JSON' if convert_to is None else 'JSONCompact' if convert_to.lower() == 'dataframe' else convert_to
+    def _transfer_sql_format(sql, convert_to, transport='JSONCompact'):
+        clickhouse_format = 'JSON' if convert_to is None else transport if convert_to.lower() == 'dataframe' else convert_to
         query_with_format = (sql.rstrip('; \n\t') + ' format ' + clickhouse_format).replace('\n', ' ').strip(' ')
         return query_with_format
 
@@ -73,50 +134,83 @@ class CHBase(object):
         ret_value = conn.getresponse().read().decode().replace('\n', '')
         print(ret_value)
 
-    def _get_data(self, conn, updated_settings, auto_close=True):
-        resp = conn.getresponse()
+    def _send(self, query_with_format, updated_settings, idempotent=False):
+        """
+        send the query on a pooled keep-alive connection, returns (conn, resp)
+        :param idempotent: True for queries that can safely run twice (select, describe, show): a reused connection
+            is not checked beforehand, if the server has closed it the query is sent again on another connection;
+            other queries (insert, optimize) are sent once on a new connection, since the server may already have
+            executed them when the connection breaks
+        """
+        while True:
+            conn, reused = self._pool.acquire(reuse=idempotent)
+            try:
+                self._compression_switched_request(query_with_format, conn, updated_settings, self.http_get_params)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                conn.close()
+                if not reused:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def _get_response(self, query_with_format, updated_settings):
+        conn, resp = self._send(query_with_format, updated_settings, idempotent=True)
+        self.server_timezone = resp.getheader('X-ClickHouse-Timezone')
 
         if resp.status == 404:
             error_message = gzip.decompress(resp.read()).decode() if updated_settings['enable_http_compression'] == 1 \
                 else resp.read().decode()
-            if auto_close:
-                conn.close()
+            conn.close()
             raise ValueError(error_message)
         elif resp.status == 401:
-            if auto_close:
-                conn.close()
+            conn.close()
             raise ConnectionRefusedError(resp.reason + '. The username or password is incorrect.')
         else:
             if resp.status != 200:
                 error_message = gzip.decompress(resp.read()).decode() if updated_settings[
                                                                              'enable_http_compression'] == 1 \
                     else resp.read().decode()
-                if auto_close:
-                    conn.close()
+                conn.close()
                 raise NotImplementedError('Unknown Error: status: {0}, reason: {1}, message: {2}'.format(
                     resp.status, resp.reason, error_message))
+        return conn, resp
 
-        total = bytes()
+    @staticmethod
+    def _iter_chunks(resp, updated_settings, chunk_size=300 * 1024):
+        """yield the decompressed response body chunk by chunk"""
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if updated_settings['enable_http_compression'] == 1 else None
         bytes_downloaded = 0
         last_time = time.time()
 
         while not resp.isclosed():
-            bytes_downloaded += 300 * 1024
-            total += resp.read(300 * 1024)
+            chunk = resp.read(chunk_size)
+            if not chunk:
+                break
+            bytes_downloaded += len(chunk)
             if time.time() - last_time > 1:
                 last_time = time.time()
                 print('\rDownloaded: %.1f MB.' % (bytes_downloaded / 1024 / 1024), end='\r')
-        if auto_close:
-            print('will close conn')
+            yield decompressor.decompress(chunk) if decompressor is not None else chunk
+        if decompressor is not None:
+            yield decompressor.flush()
+
+    def _get_data(self, query_with_format, updated_settings, decode=True):
+        conn, resp = self._get_response(query_with_format, updated_settings)
+        try:
+            ret_value = b''.join(self._iter_chunks(resp, updated_settings))
+        except BaseException:
             conn.close()
-            print('conn closed')
-        ret_value = gzip.decompress(total).decode() if updated_settings[
-                                                           'enable_http_compression'] == 1 else total.decode()
-        return ret_value
+            raise
+        self._pool.release(conn)
+        return ret_value.decode() if decode else ret_value
 
     @staticmethod
-    def _load_into_pd(ret_value, convert_to):
-        if convert_to.lower() == 'dataframe':
+    def _load_into_pd(ret_value, convert_to, transport='JSONCompact', server_tz=None):
+        if (convert_to.lower() == 'dataframe') and (transport in BINARY_FORMATS):
+            ret_value = decode_frame(ret_value, transport, server_tz)
+        elif convert_to.lower() == 'dataframe':
             result_dict = json.loads(ret_value, strict=False)
             dataframe = pd.DataFrame.from_records(result_dict['data'], columns=[i['name'] for i in result_dict['meta']])
 
@@ -140,9 +234,17 @@ class CHBase(object):
         else:
             raise ValueError('Unknown sql! current only accept select, insert, show, optimize')
 
-    def get(self, sql, convert_to='DataFrame', auto_close=True):
-        conn = self._create_conn()
-        self._test_connection(conn)
+    def get(self, sql, convert_to='DataFrame', auto_close=True, transport=None):
+        """
+        run a select query
+        :param auto_close: kept for compatibility, connections are returned to the keep-alive pool
+        :param transport: format requested when convert_to is DataFrame, binary formats (Native,
+            RowBinaryWithNamesAndTypes, ArrowStream) are decoded straight into typed columns, default self.transport;
+            a result with a column type the binary decoders do not support (Array, Tuple, Map, ...) is requested again
+            as JSONCompact
+        """
+        transport = self.transport if transport is None else transport
+        binary = (convert_to.lower() == 'dataframe') and (transport in BINARY_FORMATS)
         self._check_sql_select_only(sql)
 
         updated_settings = self.settings
@@ -164,8 +266,7 @@ class CHBase(object):
         #                  headers={'Content-Encoding': 'gzip', 'Accept-Encoding': 'gzip'})
         # else:
         #     conn.request('POST', '/?' + urllib.parse.urlencode(self.http_get_params), body=query_with_format.encode())
-        query_with_format = self._transfer_sql_format(sql, convert_to)
-        conn = self._compression_switched_request(query_with_format, conn, updated_settings, self.http_get_params)
+        query_with_format = self._transfer_sql_format(sql, convert_to, transport)
 
         # resp = conn.getresponse()
         #
@@ -201,7 +302,7 @@ class CHBase(object):
         #
         # ret_value = gzip.decompress(total).decode() if updated_settings[
         #                                                    'enable_http_compression'] == 1 else total.decode()
-        ret_value = self._get_data(conn, updated_settings, auto_close=auto_close)
+        ret_value = self._get_data(query_with_format, updated_settings, decode=not binary)
 
         # if convert_to.lower() == 'dataframe':
         #     result_dict = json.loads(ret_value, strict=False)
@@ -212,17 +313,57 @@ class CHBase(object):
         #             dataframe[i['name']] = pd.to_datetime(dataframe[i['name']])
         #
         #     ret_value = dataframe
-        ret_value = self._load_into_pd(ret_value, convert_to)
+        try:
+            ret_value = self._load_into_pd(ret_value, convert_to, transport, self.server_timezone)
+        except UnsupportedTypeError:
+            return self.get(sql, convert_to=convert_to, transport='JSONCompact')
 
         return ret_value
 
+    def get_iter(self, sql, batch_rows=100000):
+        """
+        run a select query and yield the result as DataFrame batches while the response arrives,
+        the response is requested in Native format and decompressed and decoded incrementally, so memory is bounded by
+        a batch plus one block instead of the whole payload
+        :param batch_rows: rows of each batch, the last one may be shorter
+        a result with a column type the Native decoder does not support is fetched as JSONCompact and split into batches
+        """
+        self._check_sql_select_only(sql)
+        updated_settings = self.settings
+        query_with_format = self._transfer_sql_format(sql, 'DataFrame', 'Native')
+        conn, resp = self._get_response(query_with_format, updated_settings)
+        finished = False
+        try:
+            decoder = NativeStreamDecoder(batch_rows=batch_rows, server_tz=self.server_timezone)
+            for chunk in self._iter_chunks(resp, updated_settings):
+                for frame in decoder.feed(chunk):
+                    yield frame
+            finished = True
+            for frame in decoder.close():
+                yield frame
+        except UnsupportedTypeError:
+            # raised by the header of the first block, before any batch is yielded
+            finished = False
+        else:
+            return
+        finally:
+            # a connection whose response is not read completely cannot be reused
+            if finished:
+                self._pool.release(conn)
+            else:
+                conn.close()
+        frame = self.get(sql, transport='JSONCompact')
+        step = batch_rows if batch_rows else max(len(frame), 1)
+        for start in range(0, len(frame), step):
+            yield frame.iloc[start:start + step].reset_index(drop=True)
+
     @staticmethod
     def _merge_settings(settings):
         updated_settings = {
             'enable_http_compression': 1, 'send_progress_in_http_headers': 0,
             'log_queries': 1, 'connect_timeout': 10, 'receive_timeout': 300,
             'send_timeout': 300, 'output_format_json_quote_64bit_integers': 0,
-            'wait_end_of_query': 0}
+            'wait_end_of_query': 0, **BINARY_SETTINGS}
 
         if settings is not None:
             invalid_setting_keys = list(set(settings.keys()) - set(updated_settings.keys()))
@@ -282,8 +423,6 @@ class CHBase(object):
 
     def insert_query(self, query_with_format: str):
 
-        conn = self._create_conn()
-        self._test_connection(conn)
         # self._check_sql_select_only(sql)
 
         updated_settings = self.settings
@@ -292,7 +431,7 @@ class CHBase(object):
         # http_get_params.update(updated_settings)
         # conn = http.client.HTTPConnection(components.hostname, port=components.port)
 
-        conn = self._compression_switched_request(query_with_format, conn, updated_settings, self.http_get_params)
+        conn, resp = self._send(query_with_format, updated_settings)
 
         # if updated_settings['enable_http_compression'] == 1:
         #     conn.request('POST', '/?' + urllib.parse.urlencode(http_get_params),
@@ -300,7 +439,6 @@ class CHBase(object):
         #                  headers={'Content-Encoding': 'gzip', 'Accept-Encoding': 'gzip'})
         # else:
         #     conn.request('POST', '/?' + urllib.parse.urlencode(http_get_params), body=query_with_format.encode())
-        resp = conn.getresponse()
 
         if resp.status != 200:
             error_message = gzip.decompress(resp.read()).decode() if updated_settings['enable_http_compression'] == 1 \
@@ -309,7 +447,8 @@ class CHBase(object):
             raise NotImplementedError('Unknown Error: status: {0}, reason: {1}, message: {2}'.format(
                 resp.status, resp.reason, error_message))
 
-        conn.close()
+        resp.read()
+        self._pool.release(conn)
         print('Done.')
 
         pass
@@ -0,0 +1,441 @@
+# coding=utf-8
+"""
+decode ClickHouse binary output formats straight into typed numpy columns
+
+Native: columnar blocks, fixed width columns are read with np.frombuffer
+RowBinaryWithNamesAndTypes: row oriented, rows of fixed width columns are read as one structured array
+ArrowStream: decoded by pyarrow (optional dependency)
+"""
+import re
+import struct
+import uuid
+
+import numpy as np
+import pandas as pd
+
+BINARY_FORMATS = ['Native', 'RowBinaryWithNamesAndTypes', 'ArrowStream']
+
+# settings required by the binary formats, LowCardinality columns are sent as their nested type in Native format
+BINARY_SETTINGS = {'low_cardinality_allow_in_native_format': 0}
+
+_FIXED_TYPES = {'Int8': '<i1', 'Int16': '<i2', 'Int32': '<i4', 'Int64': '<i8',
+                'UInt8': '<u1', 'UInt16': '<u2', 'UInt32': '<u4', 'UInt64': '<u8',
+                'Float32': '<f4', 'Float64': '<f8', 'Bool': '<u1', 'IPv4': '<u4',
+                'Date': '<u2', 'Date32': '<i4', 'DateTime': '<u4', 'DateTime64': '<i8',
+                'Enum8': '<i1', 'Enum16': '<i2'}
+
+_STRUCT_CODES = {'i1': 'b', 'i2': 'h', 'i4': 'i', 'i8': 'q', 'u1': 'B', 'u2': 'H', 'u4': 'I', 'u8': 'Q', 'f4': 'f', 'f8': 'd'}
+
+
+class UnsupportedTypeError(NotImplementedError):
+    """a column type that the binary decoders cannot read, the query has to be sent again as JSONCompact"""
+    pass
+
+
+_DECIMAL_WIDTHS = ((9, '<i4'), (18, '<i8'), (38, 16), (76, 32))
+
+
+def _read_varuint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_string(buf, pos):
+    length, pos = _read_varuint(buf, pos)
+    if pos + length > len(buf):
+        raise IndexError('string out of range')
+    return buf[pos:pos + length].decode('utf-8', 'replace'), pos + length
+
+
+def _split_args(args):
+    """split the arguments of a type such as "DateTime64(3, 'Asia/Shanghai')" at top level commas"""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(args):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif (char == ',') and (depth == 0):
+            parts.append(args[start:i].strip())
+            start = i + 1
+    parts.append(args[start:].strip())
+    return [i for i in parts if i]
+
+
+def parse_type(type_str):
+    """
+    parse a ClickHouse type name
+    :param type_str: e.g. 'Nullable(DateTime(\'Asia/Shanghai\'))'
+    :return: dict(kind=..., ...), kind is one of fixed, string, fixed_string, decimal, uuid, nullable
+    """
+    type_str = type_str.strip()
+    match = re.match(r'^(\w+)(?:\((.*)\))?$', type_str, re.S)
+    if match is None:
+        raise UnsupportedTypeError('unsupported ClickHouse type: {0}'.format(type_str))
+    name, args = match.group(1), _split_args(match.group(2) or '')
+    if name == 'Nullable':
+        return {'kind': 'nullable', 'type': type_str, 'inner': parse_type(args[0])}
+    elif name in ('LowCardinality', 'SimpleAggregateFunction'):
+        return parse_type(args[-1])
+    elif name == 'String':
+        return {'kind': 'string', 'type': type_str}
+    elif name == 'FixedString':
+        return {'kind': 'fixed_string', 'type': type_str, 'dtype': np.dtype('S' + args[0])}
+    elif name == 'UUID':
+        return {'kind': 'uuid', 'type': type_str, 'dtype': np.dtype('<u8, <u8')}
+    elif name.startswith('Decimal'):
+        if name == 'Decimal':
+            precision, scale = int(args[0]), int(args[1])
+        else:
+            precision, scale = {'Decimal32': 9, 'Decimal64': 18, 'Decimal128': 38, 'Decimal256': 76}[name], int(args[0])
+        width = [w for p, w in _DECIMAL_WIDTHS if precision <= p][0]
+        dtype = np.dtype(width) if isinstance(width, str) else np.dtype('V' + str(width))
+        return {'kind': 'decimal', 'type': type_str, 'dtype': dtype, 'scale': scale}
+    elif name in _FIXED_TYPES:
+        spec = {'kind': 'fixed', 'type': type_str, 'name': name, 'dtype': np.dtype(_FIXED_TYPES[name])}
+        if name == 'DateTime':
+            spec['tz'] = args[0].strip("'") if args else None
+        elif name == 'DateTime64':
+            spec['precision'] = int(args[0])
+            spec['tz'] = args[1].strip("'") if len(args) > 1 else None
+        elif name.startswith('Enum'):
+            spec['enum'] = {int(v): k.strip().strip("'") for k, v in (i.rsplit('=', 1) for i in args)}
+        return spec
+    raise UnsupportedTypeError('unsupported ClickHouse type: {0}, use JSONCompact for this query'.format(type_str))
+
+
+def _read_strings(buf, pos, n):
+    """read n length-prefixed strings, returns object array of str"""
+    if n == 0:
+        return np.empty(0, dtype='O'), pos
+    length = buf[pos]
+    # fast path: all strings share the same length (e.g. security codes), the block is a (n, length + 1) byte matrix
+    if (length < 0x80) and (pos + n * (length + 1) <= len(buf)):
+        block = np.frombuffer(buf, dtype=np.uint8, count=n * (length + 1), offset=pos).reshape(n, length + 1)
+        if (block[:, 0] == length).all() and ((length == 0) or (block[:, -1] != 0).all()):
+            values = block[:, 1:].copy().view('S' + str(max(length, 1))).ravel() if length > 0 else np.full(n, b'')
+            return np.char.decode(values, 'utf-8', 'replace').astype('O'), pos + n * (length + 1)
+    values = [None] * n
+    for i in range(n):
+        length = buf[pos]
+        if length < 0x80:
+            pos += 1
+        else:
+            length, pos = _read_varuint(buf, pos)
+        if pos + length > len(buf):
+            raise IndexError('string out of range')
+        values[i] = buf[pos:pos + length].decode('utf-8', 'replace')
+        pos += length
+    return np.array(values, dtype='O'), pos
+
+
+def _read_native_column(buf, pos, spec, n):
+    """read one column of a Native block, returns (raw values, null mask or None, new position)"""
+    if spec['kind'] == 'nullable':
+        mask = np.frombuffer(buf, dtype=np.uint8, count=n, offset=pos).astype(bool)
+        values, _, pos = _read_native_column(buf, pos + n, spec['inner'], n)
+        return values, mask, pos
+    elif spec['kind'] == 'string':
+        values, pos = _read_strings(buf, pos, n)
+        return values, None, pos
+    dtype = spec['dtype']
+    values = np.frombuffer(buf, dtype=dtype, count=n, offset=pos)
+    return values, None, pos + n * dtype.itemsize
+
+
+def _to_datetime(values, unit, tz, server_tz):
+    """convert epoch ticks to naive datetime64[ns] in the column time zone (or the server time zone)"""
+    result = pd.to_datetime(values.astype(np.int64), unit=unit, utc=True)
+    tz = tz or server_tz
+    if tz:
+        result = result.tz_convert(tz)
+    return result.tz_localize(None).values.astype('datetime64[ns]')
+
+
+def convert_column(values, spec, mask=None, server_tz=None):
+    """convert raw values of a column to numpy values used by DataFrame, nulls become nan/NaT/None"""
+    if spec['kind'] == 'nullable':
+        spec = spec['inner']
+    kind, name = spec['kind'], spec.get('name')
+    if kind == 'string':
+        result = values
+    elif kind == 'fixed_string':
+        result = np.char.decode(values, 'utf-8', 'replace').astype('O')
+    elif kind == 'uuid':
+        result = np.array([str(uuid.UUID(int=(int(hi) << 64) | int(lo))) for hi, lo in values.tolist()], dtype='O')
+    elif kind == 'decimal':
+        if values.dtype.kind == 'V':
+            raw, size = values.tobytes(), values.dtype.itemsize
+            ints = [int.from_bytes(raw[j:j + size], 'little', signed=True) for j in range(0, len(raw), size)]
+            result = np.array(ints, dtype=np.float64) / 10 ** spec['scale']
+        else:
+            result = values.astype(np.float64) / 10 ** spec['scale']
+    elif name == 'Date':
+        result = values.astype(np.int64).astype('datetime64[D]').astype('datetime64[ns]')
+    elif name == 'Date32':
+        result = values.astype(np.int64).astype('datetime64[D]').astype('datetime64[ns]')
+    elif name == 'DateTime':
+        result = _to_datetime(values, 's', spec['tz'], server_tz)
+    elif name == 'DateTime64':
+        result = _to_datetime(values * 10 ** max(9 - spec['precision'], 0), 'ns', spec['tz'], server_tz)
+    elif name in ('Enum8', 'Enum16'):
+        result = pd.Series(values).map(spec['enum']).values.astype('O')
+    elif name == 'Bool':
+        result = values.astype(bool)
+    elif name == 'IPv4':
+        result = np.array(['.'.join(str(b) for b in int(i).to_bytes(4, 'big')) for i in values], dtype='O')
+    else:
+        result = np.array(values)
+    if (mask is not None) and mask.any():
+        if result.dtype.kind in 'biu':
+            result = result.astype(np.float64)
+        elif result.dtype.kind == 'O':
+            result = result.copy()
+        result[mask] = (np.datetime64('NaT') if result.dtype.kind == 'M' else np.nan if result.dtype.kind == 'f' else None)
+    return result
+
+
+def _build_frame(names, specs, columns, masks, server_tz):
+    data = {}
+    for i, spec in enumerate(specs):
+        values = columns[i][0] if len(columns[i]) == 1 else np.concatenate(columns[i])
+        mask = None
+        if spec['kind'] == 'nullable':
+            mask = masks[i][0] if len(masks[i]) == 1 else np.concatenate(masks[i])
+        data[i] = convert_column(values, spec, mask, server_tz)
+    frame = pd.DataFrame(data, index=range(len(data[0]) if data else 0))
+    frame.columns = names
+    return frame
+
+
+def _read_native_block(buf, pos, specs=None):
+    """
+    read one Native block, raises IndexError or ValueError if the block is truncated
+    :param specs: parsed types of the previous block, reused when the types are unchanged
+    :return: (names, specs, columns, masks, number of rows, new position)
+    """
+    n_cols, pos = _read_varuint(buf, pos)
+    n_rows, pos = _read_varuint(buf, pos)
+    names, new_specs, columns, masks = [], [], [], []
+    for i in range(n_cols):
+        name, pos = _read_string(buf, pos)
+        type_str, pos = _read_string(buf, pos)
+        if (specs is not None) and (i < len(specs)) and (specs[i]['type'] == type_str):
+            spec = specs[i]
+        else:
+            spec = parse_type(type_str)
+        values, mask, pos = _read_native_column(buf, pos, spec, n_rows)
+        names.append(name)
+        new_specs.append(spec)
+        columns.append(values)
+        masks.append(mask)
+    return names, new_specs, columns, masks, n_rows, pos
+
+
+def _merge_blocks(blocks, server_tz=None):
+    """build one DataFrame from the blocks returned by _read_native_block"""
+    if not blocks:
+        return pd.DataFrame()
+    names, specs = blocks[0][0], blocks[0][1]
+    columns = [[block[2][i] for block in blocks] for i in range(len(names))]
+    masks = [[block[3][i] for block in blocks if block[3][i] is not None] for i in range(len(names))]
+    return _build_frame(names, specs, columns, masks, server_tz)
+
+
+def decode_native(body, server_tz=None):
+    """decode a Native format body (one or more blocks) into a DataFrame"""
+    pos, specs, blocks = 0, None, []
+    while pos < len(body):
+        block = _read_native_block(body, pos, specs)
+        specs, pos = block[1], block[-1]
+        blocks.append(block)
+    return _merge_blocks(blocks, server_tz)
+
+
+class NativeStreamDecoder(object):
+    """
+    incremental decoder of a Native format stream, blocks are decoded as soon as all their bytes arrived
+
+    decoder = NativeStreamDecoder(batch_rows=100000)
+    for chunk in chunks:
+        for frame in decoder.feed(chunk):
+            ...
+    for frame in decoder.close():
+        ...
+
+    :param batch_rows: rows of each DataFrame returned (the last one may be shorter), None returns all decoded rows
+    :param server_tz: time zone of the server, see decode_frame
+    """
+
+    def __init__(self, batch_rows=None, server_tz=None):
+        self.batch_rows = batch_rows
+        self.server_tz = server_tz
+        self._chunks, self._size = [], 0  # bytes not decoded yet
+        self._retry_size = 0  # a truncated block is parsed again only after the buffer doubled
+        self._specs = None
+        self._blocks, self._pending, self._rows = [], None, 0  # decoded rows not returned yet
+        self._header = None  # empty DataFrame with the columns of the result
+        self._emitted = False
+
+    def feed(self, data):
+        """add bytes of the stream, returns a list of complete batches"""
+        if data:
+            self._chunks.append(bytes(data))
+            self._size += len(data)
+        if self._size >= self._retry_size:
+            self._parse()
+        return self._take(final=False)
+
+    def close(self):
+        """end of the stream, returns the remaining rows, raises ValueError if the stream is truncated"""
+        self._parse()
+        if self._size > 0:
+            raise ValueError('truncated Native stream: {0} bytes left'.format(self._size))
+        frames = self._take(final=True)
+        if (not frames) and (not self._emitted) and (self._header is not None):
+            frames = [self._header]
+        return frames
+
+    def _parse(self):
+        buf = self._chunks[0] if len(self._chunks) == 1 else b''.join(self._chunks)
+        pos = 0
+        while pos < len(buf):
+            try:
+                names, specs, columns, masks, n_rows, new_pos = _read_native_block(buf, pos, self._specs)
+            except (IndexError, ValueError):
+                self._retry_size = 2 * (len(buf) - pos)
+                break
+            block = (names, specs, columns, masks, n_rows, new_pos)
+            self._specs, pos = specs, new_pos
+            if self._header is None:
+                self._header = _merge_blocks([block], self.server_tz).iloc[:0]
+            if n_rows > 0:
+                self._blocks.append(block)
+                self._rows += n_rows
+        else:
+            self._retry_size = 0
+        self._chunks = [buf[pos:]] if pos < len(buf) else []
+        self._size = len(buf) - pos
+
+    def _take(self, final):
+        if (self._rows == 0) or ((not final) and (self.batch_rows is not None) and (self._rows < self.batch_rows)):
+            return []
+        frame = _merge_blocks(self._blocks, self.server_tz) if self._blocks else self._pending
+        if (self._pending is not None) and self._blocks:
+            frame = pd.concat([self._pending, frame], ignore_index=True)
+        self._blocks, self._pending, self._rows = [], None, 0
+        if self.batch_rows is None:
+            frames = [frame]
+        else:
+            n_full = len(frame) if final else len(frame) - len(frame) % self.batch_rows
+            frames = [frame.iloc[i:i + self.batch_rows].reset_index(drop=True) for i in range(0, n_full, self.batch_rows)]
+            if n_full < len(frame):
+                self._pending = frame.iloc[n_full:].reset_index(drop=True)
+                self._rows = len(self._pending)
+        self._emitted = self._emitted or bool(frames)
+        return frames
+
+
+def _gen_row_reader(spec):
+    """reader of one value in RowBinary format: fun(buf, pos) -> (value, is_null, new position)"""
+    kind = spec['kind']
+    if kind == 'nullable':
+        inner = _gen_row_reader(spec['inner'])
+        default = ('' if spec['inner']['kind'] == 'string' else 0 if spec['inner']['kind'] == 'fixed' else
+                   b'\x00' * spec['inner']['dtype'].itemsize)
+
+        def read(buf, pos):
+            if buf[pos]:
+                return default, True, pos + 1
+            return inner(buf, pos + 1)
+        return read
+    elif kind == 'string':
+        def read(buf, pos):
+            length, pos = _read_varuint(buf, pos)
+            return buf[pos:pos + length].decode('utf-8', 'replace'), False, pos + length
+        return read
+    dtype = spec['dtype']
+    size = dtype.itemsize
+    if kind == 'fixed':
+        unpack = struct.Struct('<' + _STRUCT_CODES[dtype.str[1:]]).unpack_from
+        return lambda buf, pos: (unpack(buf, pos)[0], False, pos + size)
+    return lambda buf, pos: (buf[pos:pos + size], False, pos + size)
+
+
+def _row_values(values, spec):
+    """assemble the raw values read row by row into the raw array of the column"""
+    if spec['kind'] == 'nullable':
+        spec = spec['inner']
+    if spec['kind'] == 'string':
+        return np.array(values, dtype='O')
+    elif spec['kind'] == 'fixed':
+        return np.array(values, dtype=spec['dtype'])
+    return np.frombuffer(b''.join(values), dtype=spec['dtype'])
+
+
+def decode_row_binary(body, server_tz=None):
+    """decode a RowBinaryWithNamesAndTypes format body into a DataFrame"""
+    if not body:
+        return pd.DataFrame()
+    n_cols, pos = _read_varuint(body, 0)
+    names, types = [], []
+    for _ in range(n_cols):
+        name, pos = _read_string(body, pos)
+        names.append(name)
+    for _ in range(n_cols):
+        type_str, pos = _read_string(body, pos)
+        types.append(type_str)
+    specs = [parse_type(i) for i in types]
+    if all(i['kind'] not in ('nullable', 'string') for i in specs):
+        # all columns are fixed width, the rows form a packed structured array
+        dtype = np.dtype([('f' + str(i), spec['dtype']) for i, spec in enumerate(specs)])
+        records = np.frombuffer(body, dtype=dtype, count=(len(body) - pos) // max(dtype.itemsize, 1), offset=pos)
+        columns = [[np.ascontiguousarray(records['f' + str(i)])] for i in range(n_cols)]
+        return _build_frame(names, specs, columns, [[] for _ in range(n_cols)], server_tz)
+    readers = [_gen_row_reader(i) for i in specs]
+    values, nulls = [[] for _ in range(n_cols)], [[] for _ in range(n_cols)]
+    while pos < len(body):
+        for i, reader in enumerate(readers):
+            value, is_null, pos = reader(body, pos)
+            values[i].append(value)
+            nulls[i].append(is_null)
+    columns = [[_row_values(values[i], spec)] for i, spec in enumerate(specs)]
+    masks = [[np.array(nulls[i], dtype=bool)] for i in range(n_cols)]
+    return _build_frame(names, specs, columns, masks, server_tz)
+
+
+def decode_arrow(body, server_tz=None):
+    """decode an ArrowStream format body into a DataFrame, requires pyarrow"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('ArrowStream format requires pyarrow, use Native or RowBinaryWithNamesAndTypes instead')
+    if not body:
+        return pd.DataFrame()
+    frame = pa.ipc.open_stream(body).read_all().to_pandas()
+    for col in frame.columns:
+        if (frame[col].dtype == np.dtype('O')) and frame[col].map(lambda x: isinstance(x, bytes)).any():
+            frame[col] = frame[col].map(lambda x: x.decode('utf-8', 'replace') if isinstance(x, bytes) else x)
+    return frame
+
+
+_DECODERS = {'Native': decode_native, 'RowBinaryWithNamesAndTypes': decode_row_binary, 'ArrowStream': decode_arrow}
+
+
+def decode_frame(body, fmt='Native', server_tz=None):
+    """
+    decode a response body of a binary format into a DataFrame
+    :param body: bytes, decompressed response body
+    :param fmt: one of BINARY_FORMATS
+    :param server_tz: time zone of the server (X-ClickHouse-Timezone header), used for DateTime columns without time zone
+    """
+    if fmt not in _DECODERS:
+        raise ValueError('"{0}" is not a binary format, it should be one of the following: {1}'.format(
+            fmt, ', '.join(BINARY_FORMATS)))
+    return _DECODERS[fmt](body, server_tz)
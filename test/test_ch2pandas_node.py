@@ -0,0 +1,105 @@
+# coding=utf-8
+import gzip
+import http.server
+import json
+import struct
+import threading
+import unittest
+
+import pandas as pd
+
+from QuantNodes.factor_table import _Factors
+from QuantNodes.utils_node.ch2pandas_node import CHBase
+from test.test_ch_binary import NATIVE_BLOCK_1, NATIVE_BLOCK_2
+
+# a Native block with an Array(String) column, which the binary decoders do not support
+ARRAY_BLOCK = (b'\x01\x02' b'\x05codes' b'\x0dArray(String)'
+               b'\x02\x00\x00\x00\x00\x00\x00\x00' b'\x02\x00\x00\x00\x00\x00\x00\x00' b'\x02SH' b'\x02SZ')
+
+# a Native block of a factor sub-query: cik_dt DateTime, cik_iid String, f Float64, 3 rows
+FACTOR_BLOCK = (b'\x03\x03'
+                b'\x06cik_dt' b'\x08DateTime' + struct.pack('<3I', 1577836800, 1577836800, 1577923200) +
+                b'\x07cik_iid' b'\x06String' b'\x01a' b'\x01b' b'\x01a' +
+                b'\x01f' b'\x07Float64' + struct.pack('<3d', 1.0, 2.0, 3.0))
+
+
+class _FixtureHandler(http.server.BaseHTTPRequestHandler):
+    """answers the queries with gzip compressed fixture bodies over keep-alive connections"""
+    protocol_version = 'HTTP/1.1'
+    body = gzip.compress((NATIVE_BLOCK_1 + NATIVE_BLOCK_2) * 50)
+    connections = []
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        query = gzip.decompress(self.rfile.read(int(self.headers['Content-Length']))).decode()
+        if query.endswith('format JSONCompact'):
+            body = gzip.compress(json.dumps({'meta': [{'name': 'codes', 'type': 'Array(String)'}],
+                                             'data': [[['SH', 'SZ']], [[]]]}).encode())
+        elif 'groupArray' in query:
+            body = gzip.compress(ARRAY_BLOCK)
+        elif 'cik_dt' in query:
+            body = gzip.compress(FACTOR_BLOCK)
+        else:
+            body = self.body
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('X-ClickHouse-Timezone', 'UTC')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MyTestCaseCHBase(unittest.TestCase):
+    def setUp(self):
+        _FixtureHandler.connections = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.ch = CHBase('test', host='127.0.0.1', port=self.server.server_address[1])
+
+    def tearDown(self):
+        self.ch.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive_and_streaming(self):
+        frames = [self.ch.get('select 1') for _ in range(3)]
+        self.assertEqual(len(_FixtureHandler.connections), 1)
+        self.assertEqual(frames[0].shape, (100, 4))
+        batches = list(self.ch.get_iter('select 1', batch_rows=30))
+        self.assertListEqual([len(i) for i in batches], [30, 30, 30, 10])
+        pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), frames[0])
+        self.assertEqual(len(_FixtureHandler.connections), 1)
+
+    def test_unsupported_types_fall_back_to_json(self):
+        expected = pd.DataFrame({'codes': [['SH', 'SZ'], []]})
+        pd.testing.assert_frame_equal(self.ch.get('select groupArray(code) as codes from t'), expected)
+        batches = list(self.ch.get_iter('select groupArray(code) as codes from t', batch_rows=1))
+        self.assertListEqual([len(i) for i in batches], [1, 1])
+        pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), expected)
+
+    def test_fetch_iter_streams_batches(self):
+        factors = _Factors([_Factors.add_factor('db.t', 'f', cik_dt='dt', cik_iid='code')])
+        batches = list(factors.fetch_iter(self.ch, "cik_dt >= '2020-01-01'", '1', batch_rows=2))
+        self.assertListEqual([len(i) for i in batches], [2, 1])
+        fetched = pd.concat(batches)
+        self.assertListEqual(fetched.index.names, ['cik_dt', 'cik_iid'])
+        self.assertListEqual(fetched['f'].tolist(), [1.0, 2.0, 3.0])
+        self.assertListEqual(fetched.index.get_level_values('cik_iid').tolist(), ['a', 'b', 'a'])
+
+    def test_insert_is_sent_on_a_new_connection(self):
+        # an insert is never resent, so it does not go out on an idle connection the server may have closed
+        self.ch.get('select 1')
+        self.ch.insert_query('insert into t format JSONEachRow {"x": 1}')
+        self.assertEqual(len(_FixtureHandler.connections), 2)
+        self.ch.get('select 1')
+        self.assertEqual(len(_FixtureHandler.connections), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.utils_node.ch_binary import decode_frame, NativeStreamDecoder
+
+# SELECT code, dt, v, n FROM t FORMAT Native, two blocks of one row each
+# code String, dt DateTime('Asia/Shanghai'), v Nullable(Float64), n Int32
+NATIVE_BLOCK_1 = (b'\x04\x01'
+                  b'\x04code' b'\x06String' b'\x09000001.SZ'
+                  b'\x02dt' b'\x19DateTime(\'Asia/Shanghai\')' b'\x00\xe1\x0b\x5e'
+                  b'\x01v' b'\x11Nullable(Float64)' b'\x00' b'\x00\x00\x00\x00\x00\x00\xf8\x3f'
+                  b'\x01n' b'\x05Int32' b'\xff\xff\xff\xff')
+NATIVE_BLOCK_2 = (b'\x04\x01'
+                  b'\x04code' b'\x06String' b'\x02SH'
+                  b'\x02dt' b'\x19DateTime(\'Asia/Shanghai\')' b'\x80\x32\x0d\x5e'
+                  b'\x01v' b'\x11Nullable(Float64)' b'\x01' b'\x00\x00\x00\x00\x00\x00\x00\x00'
+                  b'\x01n' b'\x05Int32' b'\x02\x00\x00\x00')
+
+# the same data as RowBinaryWithNamesAndTypes
+ROW_BINARY = (b'\x04' b'\x04code' b'\x02dt' b'\x01v' b'\x01n'
+              b'\x06String' b'\x19DateTime(\'Asia/Shanghai\')' b'\x11Nullable(Float64)' b'\x05Int32'
+              b'\x09000001.SZ' b'\x00\xe1\x0b\x5e' b'\x00' b'\x00\x00\x00\x00\x00\x00\xf8\x3f' b'\xff\xff\xff\xff'
+              b'\x02SH' b'\x80\x32\x0d\x5e' b'\x01' b'\x02\x00\x00\x00')
+
+# SELECT d, x FROM t FORMAT RowBinaryWithNamesAndTypes, d Date, x Float32
+ROW_BINARY_FIXED = (b'\x02' b'\x01d' b'\x01x' b'\x04Date' b'\x07Float32'
+                    b'\xf4\x46' b'\x00\x00\x20\x40'
+                    b'\xf5\x46' b'\x00\x00\xc0\xbf')
+
+
+class MyTestCaseCHBinary(unittest.TestCase):
+    def setUp(self):
+        self.expected = pd.DataFrame({'code': ['000001.SZ', 'SH'],
+                                      'dt': pd.to_datetime(['2020-01-01 08:00:00', '2020-01-02 08:00:00']).astype('datetime64[ns]'),
+                                      'v': [1.5, np.nan], 'n': np.array([-1, 2], dtype=np.int32)})
+
+    def test_native_blocks(self):
+        frame = decode_frame(NATIVE_BLOCK_1 + NATIVE_BLOCK_2, 'Native')
+        pd.testing.assert_frame_equal(frame, self.expected, check_index_type=False)
+        # strings of the same length are decoded by the fixed width path
+        self.assertListEqual(decode_frame(NATIVE_BLOCK_1 + NATIVE_BLOCK_1, 'Native')['code'].tolist(), ['000001.SZ'] * 2)
+
+    def test_row_binary(self):
+        frame = decode_frame(ROW_BINARY, 'RowBinaryWithNamesAndTypes')
+        pd.testing.assert_frame_equal(frame, self.expected, check_index_type=False)
+        frame = decode_frame(ROW_BINARY_FIXED, 'RowBinaryWithNamesAndTypes')
+        self.assertListEqual(frame['d'].tolist(), [pd.Timestamp('2019-09-25'), pd.Timestamp('2019-09-26')])
+        np.testing.assert_array_equal(frame['x'].values, np.array([2.5, -1.5], dtype=np.float32))
+
+
+    def test_native_stream(self):
+        body = NATIVE_BLOCK_1 + NATIVE_BLOCK_2 + NATIVE_BLOCK_1
+        for batch_rows, sizes in ((2, [2, 1]), (None, [1, 1, 1])):
+            decoder, frames = NativeStreamDecoder(batch_rows=batch_rows), []
+            for i in range(0, len(body), 7):
+                frames.extend(decoder.feed(body[i:i + 7]))
+            frames.extend(decoder.close())
+            self.assertListEqual([len(i) for i in frames], sizes)
+            pd.testing.assert_frame_equal(pd.concat(frames, ignore_index=True), decode_frame(body, 'Native'))
+        decoder = NativeStreamDecoder()
+        decoder.feed(NATIVE_BLOCK_1[:-1])
+        self.assertRaises(ValueError, decoder.close)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node import ExpandingKernel
+
+
+class MyTestCaseExpandingKernel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = rng.standard_normal((80, 6))
+        self.x[rng.random(self.x.shape) < 0.2] = np.nan
+        self.x[:10, 0] = np.nan
+        self.y = rng.standard_normal((80, 6))
+        self.y[rng.random(self.y.shape) < 0.2] = np.nan
+
+    def _resumed(self, fun, n):
+        Rslt1, State = fun(slice(None, n), None)
+        Rslt2, _ = fun(slice(n, None), State)
+        return np.r_[Rslt1, Rslt2]
+
+    def test_expanding_matches_pandas_and_resumes(self):
+        Expanding = pd.DataFrame(self.x).expanding(min_periods=3)
+        for how in ExpandingKernel.EXPANDING_STATS:
+            Rslt = ExpandingKernel.expanding(self.x, how, min_periods=3)[0]
+            np.testing.assert_allclose(Rslt, getattr(Expanding, how)().values, err_msg=how)
+            Resumed = self._resumed(lambda s, state: ExpandingKernel.expanding(self.x[s], how, state=state, min_periods=3), 33)
+            np.testing.assert_allclose(Resumed, Rslt, err_msg=how)
+        for how in ("cov", "corr"):
+            Rslt = ExpandingKernel.expandingCov(self.x, self.y, how, min_periods=3)[0]
+            np.testing.assert_allclose(Rslt, getattr(Expanding, how)(pd.DataFrame(self.y)).values, err_msg=how)
+
+    def test_ewm_matches_pandas_and_resumes(self):
+        Alpha = ExpandingKernel.genEWMAlpha(span=10)
+        for adjust in (True, False):
+            for ignore_na in (True, False):
+                EWM = pd.DataFrame(self.x).ewm(span=10, min_periods=2, adjust=adjust, ignore_na=ignore_na)
+                for how in ExpandingKernel.EWM_STATS:
+                    Kwargs = {"min_periods": 2, "adjust": adjust, "ignore_na": ignore_na}
+                    Rslt = ExpandingKernel.ewm(self.x, Alpha, how, data2=self.y, **Kwargs)[0]
+                    Expected = (getattr(EWM, how)(pd.DataFrame(self.y)) if how in ("cov", "corr") else getattr(EWM, how)())
+                    np.testing.assert_allclose(Rslt, Expected.values, err_msg=how)
+                    Resumed = self._resumed(lambda s, state: ExpandingKernel.ewm(self.x[s], Alpha, how, state=state, data2=self.y[s],
+                                                                                 **Kwargs), 41)
+                    np.testing.assert_allclose(Resumed, Rslt, err_msg=how)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+import datetime as dt
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node.FactorCache import openCacheFile, isCacheFile, detectCacheFormat, readCacheData
+from QuantNodes.factor_node.FactorDType import genStdFrame
+
+
+class MyTestCaseFactorCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name + '/cache'
+        self.dts = [dt.datetime(2020, 1, i) for i in range(1, 6)]
+        self.ids = ['000001.SZ', '000002.SZ', '600000.SH', '600004.SH']
+        self.data = pd.DataFrame(np.arange(20.0).reshape(5, 4), index=self.dts, columns=self.ids)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_block_roundtrip(self):
+        with openCacheFile(self.path, 'c', 'mmap') as f:
+            f['StdData'] = self.data
+            f['_QS_IDs'] = self.ids
+        self.assertTrue(isCacheFile(self.path, 'mmap'))
+        self.assertEqual(detectCacheFormat(self.path, 'shelve'), 'mmap')
+        with openCacheFile(self.path, 'r', 'mmap') as f:
+            pd.testing.assert_frame_equal(f['StdData'], self.data)
+            self.assertListEqual(f['_QS_IDs'], self.ids)
+
+    def test_slice_is_view(self):
+        with openCacheFile(self.path, 'c', 'mmap') as f:
+            f['StdData'] = self.data
+        with openCacheFile(self.path, 'r', 'mmap') as f:
+            arr = f.readArray('StdData', dts=self.dts[1:3], ids=self.ids[1:3])
+            self.assertIsInstance(arr.base, np.memmap)
+            np.testing.assert_array_equal(arr, self.data.values[1:3, 1:3])
+            sub = readCacheData(f, 'StdData', dts=[self.dts[4], self.dts[0]], ids=[self.ids[3]])
+            np.testing.assert_array_equal(sub.values.ravel(), [19.0, 3.0])
+
+    def test_object_dictionary_encoded(self):
+        obj = pd.DataFrame([['a', None, 'b', 'a']] * 5, index=self.dts, columns=self.ids)
+        with openCacheFile(self.path, 'c', 'mmap') as f:
+            f['StdData'] = obj
+        with openCacheFile(self.path, 'r', 'mmap') as f:
+            res = f['StdData']
+        self.assertListEqual(res.iloc[0].tolist(), ['a', None, 'b', 'a'])
+
+    def test_columnar_raw_data(self):
+        raw = pd.DataFrame({'ID': ['a', 'b', 'c'], 'date': pd.to_datetime(['2020-01-01'] * 3), 'v': [1.0, np.nan, 3.0]})
+        with openCacheFile(self.path, 'c', 'mmap') as f:
+            f['RawData'] = raw
+        with openCacheFile(self.path, 'r', 'mmap') as f:
+            res = f['RawData']
+        self.assertListEqual(res['ID'].tolist(), ['a', 'b', 'c'])
+        np.testing.assert_array_equal(res['v'].values, raw['v'].values)
+
+    def test_category_and_record_blocks(self):
+        cat = genStdFrame(np.array([['a', None, 'b', 'a']] * 5, dtype='O'), self.dts, self.ids, 'category')
+        self.assertEqual(len(set(cat.dtypes)), 1)
+        dtype = [('alpha', 'f8'), ('beta', 'f8')]
+        rec = np.full((5, 4), np.nan, dtype=dtype)
+        rec['alpha'], rec['beta'] = self.data.values, -self.data.values
+        rec = genStdFrame(rec, self.dts, self.ids, 'record', dtype=dtype)
+        with openCacheFile(self.path, 'c', 'mmap') as f:
+            f['Category'], f['Record'] = cat, rec
+        with openCacheFile(self.path, 'r', 'mmap') as f:
+            res = readCacheData(f, 'Category', dts=self.dts[1:3], ids=self.ids[:2])
+            self.assertIsInstance(res.dtypes.iloc[0], pd.CategoricalDtype)
+            self.assertListEqual(res.iloc[0].tolist()[:1], ['a'])
+            self.assertTrue(pd.isnull(res.iloc[0, 1]))
+            self.assertEqual(f.readArray('Category', decode=False).dtype, np.int32)
+            arr = f.readArray('Record', ids=self.ids[2:])
+            np.testing.assert_array_equal(arr['beta'], -self.data.values[:, 2:])
+            res = readCacheData(f, 'Record', dts=self.dts[:1])
+            self.assertEqual(res.iloc[0, 1], (1.0, -1.0))
+            self.assertEqual(res.attrs['dtype'], rec.attrs['dtype'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+
+from QuantNodes.factor_node.FactorCompiler import compileExpr, evalExpr
+
+
+def _scale(f, idt, iid, x, args):
+    return x[0] * args["k"]
+
+
+class MyTestCaseFactorCompiler(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.x = [np.random.rand(5, 4) for _ in range(4)]
+        self.x[3][0, 0] = 0
+
+    def test_fused_chain(self):
+        # (a + b) * c / d, 参数结构与运算符重载生成的一致
+        ab = compileExpr({"SepInd": 1, "OperatorType": "add"})
+        abc = compileExpr({"Fun1": evalExpr, "Arg1": ab, "SepInd": 2, "OperatorType": "mul"})
+        abcd = compileExpr({"Fun1": evalExpr, "Arg1": abc, "SepInd": 3, "OperatorType": "div"})
+        d = self.x[3].copy()
+        rslt = evalExpr(None, None, None, self.x, abcd)
+        expected = (self.x[0] + self.x[1]) * self.x[2] / np.where(d == 0, np.nan, d)
+        np.testing.assert_allclose(rslt, expected)
+        np.testing.assert_array_equal(self.x[3], d)  # 不修改描述子数据
+        self.assertEqual(abcd["Kernel"][0].count("_F["), 0)
+
+    def test_scalar_and_opaque_operator(self):
+        neg = compileExpr({"Fun": _scale, "Arg": {"k": 2}, "OperatorType": "neg"})
+        rsub = compileExpr({"Fun2": evalExpr, "Arg2": neg, "SepInd": 0, "Data1": 1.0, "OperatorType": "sub"})
+        np.testing.assert_allclose(evalExpr(None, None, None, self.x[:1], rsub), 1 + 2 * self.x[0])
+        pow_ = compileExpr({"SepInd": 1, "Data2": -1, "OperatorType": "pow"})
+        self.assertTrue(np.isnan(evalExpr(None, None, None, [np.array([0.0, 2.0])], pow_)[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# coding=utf-8
+import threading
+import unittest
+import uuid
+
+import numpy as np
+
+from QuantNodes.factor_node.FactorGraph import FactorHasher, FactorFingerprint, genFactorDeps, sortFactorDAG, pruneFactorDAG, \
+    runFactorDAG
+
+
+def _rolling_mean(f, idt, iid, x, args):
+    return x[0]
+
+
+class _FT(object):
+    Name, FactorDB = 'ft', None
+
+    def __init__(self, version=1):
+        self.Version = version
+
+    def getMetaData(self, key=None, args={}):
+        return (self.Version if key == "Version" else None)
+
+
+def _genWindowOperator(w):
+    def _operator(f, idt, iid, x, args):
+        return x[0] * w
+    return _operator
+
+
+class _Factor(object):
+    def __init__(self, name, descriptors=(), ft=None, args=None):
+        self.Name = name
+        self._NameInFT = name
+        self.FactorTable = ft
+        self.Descriptors = list(descriptors)
+        self.Args = (args or {})
+        if descriptors: self.Operator = args.get("算子")
+
+
+class MyTestCaseFactorGraph(unittest.TestCase):
+    def setUp(self):
+        self.ft = _FT()
+        self.close = _Factor('close', ft=self.ft, args={'回溯天数': 0})
+
+    def _rolling(self, window):
+        return _Factor(str(uuid.uuid1()), [self.close], args={'算子': _rolling_mean, '参数': {'window': window}})
+
+    def test_identical_subtrees_share_key(self):
+        hasher = FactorHasher()
+        close2 = _Factor('close', ft=self.ft, args={'回溯天数': 0})
+        self.assertEqual(hasher.genKey(self.close), hasher.genKey(close2))
+        self.assertEqual(hasher.genKey(self._rolling(20)), hasher.genKey(self._rolling(20)))
+        self.assertNotEqual(hasher.genKey(self._rolling(20)), hasher.genKey(self._rolling(10)))
+
+    def test_array_args(self):
+        hasher = FactorHasher()
+        a = _Factor('a', [self.close], args={'算子': _rolling_mean, '参数': {'w': np.arange(3.0)}})
+        b = _Factor('b', [self.close], args={'算子': _rolling_mean, '参数': {'w': np.arange(3.0)}})
+        c = _Factor('c', [self.close], args={'算子': _rolling_mean, '参数': {'w': np.ones(3)}})
+        self.assertEqual(hasher.genKey(a), hasher.genKey(b))
+        self.assertNotEqual(hasher.genKey(a), hasher.genKey(c))
+
+    def test_fingerprint_is_stable(self):
+        fp1, fp2 = FactorFingerprint(), FactorFingerprint()
+        self.assertEqual(fp1.genFingerprint(self._rolling(20)), fp2.genFingerprint(self._rolling(20)))
+        self.assertNotEqual(fp1.genFingerprint(self._rolling(20)), fp1.genFingerprint(self._rolling(10)))
+        obj = _Factor('obj', [self.close], args={'算子': _rolling_mean, '参数': {'w': object()}})
+        self.assertIsNone(fp1.genFingerprint(obj))
+        # 没有版本的因子表中的因子不能缓存
+        self.assertIsNone(FactorFingerprint().genFingerprint(_Factor('close', ft=_FT(None))))
+
+    def test_fingerprint_of_closures(self):
+        fp = FactorFingerprint()
+        f2, f3, f3_ = (_Factor(str(uuid.uuid1()), [self.close], args={'算子': _genWindowOperator(w)}) for w in (2, 3, 3))
+        self.assertNotEqual(fp.genFingerprint(f2), fp.genFingerprint(f3))
+        self.assertEqual(fp.genFingerprint(f3), fp.genFingerprint(f3_))
+        g2, g3 = (_Factor(str(uuid.uuid1()), [self.close], args={'算子': eval("lambda f, idt, iid, x, args, w=%d: x[0] * w" % w)})
+                  for w in (2, 3))
+        self.assertNotEqual(fp.genFingerprint(g2), fp.genFingerprint(g3))
+
+    def test_prune_cache_hits(self):
+        deps = {'close': [], 'a': ['close'], 'b': ['a'], 's': ['close'], 'c': ['b', 's']}
+        # b 命中缓存, 不需要计算 a; 同步节点 s 总是保留
+        pruned = pruneFactorDAG(deps, ['b', 'c'], lambda node: node == 'b', keep=['s'])
+        self.assertDictEqual(pruned, {'close': [], 's': ['close'], 'b': [], 'c': ['b', 's']})
+        self.assertDictEqual(pruneFactorDAG(deps, ['c'], lambda node: False), deps)
+
+    def test_topological_order(self):
+        a, b = self._rolling(20), self._rolling(10)
+        c = _Factor('c', [a, b], args={'算子': _rolling_mean})
+        deps = genFactorDeps({'c': c, a.Name: a, b.Name: b, 'close': self.close})
+        self.assertListEqual(sorted(deps['c']), sorted([a.Name, b.Name]))
+        self.assertListEqual(sortFactorDAG(deps), ['close', a.Name, b.Name, 'c'])
+
+    def test_deps_of_merged_descriptors(self):
+        # 结构相同的描述子合并后, 依赖取运算描述子, 因子的 Descriptors 保持不变
+        a, a2 = self._rolling(20), self._rolling(20)
+        c = _Factor('c', (a, a2), args={'算子': _rolling_mean})
+        c._QS_Descriptors = [a, a]
+        deps = genFactorDeps({'c': c, a.Name: a, 'close': self.close})
+        self.assertListEqual(deps['c'], [a.Name, a.Name])
+        self.assertListEqual(c.Descriptors, [a, a2])
+
+    def test_barrier_overlaps_independent_nodes(self):
+        deps = {'close': [], 'a': ['close'], 's1': ['a'], 'b': ['close'], 's2': ['b'], 'out': ['s1', 's2']}
+        b_done, finished = threading.Event(), []
+
+        def run(node):
+            # 同步节点 s1 等待期间, 与其无关的 b 仍然能够计算
+            if node == 's1': self.assertTrue(b_done.wait(5))
+            if node == 'b': b_done.set()
+            finished.append(node)
+
+        order = runFactorDAG(deps, run, barriers=['s2', 's1'], thread_num=2)
+        self.assertListEqual(sorted(order), sorted(finished))
+        self.assertLess(order.index('b'), order.index('s1'))
+        self.assertLess(order.index('s1'), order.index('s2'))
+        self.assertEqual(order[-1], 'out')
+
+    def test_single_thread_runs_in_caller(self):
+        deps = {'close': [], 'a': ['close'], 's1': ['a'], 'out': ['s1']}
+        threads = set()
+        order = runFactorDAG(deps, lambda node: threads.add(threading.get_ident()), barriers=['s1'], thread_num=1)
+        self.assertListEqual(order, ['close', 'a', 's1', 'out'])
+        self.assertSetEqual(threads, {threading.get_ident()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding=utf-8
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node.FactorPanel import FactorPanel
+
+
+class MyTestCaseFactorPanel(unittest.TestCase):
+    def setUp(self):
+        self.dts = [dt.datetime(2020, 1, i) for i in range(1, 5)]
+        self.ids = ['000001.SZ', '000002.SZ', '600000.SH']
+        self.f1 = pd.DataFrame(np.arange(12.0).reshape(4, 3), index=self.dts, columns=self.ids)
+        self.f2 = self.f1 * 10
+        self.panel = FactorPanel({'f1': self.f1, 'f2': self.f2})
+
+    def test_construct_and_getitem(self):
+        self.assertEqual(self.panel.shape, (2, 4, 3))
+        pd.testing.assert_frame_equal(self.panel['f2'], self.f2, check_freq=False)
+        self.assertTrue(np.shares_memory(self.panel['f1'].values, self.panel.values))
+
+    def test_loc_reduces_like_panel(self):
+        section = self.panel.loc[:, self.dts[1], :]
+        self.assertListEqual(section.index.tolist(), self.ids)
+        self.assertListEqual(section.columns.tolist(), ['f1', 'f2'])
+        id_data = self.panel.iloc[:, :, 0]
+        np.testing.assert_array_equal(id_data['f2'].values, self.f2.iloc[:, 0].values)
+        sub = self.panel.loc[['f2'], self.dts[1:3], self.ids[:2]]
+        self.assertTrue(np.shares_memory(sub.values, self.panel.values))
+
+    def test_missing_labels_and_join(self):
+        sub = self.panel.loc[['f1', 'f3'], self.dts, self.ids + ['600004.SH']]
+        self.assertTrue(np.isnan(sub.values[1]).all())
+        self.assertTrue(np.isnan(sub.values[0, :, 3]).all())
+        other = FactorPanel({'f3': self.f1.iloc[:2]})
+        joined = self.panel.join(other).loc[['f3', 'f1']]
+        self.assertListEqual(joined.items.tolist(), ['f3', 'f1'])
+        self.assertTrue(np.isnan(joined['f3'].values[2:]).all())
+
+    def test_setitem_and_swapaxes(self):
+        self.panel.iloc[:, 1:, :] = self.panel.iloc[:, :-1, :].values
+        self.panel.iloc[:, :1, :] = None
+        np.testing.assert_array_equal(self.panel['f1'].values[1:], self.f1.values[:-1])
+        swapped = self.panel.swapaxes(0, 2)
+        self.assertListEqual(swapped.items.tolist(), self.ids)
+        np.testing.assert_array_equal(swapped.loc[:, :, 'f2'].values, self.panel['f2'].values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_table.merge import plan_join, sorted_merge
+
+
+class MyTestCaseSortedMerge(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.frames = []
+        for k, n_iid in enumerate((5, 5, 400)):
+            df = pd.DataFrame({'cik_dt': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 20, 300), 'D'),
+                               'cik_iid': rng.integers(0, n_iid, 300).astype(str), 'f%d' % k: rng.standard_normal(300)})
+            self.frames.append(df.drop_duplicates(['cik_dt', 'cik_iid']))
+
+    def test_matches_concat(self):
+        # the first two frames share a dense key space, the third makes it sparse
+        for frames in (self.frames[:2], self.frames):
+            expected = pd.concat([i.set_index(['cik_dt', 'cik_iid']) for i in frames], axis=1).sort_index()
+            pd.testing.assert_frame_equal(sorted_merge(frames), expected, check_index_type=False)
+
+    def test_duplicated_keys(self):
+        # like the all full join of the server, duplicated keys get every combination of the rows
+        a = pd.DataFrame({'cik_dt': pd.to_datetime(['2020-01-01'] * 3 + ['2020-01-02']), 'cik_iid': ['a', 'a', 'b', 'a'],
+                          'x': [1.0, 2.0, 3.0, 4.0]})
+        b = pd.DataFrame({'cik_dt': pd.to_datetime(['2020-01-01'] * 2 + ['2020-01-03']), 'cik_iid': ['a', 'a', 'a'],
+                          'y': [10.0, 20.0, 30.0]})
+        merged = sorted_merge([a, b])
+        self.assertListEqual(merged.loc[(pd.Timestamp('2020-01-01'), 'a')].values.tolist(),
+                             [[1.0, 10.0], [1.0, 20.0], [2.0, 10.0], [2.0, 20.0]])
+        expected = pd.merge(a, b, on=['cik_dt', 'cik_iid'], how='outer').sort_values(['cik_dt', 'cik_iid', 'x', 'y'])
+        pd.testing.assert_frame_equal(merged.reset_index(), expected.reset_index(drop=True))
+
+    def test_plan_join(self):
+        self.assertEqual(plan_join([10, 20], max_server_join_rows=100), 'server')
+        self.assertEqual(plan_join([80, 40], max_server_join_rows=100), 'client')
+        self.assertEqual(plan_join([500], max_server_join_rows=100), 'server')
+
+
+if __name__ == '__main__':
+    unittest.main()
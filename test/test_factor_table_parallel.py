@@ -0,0 +1,67 @@
+# coding=utf-8
+import threading
+import time
+import unittest
+
+from QuantNodes.factor_table.parallel import map_query, ThreadLocalQuery
+
+
+class _SlowQuery(object):
+    """answers sql with itself after a delay, recording how many queries run at the same time"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.lock = threading.Lock()
+        self.active = self.max_active = self.started = 0
+
+    def __call__(self, sql):
+        with self.lock:
+            self.started += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delays.get(sql, 0.02))
+        with self.lock:
+            self.active -= 1
+        return sql
+
+
+class MyTestCaseMapQuery(unittest.TestCase):
+    def test_order_and_concurrency(self):
+        sql_list = ['q%d' % i for i in range(8)]
+        # the first queries are the slowest, results still come back in the order of the queries
+        query = _SlowQuery({sql: 0.08 - 0.01 * i for i, sql in enumerate(sql_list)})
+        self.assertListEqual(list(map_query(query, sql_list, concurrency=3)), sql_list)
+        self.assertEqual(query.max_active, 3)
+        query = _SlowQuery({})
+        self.assertListEqual(list(map_query(query, sql_list, concurrency=1)), sql_list)
+        self.assertEqual(query.max_active, 1)
+
+    def test_close_cancels_pending_queries(self):
+        query = _SlowQuery({})
+        results = map_query(query, ['q%d' % i for i in range(20)], concurrency=2)
+        self.assertEqual(next(results), 'q0')
+        results.close()
+        time.sleep(0.1)
+        self.assertLess(query.started, 20)
+        self.assertEqual(query.active, 0)
+
+    def test_thread_local_query(self):
+        nodes = []
+
+        def create_node():
+            node = _SlowQuery({})
+            nodes.append(node)
+            return node
+
+        query = ThreadLocalQuery(create_node)
+        self.assertListEqual(list(map_query(query, ['q%d' % i for i in range(6)], concurrency=2)),
+                             ['q%d' % i for i in range(6)])
+        # every worker thread has its own connector, which never runs two queries at the same time
+        self.assertLessEqual(len(nodes), 2)
+        self.assertTrue(all(node.max_active == 1 for node in nodes))
+        self.assertEqual(sum(node.started for node in nodes), 6)
+        self.assertEqual(query.delays, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
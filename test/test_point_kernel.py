@@ -0,0 +1,38 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+
+from QuantNodes.factor_node import PointKernel
+from QuantNodes.factor_node.PointKernel import calcPointData, vectorizable
+
+
+def _spread(f, idt, iid, x, args):
+    return x[0] - 2 * x[1]
+
+
+class MyTestCasePointKernel(unittest.TestCase):
+    def setUp(self):
+        self.x = [np.arange(12.0).reshape(4, 3), np.ones((4, 3))]
+        self.expected = self.x[0] - 2
+
+    def test_vectorized_call(self):
+        out = np.full((4, 3), np.nan)
+        self.assertIsNone(calcPointData(_spread, None, [], [], self.x, {}, out))
+        np.testing.assert_array_equal(calcPointData(_spread, None, [], [], self.x, {}, out, mode='向量化'), self.expected)
+        out[:] = np.nan
+        np.testing.assert_array_equal(calcPointData(vectorizable(lambda f, idt, iid, x, args: x[0] - 2 * x[1]),
+                                                    None, [], [], self.x, {}, out), self.expected)
+
+    def test_numba(self):
+        out = np.full((4, 3), np.nan)
+        data = calcPointData(_spread, None, [], [], self.x, {}, out, mode='numba')
+        if PointKernel.numba is None:
+            self.assertIsNone(data)  # 没有安装 numba 时由调用方逐点计算
+        else:
+            np.testing.assert_array_equal(data, self.expected)
+        self.assertIsNone(calcPointData(_spread, None, [], [], [np.array([['a']], dtype='O')], {}, out, mode='numba'))
+
+
+if __name__ == '__main__':
+    unittest.main()
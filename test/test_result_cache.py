@@ -0,0 +1,46 @@
+# coding=utf-8
+import datetime as dt
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node.ResultCache import ResultCache, genResultKey
+
+
+class MyTestCaseResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dts = [dt.datetime(2020, 1, i) for i in range(1, 5)]
+        self.ids = ['000001.SZ', '000002.SZ', '600000.SH']
+        self.data = pd.DataFrame(np.arange(12.0).reshape(4, 3), index=self.dts, columns=self.ids)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_put_and_get_across_instances(self):
+        key = genResultKey('fingerprint', tuple(self.dts), tuple(self.ids))
+        self.assertEqual(key, genResultKey('fingerprint', tuple(self.dts), tuple(self.ids)))
+        ResultCache(self.dir.name).put(key, {'StdData': self.data, '_QS_IDs': self.ids})
+        cached = ResultCache(self.dir.name).get(key)
+        pd.testing.assert_frame_equal(cached['StdData'], self.data, check_freq=False)
+        self.assertListEqual(cached['_QS_IDs'], self.ids)
+        self.assertIsNone(ResultCache(self.dir.name).get(genResultKey('other')))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(self.dir.name, cache_format='shelve')
+        for i, key in enumerate(('a', 'b', 'c')):
+            cache.put(key, {'StdData': self.data})
+            os.utime(os.path.join(self.dir.name, key), (time.time() - 100 + i, time.time() - 100 + i))
+        self.assertIsNotNone(cache.get('a'))  # a 成为最近使用的条目
+        cache.evict(max_size=cache.Size * 2 // 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
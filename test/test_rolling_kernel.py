@@ -0,0 +1,189 @@
+# coding=utf-8
+import datetime as dt
+import threading
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node import RollingKernel
+from QuantNodes.factor_node.DTIndex import getDTIndex
+from QuantNodes.factor_node.RollingKernel import genWindows, reduceWindows
+
+
+class MyTestCaseRollingKernel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data = rng.standard_normal((30, 4))
+        self.data[rng.random((30, 4)) < 0.2] = np.nan
+        self.window = 5
+
+    def test_windows_are_views(self):
+        windows = genWindows(self.data, self.window)
+        self.assertEqual(windows.shape, (26, 5, 4))
+        self.assertTrue(np.shares_memory(windows, self.data))
+        np.testing.assert_array_equal(windows[3], self.data[3:8])
+
+    def test_reducers_match_pandas(self):
+        windows = genWindows(self.data, self.window)
+        rolling = pd.DataFrame(self.data).rolling(self.window, min_periods=3)
+        for how in ('sum', 'mean', 'std', 'min', 'max', 'count'):
+            expected = getattr(rolling, how)().values[self.window - 1:]
+            if how == 'count': expected = pd.DataFrame(self.data).rolling(self.window).count().values[self.window - 1:]
+            np.testing.assert_allclose(reduceWindows(windows, how, min_periods=(0 if how == 'count' else 3)), expected,
+                                       err_msg=how)
+        argmax = reduceWindows(windows, 'argmax', min_periods=3)
+        self.assertTrue(np.array_equal(np.isnan(argmax), np.isnan(rolling.max().values[self.window - 1:])))
+
+    def test_window_views_use_streaming_kernels(self):
+        data = self.data.copy()
+        data[10:16, 0] = np.nan  # 完全缺失的窗口
+        for window in (1, 2, self.window):
+            for data_ in (data, data[:, 1]):
+                windows = genWindows(data_, window)
+                for how in ('sum', 'mean', 'std', 'var', 'min', 'max', 'count'):
+                    for min_periods in (0, 2):
+                        # 拷贝后不再是滑动窗口视图, 按照展开的窗口计算
+                        np.testing.assert_allclose(reduceWindows(windows, how, min_periods=min_periods),
+                                                   reduceWindows(windows.copy(), how, min_periods=min_periods),
+                                                   atol=1e-12, err_msg='%s %d %d' % (how, window, min_periods))
+
+    def test_streaming_kernels_match_pandas(self):
+        data = self.data.copy()
+        data[10:13, 0] = np.nan  # 完全缺失的窗口
+        data[5, 1] = 0.0
+        frame = pd.DataFrame(data)
+        for min_periods in (1, 3):
+            rolling = frame.rolling(self.window, min_periods=min_periods)
+            for how in ('Sum', 'Mean', 'Max', 'Min'):
+                np.testing.assert_allclose(getattr(RollingKernel, 'rolling' + how)(data, self.window, min_periods),
+                                           getattr(rolling, how.lower())().values[self.window - 1:], err_msg=how)
+            for ddof in (0, 1):
+                np.testing.assert_allclose(RollingKernel.rollingStd(data, self.window, min_periods, ddof=ddof),
+                                           rolling.apply(lambda x: np.nanstd(x, ddof=ddof) if np.sum(~np.isnan(x)) > ddof else np.nan,
+                                                         raw=True).values[self.window - 1:])
+            expected = np.array([np.nanprod(data[i:i + self.window], axis=0) for i in range(len(data) - self.window + 1)])
+            expected[rolling.count().values[self.window - 1:] < min_periods] = np.nan
+            np.testing.assert_allclose(RollingKernel.rollingProd(data, self.window, min_periods), expected)
+            weights = np.arange(1.0, self.window + 1)
+            expected = rolling.apply(lambda x: (np.nansum(x * weights) / np.nansum(pd.notnull(x) * weights)
+                                              if len(x) == self.window else np.nan), raw=True)
+            np.testing.assert_allclose(RollingKernel.rollingWeightedMean(data, weights, min_periods),
+                                       expected.values[self.window - 1:])
+        np.testing.assert_array_equal(RollingKernel.rollingCount(data, self.window),
+                                      frame.rolling(self.window).count().values[self.window - 1:])
+        self.assertEqual(RollingKernel.rollingMax(data[:3], self.window).shape, (0, 4))
+
+    def test_variance_after_outlier(self):
+        np.testing.assert_allclose(RollingKernel.rollingVar(np.array([1e10, 1, 2, 3, 4, 5]), 3)[1:], [1, 1, 1])
+        # 异常值离开窗口后结果不受影响
+        data = 1e6 + np.random.default_rng(1).standard_normal(200) * 786
+        data[50] = 1e13
+        expected = np.array([np.std(data[i:i + 20], ddof=1) for i in range(len(data) - 19)])
+        np.testing.assert_allclose(RollingKernel.rollingStd(data, 20), expected, rtol=1e-9)
+
+    def test_sums_after_inf_and_level_shift(self):
+        # inf 只影响包含它的窗口
+        np.testing.assert_array_equal(RollingKernel.rollingSum(np.array([1, np.inf, 1, 2, 3, 4]), 2), [np.inf, np.inf, 3, 5, 7])
+        np.testing.assert_array_equal(RollingKernel.rollingMean(np.array([1, -np.inf, 1, 2, 3, 4]), 2),
+                                      [-np.inf, -np.inf, 1.5, 2.5, 3.5])
+        np.testing.assert_allclose(RollingKernel.rollingProd(np.array([2, np.inf, 2, 3, 4]), 2), [np.inf, np.inf, 6, 12])
+        # 数据水平大幅下降后没有残留的舍入误差
+        data = np.r_[1e9 + np.arange(50.0), 0.01 * np.arange(1, 51)]
+        expected = np.array([np.sum(data[i:i + 5]) for i in range(len(data) - 4)])
+        np.testing.assert_allclose(RollingKernel.rollingSum(data, 5)[-40:], expected[-40:], rtol=1e-12)
+        np.testing.assert_allclose(RollingKernel.rollingMean(data, 5)[-40:], expected[-40:] / 5, rtol=1e-12)
+
+    def test_rolling_regress_matches_wls(self):
+        rng = np.random.default_rng(1)
+        n, nID, window, half_life = 40, 3, 10, 5
+        x1, x2 = rng.standard_normal((n, nID)), rng.standard_normal((n, nID))
+        y = 0.5 + 2 * x1 - x2 + 0.3 * rng.standard_normal((n, nID))
+        y[rng.random((n, nID)) < 0.1] = np.nan
+        x1[:12, 2] = np.nan  # 样本不足的窗口
+        rslt, degenerate = RollingKernel.rollingRegress(y, [x1, x2], window, constant=True, half_life=half_life)
+        self.assertEqual(rslt.shape, (n - window + 1, nID))
+        self.assertEqual(rslt.dtype.names[:3], ('alpha', 'beta0', 'beta1'))
+        weight = (0.5 ** (1 / half_life)) ** np.arange(window)[::-1]
+        for i in range(n - window + 1):
+            for j in range(nID):
+                iY, iX = y[i:i + window, j], np.c_[np.ones(window), x1[i:i + window, j], x2[i:i + window, j]]
+                mask = ~(np.isnan(iY) | np.isnan(iX).any(axis=1))
+                if mask.sum() <= 3:
+                    self.assertTrue(degenerate[i, j] or (mask.sum() == 0))
+                    self.assertTrue(np.isnan(rslt[i, j]['alpha']))
+                    continue
+                sw = np.sqrt(weight[mask])
+                wX, wY = iX[mask] * sw[:, None], iY[mask] * sw
+                beta = np.linalg.lstsq(wX, wY, rcond=None)[0]
+                ssr = np.sum((wY - wX @ beta) ** 2)
+                tvalue = beta / np.sqrt(np.diag(np.linalg.inv(wX.T @ wX)) * ssr / (mask.sum() - 3))
+                tss = np.sum(weight[mask] * (iY[mask] - np.average(iY[mask], weights=weight[mask])) ** 2)
+                expected = list(beta) + list(tvalue) + [(tss - ssr) / 2 / (ssr / (mask.sum() - 3)), 1 - ssr / tss]
+                np.testing.assert_allclose(list(rslt[i, j])[:-1], expected, rtol=1e-6)
+
+    def test_rolling_regress_degeneracy_is_scale_free(self):
+        rng = np.random.default_rng(2)
+        for x in (rng.normal(0, 1e6, (60, 3)), rng.normal(1e9, 1e8, (60, 3)), rng.normal(1e3, 10, (60, 3))):
+            y = 3 + 2e-3 * x + rng.standard_normal(x.shape)
+            rslt, degenerate = RollingKernel.rollingRegress(y, [x], 20)
+            self.assertFalse(degenerate.any())
+            beta = np.linalg.lstsq(np.c_[np.ones(20), x[7:27, 1]], y[7:27, 1], rcond=None)[0]
+            np.testing.assert_allclose([rslt[7, 1]['alpha'], rslt[7, 1]['beta0']], beta, rtol=1e-6)
+        # 共线的窗口仍然交由调用方处理
+        self.assertTrue(RollingKernel.rollingRegress(y, [x, 2 * x], 20)[1].all())
+
+    def test_order_statistics_match_window_sorts(self):
+        windows = genWindows(self.data, self.window)
+        count = (~np.isnan(windows)).sum(axis=1)
+        rank = (windows < self.data[self.window - 1:, None, :]).sum(axis=1).astype(float)
+        rank = np.where(np.isnan(self.data[self.window - 1:]), count, rank)
+        rank[count < 2] = np.nan
+        np.testing.assert_allclose(RollingKernel.rollingRank(self.data, self.window, min_periods=2), rank)
+        quantile = np.nanquantile(windows, 0.3, axis=1)
+        quantile[count < 2] = np.nan
+        np.testing.assert_allclose(RollingKernel.rollingQuantile(self.data, self.window, 0.3, min_periods=2), quantile)
+        other = np.round(self.data[::-1] * 2, 0)
+        rslt = RollingKernel.spearmanCorr(self.data, other, min_periods=3)
+        for j in range(self.data.shape[1]):
+            mask = ~(np.isnan(self.data[:, j]) | np.isnan(other[:, j]))
+            expected = np.corrcoef(pd.Series(self.data[mask, j]).rank(), pd.Series(other[mask, j]).rank())[0, 1]
+            np.testing.assert_allclose(rslt[j], expected)
+
+
+    def test_index_transforms(self):
+        dts = [dt.datetime(2020, 1, 1) + dt.timedelta(i) for i in range(30)]
+        index = getDTIndex(dts)
+        self.assertIs(getDTIndex(dts), index)
+        self.assertEqual(index.index(dts[7]), 7)
+        self.assertListEqual(index.getIndexer([dts[3], dt.datetime(2021, 1, 1)]).tolist(), [3, -1])
+        self.assertListEqual(index.searchsorted([dt.datetime(2020, 1, 3, 12)]).tolist(), [3])
+        for limit in (None, 2):
+            np.testing.assert_allclose(RollingKernel.forwardFill(self.data, limit), pd.DataFrame(self.data).ffill(limit=limit).values)
+        targets = [iDT for iDT in dts if iDT.day % 7 == 0]
+        target_data = pd.DataFrame(self.data, index=dts).loc[targets].to_numpy(copy=True)
+        target_data[1:] = target_data[:-1].copy()
+        expected = pd.DataFrame(np.nan, index=dts, columns=range(4))
+        expected.loc[targets] = target_data
+        np.testing.assert_allclose(RollingKernel.lagTargets(self.data, index.getIndexer(targets), 1), expected.ffill().values)
+
+    def test_index_cache_across_threads(self):
+        # 多个线程同时查找和淘汰缓存的索引
+        rulers = [[dt.datetime(2020, 1, 1) + dt.timedelta(j) for j in range(i + 1)] for i in range(20)]
+        errors = []
+
+        def lookup(k):
+            try:
+                for i in range(500):
+                    ruler = rulers[(i * 7 + k) % len(rulers)]
+                    self.assertEqual(getDTIndex(ruler).index(ruler[-1]), len(ruler) - 1)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup, args=(k,)) for k in range(8)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertListEqual(errors, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node import SectionKernel
+
+
+class MyTestCaseSectionKernel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data = np.round(rng.standard_normal((6, 50)), 1)
+        self.data[rng.random(self.data.shape) < 0.15] = np.nan
+        self.cat = rng.integers(0, 3, self.data.shape).astype(float)
+        self.cat[0, :3] = np.nan
+        self.mask = rng.random(self.data.shape) < 0.9
+        self.x = rng.standard_normal(self.data.shape)
+        self.dummy = rng.integers(0, 4, self.data.shape)
+
+    def _iterGroups(self):
+        for i in range(self.data.shape[0]):
+            for iCat in pd.unique(self.cat[i]):
+                yield i, self.mask[i] & (np.isnan(self.cat[i]) if pd.isnull(iCat) else (self.cat[i] == iCat))
+
+    def test_grouped_standardize_matches_per_section(self):
+        zscore = SectionKernel.standardizeZScore(self.data, mask=self.mask, cat_data=self.cat)
+        rank = SectionKernel.standardizeRank(self.data, mask=self.mask, cat_data=[self.cat], ascending=False)
+        filled = SectionKernel.fillNaNByFun(self.data, mask=self.mask, cat_data=self.cat, val_fun="中位数")
+        for i, iMask in self._iterGroups():
+            x = self.data[i][iMask]
+            np.testing.assert_allclose(zscore[i][iMask], (x - np.nanmean(x)) / np.nanstd(x))
+            x = pd.Series(x)
+            np.testing.assert_allclose(rank[i][iMask], (x.rank(ascending=False, method="first") - 0.5) / x.notnull().sum())
+            np.testing.assert_allclose(filled[i][iMask], x.fillna(x.median()))
+        self.assertTrue(np.isnan(zscore[~self.mask]).all())
+        np.testing.assert_array_equal(filled[~self.mask], self.data[~self.mask])
+
+    def test_matches_data_preprocessing_fun(self):
+        # DataPreprocessingFun(QuantStudio 0.0.9) 的结果
+        x = np.array([[1, 2, 2, 3, 10, np.nan, 4, 5]], dtype=float)
+        mad = 1.483 * 1.0
+        avg = np.nanmean(x)
+        np.testing.assert_allclose(SectionKernel.standardizeZScore(x, dispersion_statistics="MAD"), (x - avg) / mad)
+        np.testing.assert_allclose(SectionKernel.standardizeZScore(x, dispersion_statistics="MAD")[0, :2], [-1.927, -1.252],
+                                   atol=1e-3)
+        np.testing.assert_allclose(SectionKernel.standardizeZScore(x, avg_statistics="中位数"), (x - 3) / np.nanstd(x))
+        np.testing.assert_allclose(SectionKernel.winsorize(x, dispersion_statistics="MAD", std_multiplier=1),
+                                   np.clip(x, avg - mad, avg + mad))
+        np.testing.assert_allclose(SectionKernel.winsorize(x, dispersion_statistics="MAD", std_multiplier=1)[0, [0, 4]],
+                                   [2.374, 5.340], atol=1e-3)
+        np.testing.assert_array_equal(SectionKernel.standardizeRank(x, uniformization=False), [[0, 1, 2, 3, 6, np.nan, 4, 5]])
+        np.testing.assert_array_equal(SectionKernel.standardizeRank(x, uniformization=False, ascending=False),
+                                      [[6, 4, 5, 3, 0, np.nan, 2, 1]])
+        np.testing.assert_allclose(SectionKernel.standardizeRank(x, offset=0.5), (np.array([[0, 1, 2, 3, 6, np.nan, 4, 5]]) + 0.5) / 7)
+        # 离散统计量为 0 的截面结果为 0
+        np.testing.assert_array_equal(SectionKernel.standardizeZScore(np.array([[2.0, 2.0, 2.0]])), [[0.0, 0.0, 0.0]])
+        np.testing.assert_array_equal(SectionKernel.standardizeZScore(np.array([[1.0, 2.0, 2.0, 2.0]]),
+                                                                      dispersion_statistics="MAD"), [[0.0] * 4])
+
+    def test_orthogonalize_matches_lstsq(self):
+        rslt = SectionKernel.orthogonalize(self.data, X=[self.x], mask=self.mask, constant=True, dummy_data=[self.dummy],
+                                           other_handle="保持不变")
+        for i in range(self.data.shape[0]):
+            design = np.c_[np.ones(self.data.shape[1]), self.x[i], np.eye(4)[self.dummy[i]]]
+            fit = self.mask[i] & ~np.isnan(self.data[i])
+            beta = np.linalg.lstsq(design[fit], self.data[i][fit], rcond=None)[0]
+            np.testing.assert_allclose(rslt[i][self.mask[i]], (self.data[i] - design @ beta)[self.mask[i]], atol=1e-10)
+            np.testing.assert_array_equal(rslt[i][~self.mask[i]], self.data[i][~self.mask[i]])
+
+    def test_aggregate_matches_masked_reductions(self):
+        ids = [0.0, 1.0, 2.0, 5.0]
+        std = lambda x: (np.nanstd(x, ddof=1) if np.sum(~np.isnan(x)) > 1 else np.nan)
+        count = lambda x: np.sum(~np.isnan(x))
+        for how, fun in (("sum", np.nansum), ("prod", np.nanprod), ("max", np.nanmax), ("median", np.nanmedian),
+                         ("std", std), ("count", count)):
+            byID = SectionKernel.aggregate(self.data, mask=self.mask, cat_data=self.cat, how=how, target_ids=ids)
+            byCell = SectionKernel.aggregate(self.data, mask=self.mask, cat_data=self.cat, how=how)
+            for i in range(self.data.shape[0]):
+                for j, jID in enumerate(ids):
+                    x = self.data[i][self.mask[i] & (self.cat[i] == jID)]
+                    expected = (fun(x) if (how in ("sum", "prod", "count")) or (~np.isnan(x)).any() else np.nan)
+                    np.testing.assert_allclose(byID[i, j], expected, err_msg=how)
+            for i, iMask in self._iterGroups():
+                x = self.data[i][iMask]
+                if (~np.isnan(x)).any(): np.testing.assert_allclose(byCell[i][iMask], fun(x), err_msg=how)
+            self.assertTrue(np.isnan(byCell[~self.mask]).all())
+        whole = SectionKernel.aggregate(self.data, how="quantile", quantile=0.3)
+        np.testing.assert_allclose(whole[:, 0], np.nanpercentile(self.data, 30, axis=1))
+        disaggregated = SectionKernel.disaggregate(byID, self.cat, ids)
+        np.testing.assert_allclose(disaggregated[self.cat == 1.0], byID[:, [1]].repeat(50, axis=1)[self.cat == 1.0])
+        self.assertTrue(np.isnan(disaggregated[np.isnan(self.cat)]).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# coding=utf-8
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from QuantNodes.factor_node.SharedCache import SharedCacheWriter, SharedCacheReader
+
+
+class MyTestCaseSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.dts = [dt.datetime(2020, 1, i) for i in range(1, 8)]
+        self.ids = ['000001.SZ', '000002.SZ', '600000.SH']
+        self.data = pd.DataFrame(np.arange(21.0).reshape(7, 3), index=self.dts, columns=self.ids)
+        self.writer = SharedCacheWriter(4)
+        self.reader = SharedCacheReader()
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_publish_and_shift(self):
+        self.writer.write('f', self.data.iloc[:4], dts=self.dts[:4])
+        cache = self.reader.load(self.writer.publish())
+        pd.testing.assert_frame_equal(cache['f'], self.data.iloc[:4], check_freq=False)
+        # 前移两个时点, 已发布的数据不受影响
+        self.writer.shift(self.dts[2:6], {'f': self.data.iloc[4:6]})
+        pd.testing.assert_frame_equal(cache['f'], self.data.iloc[:4], check_freq=False)
+        held, cache = cache['f'], self.reader.load(self.writer.publish())
+        pd.testing.assert_frame_equal(cache['f'], self.data.iloc[2:6], check_freq=False)
+        # 子进程重写之前发布的缓冲区后, 主进程仍然持有的数据不受影响
+        self.writer.shift(self.dts[3:7], {'f': self.data.iloc[6:7]})
+        cache = self.reader.load(self.writer.publish())
+        pd.testing.assert_frame_equal(cache['f'], self.data.iloc[3:7], check_freq=False)
+        pd.testing.assert_frame_equal(held, self.data.iloc[:4], check_freq=False)
+
+    def test_object_data_and_pop(self):
+        obj = pd.DataFrame('a', index=self.dts[:2], columns=self.ids)
+        self.writer.write('f', self.data.iloc[:2], dts=self.dts[:2])
+        self.writer.write('g', obj)
+        cache = self.reader.load(self.writer.publish())
+        self.assertListEqual(sorted(cache), ['f', 'g'])
+        pd.testing.assert_frame_equal(cache['g'], obj)
+        self.writer.pop('f')
+        cache = self.reader.load(self.writer.publish())
+        self.assertListEqual(list(cache), ['g'])
+
+
+if __name__ == '__main__':
+    unittest.main()